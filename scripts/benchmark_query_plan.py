@@ -0,0 +1,181 @@
+"""
+Compare the legacy results query (fan-out join + DISTINCT) with the per-experiment
+plan built by gresq.util.query_builder.results_query.
+
+A synthetic database is generated with --experiments experiments (10,000 by default),
+each with several preparation steps, Raman files/analyses and an author, and a set of
+typical filter combinations is timed against both plans.
+
+Usage:
+    python scripts/benchmark_query_plan.py [--url sqlite:////tmp/gresq_bench.db]
+                                           [--experiments 10000] [--repeat 3] [--explain]
+"""
+import argparse
+import datetime
+import random
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine, Integer, Float, Numeric, String, Date, Boolean
+from grdb.database import Base
+from grdb.database.models import (
+    Experiment,
+    Substrate,
+    EnvironmentConditions,
+    Furnace,
+    Recipe,
+    Properties,
+    Author,
+    PreparationStep,
+    RamanFile,
+    RamanAnalysis,
+)
+from gresq.util.query_builder import legacy_results_query, results_query
+
+
+def fake_value(column, rng):
+    """
+    Random value appropriate for a column's type.
+    """
+    if isinstance(column.type, Boolean):
+        return rng.random() < 0.5
+    elif isinstance(column.type, Integer):
+        return rng.randint(1, 10)
+    elif isinstance(column.type, (Float, Numeric)):
+        return round(rng.uniform(0, 1000), 3)
+    elif isinstance(column.type, Date):
+        return datetime.date(2018, 1, 1) + datetime.timedelta(days=rng.randint(0, 1500))
+    elif isinstance(column.type, String):
+        return rng.choice(["Copper", "Nickel", "Platinum", "Annealing", "Growing", "Cooling"])
+    return None
+
+
+def fake_row(model, rng, **values):
+    """
+    Fills every non-key column of a model that is not given explicitly.
+    """
+    row = {}
+    for column in model.__table__.columns:
+        if column.primary_key or column.foreign_keys:
+            continue
+        row[column.key] = fake_value(column, rng)
+    row.update(values)
+    return row
+
+
+def populate(engine, n_experiments, seed=0, steps=6, raman_files=2, analyses=2):
+    rng = random.Random(seed)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    rows = {m: [] for m in [Recipe, Substrate, Furnace, EnvironmentConditions, Author, Experiment, Properties, PreparationStep, RamanFile, RamanAnalysis]}
+    step_id = raman_file_id = analysis_id = 1
+    for i in range(1, n_experiments + 1):
+        rows[Recipe].append(fake_row(Recipe, rng, id=i))
+        rows[Substrate].append(fake_row(Substrate, rng, id=i))
+        rows[Furnace].append(fake_row(Furnace, rng, id=i))
+        rows[EnvironmentConditions].append(fake_row(EnvironmentConditions, rng, id=i))
+        rows[Author].append(fake_row(Author, rng, id=i))
+        rows[Experiment].append(
+            fake_row(
+                Experiment,
+                rng,
+                id=i,
+                recipe_id=i,
+                substrate_id=i,
+                furnace_id=i,
+                environment_conditions_id=i,
+                submitted_by=i,
+            )
+        )
+        rows[Properties].append(fake_row(Properties, rng, id=i, experiment_id=i))
+        for s in range(steps):
+            rows[PreparationStep].append(
+                fake_row(PreparationStep, rng, id=step_id, recipe_id=i, step=s)
+            )
+            step_id += 1
+        for f in range(raman_files):
+            rows[RamanFile].append(
+                fake_row(RamanFile, rng, id=raman_file_id, experiment_id=i)
+            )
+            for a in range(analyses):
+                rows[RamanAnalysis].append(
+                    fake_row(RamanAnalysis, rng, id=analysis_id, raman_file_id=raman_file_id)
+                )
+                analysis_id += 1
+            raman_file_id += 1
+
+    with engine.begin() as connection:
+        for model, values in rows.items():
+            connection.execute(model.__table__.insert(), values)
+
+
+FILTER_SETS = {
+    "validated": lambda: [Experiment.validated == True],
+    "furnace": lambda: [Furnace.tube_diameter > 500],
+    "preparation step": lambda: [PreparationStep.furnace_temperature > 900],
+    "raman": lambda: [RamanAnalysis.d_to_g < 100],
+    "author": lambda: [Author.institution == "Copper"],
+    "combined": lambda: [
+        Experiment.validated == True,
+        PreparationStep.furnace_temperature > 500,
+        RamanAnalysis.gp_to_g > 100,
+    ],
+}
+
+
+def run(engine, build, filters, repeat):
+    statement = build(filters).statement
+    best = None
+    nrows = 0
+    for _ in range(repeat):
+        with engine.connect() as connection:
+            t = time.perf_counter()
+            df = pd.read_sql_query(statement, connection)
+            elapsed = time.perf_counter() - t
+        nrows = df.shape[0]
+        best = elapsed if best is None else min(best, elapsed)
+    return best, nrows, statement
+
+
+def explain(engine, statement):
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    compiled = statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        return [str(r) for r in connection.exec_driver_sql(prefix + str(compiled))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="sqlite:////tmp/gresq_bench.db", type=str)
+    parser.add_argument("--experiments", default=10000, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--skip_populate", action="store_true", default=False)
+    parser.add_argument("--explain", action="store_true", default=False)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if not args.skip_populate:
+        t = time.perf_counter()
+        populate(engine, args.experiments)
+        print("Populated %s experiments in %.1f s" % (args.experiments, time.perf_counter() - t))
+
+    print("%-18s %12s %8s %12s %8s %8s" % ("filters", "legacy (s)", "rows", "new (s)", "rows", "speedup"))
+    for name, filters in FILTER_SETS.items():
+        legacy_time, legacy_rows, legacy_statement = run(engine, legacy_results_query, filters(), args.repeat)
+        new_time, new_rows, new_statement = run(engine, results_query, filters(), args.repeat)
+        print(
+            "%-18s %12.3f %8d %12.3f %8d %7.1fx"
+            % (name, legacy_time, legacy_rows, new_time, new_rows, legacy_time / max(new_time, 1e-9))
+        )
+        if args.explain:
+            print("  legacy plan:")
+            for line in explain(engine, legacy_statement):
+                print("    " + line)
+            print("  new plan:")
+            for line in explain(engine, new_statement):
+                print("    " + line)
+
+
+if __name__ == "__main__":
+    main()
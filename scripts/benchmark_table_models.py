@@ -0,0 +1,149 @@
+"""
+Measure the cost of painting and scrolling the results table.
+
+A synthetic table (100,000 rows x 60 columns of floats with missing values, integers,
+strings and dates by default) is written to a SQLite file and shown in an offscreen
+QTableView through PagedResultsTableModel, the model of the results tab, once as it is
+(display strings cached per block of rows) and once through a model that formats every
+cell on each repaint, as PagedResultsTableModel used to. Every page is read before the view
+is scrolled to --pages positions spread over the table and repainted at each one, so the
+times measure formatting and painting only.
+
+Usage:
+    python scripts/benchmark_table_models.py [--rows 100000] [--columns 60] [--pages 50]
+"""
+import os
+import argparse
+import datetime
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import pandas as pd
+from PyQt5 import QtCore, QtWidgets
+from sqlalchemy import create_engine, MetaData, Table
+from sqlalchemy.orm import Query
+from gresq.util.paging import PagedResultsTableModel
+
+
+class CellTableModel(PagedResultsTableModel):
+    """
+    PagedResultsTableModel formatting each cell from its page whenever it is painted.
+    """
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            values = self.row(index.row())
+            if values is None:
+                return self.placeholder
+            value = values[index.column()]
+            if value is None or value != value:
+                return ""
+            return str(value)
+        return QtCore.QVariant()
+
+
+def make_frame(rows, columns, seed=0):
+    rng = np.random.RandomState(seed)
+    data = {"id": np.arange(1, rows + 1)}
+    for c in range(columns):
+        kind = c % 4
+        if kind == 0:
+            values = rng.uniform(0, 1000, rows)
+            values[rng.rand(rows) < 0.2] = np.nan
+        elif kind == 1:
+            values = rng.randint(0, 100000, rows)
+        elif kind == 2:
+            choices = np.array(["Copper", "Nickel", "Platinum", None], dtype=object)
+            values = choices[rng.randint(0, 4, rows)]
+        else:
+            values = pd.Timestamp(datetime.date(2018, 1, 1)) + pd.to_timedelta(
+                rng.randint(0, 1500, rows), unit="D"
+            )
+        data["column_%s" % c] = values
+    return pd.DataFrame(data)
+
+
+def read_pages(app, model):
+    while True:
+        if model.canFetchMore():
+            model.fetchMore()
+        elif not model.pending:
+            return
+        app.processEvents()
+
+
+def repaint_times(app, model, pages):
+    view = QtWidgets.QTableView()
+    view.resize(1600, 900)
+    view.setModel(model)
+    view.show()
+    app.processEvents()
+
+    scrollbar = view.verticalScrollBar()
+    positions = np.linspace(0, scrollbar.maximum(), pages).astype(int)
+    times = []
+    for position in positions:
+        scrollbar.setValue(int(position))
+        t = time.perf_counter()
+        view.viewport().repaint()
+        times.append(time.perf_counter() - t)
+    # Repainting the same position again, e.g. when the window is uncovered.
+    repeat = []
+    for i in range(pages):
+        t = time.perf_counter()
+        view.viewport().repaint()
+        repeat.append(time.perf_counter() - t)
+    view.close()
+    return np.array(times), np.array(repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default=100000, type=int)
+    parser.add_argument("--columns", default=60, type=int)
+    parser.add_argument("--pages", default=50, type=int)
+    parser.add_argument("--page_size", default=500, type=int)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+    df = make_frame(args.rows, args.columns)
+    print("Table: %s rows x %s columns" % df.shape)
+
+    directory = tempfile.mkdtemp()
+    engine = create_engine("sqlite:///%s" % os.path.join(directory, "results.db"))
+    df.to_sql("results", engine, index=False)
+    results = Table("results", MetaData(), autoload_with=engine)
+    max_pages = args.rows // args.page_size + 1
+
+    print(
+        "%-12s %10s %14s %14s %14s"
+        % ("model", "load (ms)", "scroll (ms)", "p95 (ms)", "repaint (ms)")
+    )
+    for name, cls in (("per cell", CellTableModel), ("cached", PagedResultsTableModel)):
+        model = cls(
+            Query(list(results.c)),
+            bind=engine,
+            page_size=args.page_size,
+            max_pages=max_pages,
+        )
+        t = time.perf_counter()
+        read_pages(app, model)
+        load = time.perf_counter() - t
+        scroll, repeat = repaint_times(app, model, args.pages)
+        print(
+            "%-12s %10.1f %14.2f %14.2f %14.2f"
+            % (
+                name,
+                load * 1000,
+                scroll.mean() * 1000,
+                np.percentile(scroll, 95) * 1000,
+                repeat.mean() * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -37,7 +37,7 @@ from gresq.config import config
 from gresq.recipe import Recipe
 from gresq.util.box_adaptor import BoxAdaptor
 from gresq.util.mdf_adaptor import MDFAdaptor
-import urllib.request
+from gresq.util.http import default_client
 
 
 def zipdir(path, ziph):
@@ -68,12 +68,13 @@ def stage_upload(sample, sem_files=[], raman_files=[], json_name='mdf'):
     json.dump(sample, dump_file)
     dump_file.close()
 
+    client = default_client()
     for raman_file in raman_files:
         print(raman_file.url, raman_file.filename)
-        urllib.request.urlretrieve(raman_file.url, mdf_path+"/"+raman_file.filename)
+        client.download(raman_file.url, mdf_path+"/"+raman_file.filename)
     for sem_file in sem_files:
         print(sem_file.url, sem_file.filename)
-        urllib.request.urlretrieve(sem_file.url, mdf_path+"/"+sem_file.filename)
+        client.download(sem_file.url, mdf_path+"/"+sem_file.filename)
 
     box_adaptor = BoxAdaptor(box_config_path)
     upload_folder = box_adaptor.create_upload_folder()
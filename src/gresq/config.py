@@ -51,6 +51,9 @@ class Config:
             DEV_DATABASE_URL_USER2
         A single set of _ARGS can be used for multiple URLs.
         Currently suffixes are not supported for ARGS variables.
+        The local replica is configured with prefix + '_REPLICA_PATH' (the SQLite file,
+        GRESQ_CACHE_DIR/replica_<prefix>.db by default) and prefix + '_REPLICA_SYNC_SECONDS'
+        (seconds between background syncs, 300 by default).
         """
         # secrets = importlib.import_module('gresq.gresq_app_secrets','gresq')
         # secrets_found = True
@@ -119,6 +122,14 @@ class Config:
             except AttributeError:
                 self.DATABASEARGS = None
 
+        # Local SQLite replica used by run_dashboard --db_mode replica (gresq.util.replica).
+        self.REPLICA_var = prefix + "_REPLICA_PATH"
+        self.SYNC_var = prefix + "_REPLICA_SYNC_SECONDS"
+        self.REPLICA_PATH = os.environ.get(self.REPLICA_var) or (
+            getattr(secrets, self.REPLICA_var, None) if self.secrets_found else None
+        )
+        self.REPLICA_SYNC_SECONDS = int(os.environ.get(self.SYNC_var, 300))
+
 
 class MultiConfig(Config):
     """Generate multiple Config class instances."""
@@ -2,14 +2,18 @@ from __future__ import division
 import subprocess
 import os
 from PyQt5 import QtGui, QtCore, QtWidgets
-from gresq.dashboard.submit import GSASubmit
-from gresq.dashboard.query import GSAQuery
-from gresq.dashboard.query_2_0 import GSAQuery as GSAQuery_2_0
-from gresq.dashboard.submit_2_0 import GSASubmit as GSASubmit_2_0
 # from GSARaman import GSARaman
-from gresq.dashboard.oscm import GSAOscm
 from gresq.util.util import ConfigParams
 from gresq.util.icons import Icon
+from gresq.util.lazy import lazy_import, LazyTab
+from gresq.util.instrumentation import InstrumentationDock
+
+# Tab modules are imported when their tab is first shown.
+query = lazy_import("gresq.dashboard.query")
+submit = lazy_import("gresq.dashboard.submit")
+query_2_0 = lazy_import("gresq.dashboard.query_2_0")
+submit_2_0 = lazy_import("gresq.dashboard.submit_2_0")
+oscm = lazy_import("gresq.dashboard.oscm")
 
 class GSADashboard(QtWidgets.QMainWindow):
     """
@@ -47,11 +51,19 @@ class GSADashboard(QtWidgets.QMainWindow):
         helpMenu = mainMenu.addMenu('&Help')
         helpMenu.addAction(aboutAction)
 
-        # self.query_tab = GSAQuery(config=self.config)
-        self.query_2_0_tab = GSAQuery_2_0(config=self.config)
-        # self.submit_tab = GSASubmit(config=self.config)
-        # self.submit_2_0_tab = GSASubmit_2_0(config=self.config)
-        # self.oscm_tab = GSAOscm(server_instance="prod")
+        # Developer dock with the SQL statements run by the dashboard; it has no menu entry.
+        self.sql_dock = InstrumentationDock(parent=self)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.sql_dock)
+        self.sql_dock.hide()
+        sqlAction = self.sql_dock.toggleViewAction()
+        sqlAction.setShortcut(QtGui.QKeySequence("Ctrl+Shift+L"))
+        self.addAction(sqlAction)
+
+        # self.query_tab = LazyTab(lambda: query.GSAQuery(config=self.config))
+        self.query_2_0_tab = LazyTab(lambda: query_2_0.GSAQuery(config=self.config))
+        # self.submit_tab = LazyTab(lambda: submit.GSASubmit(config=self.config))
+        # self.submit_2_0_tab = LazyTab(lambda: submit_2_0.GSASubmit(config=self.config))
+        # self.oscm_tab = LazyTab(lambda: oscm.GSAOscm(server_instance="prod"))
         # self.submit_tab.preparation.oscm_signal.connect(
         #     lambda: self.setCurrentWidget(self.oscm_tab)
         # )
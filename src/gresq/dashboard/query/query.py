@@ -534,7 +534,7 @@ class PreviewWidget(QtGui.QTabWidget):
         with dal.session_scope() as session:
             if index:
                 if model:
-                    i = int(model.df["id"].values[index.row()])
+                    i = model.rowId(index.row())
                 else:
                     i = index
                 s = session.query(Sample).filter(Sample.id == i)[0]
@@ -718,8 +718,8 @@ class FieldsDisplayWidget(QtGui.QScrollArea):
         """
         for field in self.fields.keys():
             if index:
-                if field in model.df.columns:
-                    value = model.df[field].iloc[index.row()]
+                if field in model.columnNames():
+                    value = model.value(field, index.row())
                     if pd.isnull(value):
                         value = ""
                     elif value != None and isinstance(value, float):
@@ -870,7 +870,7 @@ class SEMDisplayTab(QtGui.QScrollArea):
         self.file_list = QtGui.QListWidget()
         self.sem_info = QtGui.QStackedWidget()
         self.sample_id = None
-        self.threadpool = DownloadPool(2)
+        self.threadpool = DownloadPool(parent=self)
 
         self.setWidgetResizable(True)
         self.setWidget(self.contentWidget)
@@ -949,7 +949,7 @@ class SEMDisplayTab(QtGui.QScrollArea):
 
         if sem.default_analysis:
             thread = DownloadThread(url=sem.default_analysis.mask_url, thread_id=sem.id)
-            runner = self.threadpool.addRunner(thread)
+            runner = self.threadpool.addThread(thread)
             runner.finished[object, int, object].connect(mask_tab.loadImage)
 
         return sem_tabs
@@ -5,17 +5,49 @@ import numpy as np
 import sys, operator, os
 from PyQt5 import QtGui, QtCore, QtWidgets
 import pyqtgraph as pg
-import cv2
 import io
 import sip
 import requests
 import uuid
 import json
+import logging
 from PIL import Image
-from gresq.util.io import DownloadThread, DownloadPool, DownloadRunner
+from gresq.util.io import DownloadThread, DownloadPool, DownloadRunner, DownloadScheduler
+from gresq.util.query_engine import QueryEngine
+from gresq.util.prefetch import Prefetcher, neighbour_rows
+from gresq.util.paging import PagedResultsTableModel, count_query
+from gresq.util.refine import refine_results
+from gresq.util.versions import current_versions, bump_table_versions, changed_tables
+from gresq.util.spectrum import default_spectrum_store
+from gresq.util.vocabulary import default_vocabulary, string_columns
+from gresq.util.lazy import lazy_import, LazyTab
+from gresq.util.preview import PreviewLoader, related
+from gresq.util.instrumentation import origin
+from gresq.util.jobs import default_job_runner
+from gresq.util.export import Exporter, export_formats, export_format
+from gresq.util.summary import (
+    results_query_for,
+    refresh_experiment_summary,
+    delete_experiment_summary,
+)
+from gresq.util.query_builder import (
+    preparation_fields,
+    properties_fields,
+    substrate_fields,
+    furnace_fields,
+    environment_conditions_fields,
+    recipe_fields,
+    hybrid_recipe_fields,
+    author_fields,
+    raman_fields,
+    spectrum_fields,
+    experiment_fields,
+    results_fields,
+    selection_list,
+    results_models,
+)
 from gresq.util.util import ConfigParams, sql_validator, operators, ResultsTableModel, errorCheck, BasicLabel, HeaderLabel
 from gresq.util.box_adaptor import BoxAdaptor
-from gresq.dashboard.stats import TSNEWidget, PlotWidget
 from grdb.database import dal, Base
 from grdb.database.models import (
     Experiment,
@@ -33,105 +65,16 @@ from grdb.database.models import (
 )
 from sqlalchemy import String, Integer, Float, Numeric, or_
 from gresq.config import config
-from gsaimage import ImageEditor
-import scipy
-from scipy import signal
-from gsaraman.raw_plotter import RamanQueryWidget
-
-"""
-Each primary field will correspond to a SQLAlchemy model. Each of these are models
-(whose schema is in grdb.database.v1_1_0.py). Secondary fields are attributes of these
-models and the fields that will be displayed are controlled via the field lists
-below.
-"""
-# made changes here - Mitisha
-preparation_fields = [
-    "name",
-    "duration",
-    "furnace_temperature",
-    "furnace_pressure",
-    "sample_location",
-    "helium_flow_rate",
-    "hydrogen_flow_rate",
-    "carbon_source_flow_rate",
-    "argon_flow_rate",
-    "cooling_rate",
-]
-
-properties_fields = [
-    "growth_coverage",
-    "shape",
-    "average_thickness_of_growth",
-    "standard_deviation_of_growth",
-    "number_of_layers",
-    "domain_size",
-]
-
-substrate_fields = [
-    "catalyst",
-    "thickness",
-    "diameter",
-    "length",
-    "surface_area",
-]
-
-furnace_fields = [
-    "tube_diameter",
-    "cross_sectional_area",
-    "tube_length",
-    "length_of_heated_region",
-]
-
-environment_conditions_fields = [
-    "dew_point",
-    "ambient_temperature",
-]
-
-recipe_fields = [
-    "base_pressure",
-    # "carbon_source",
-]
-
-hybrid_recipe_fields = [
-    "maximum_temperature",
-    "maximum_pressure",
-    "average_carbon_flow_rate",
-    "uses_helium",
-    "uses_hydrogen",
-    "uses_argon",
-]
-
-author_fields = ["last_name", "first_name", "institution"]
-
-raman_fields = ["gp_to_g", "d_to_g"]
-
-spectrum_fields = [
-    "percent",
-    "d_peak_shift",
-    "d_peak_amplitude",
-    "d_fwhm",
-    "g_peak_shift",
-    "g_peak_amplitude",
-    "g_fwhm",
-    "g_prime_peak_shift",
-    "g_prime_peak_amplitude",
-    "g_prime_fwhm",
-]
-
-experiment_fields = ["id", "experiment_date", "validated"]
-
-results_fields = experiment_fields + properties_fields + raman_fields
-
-selection_list = {
-    "Furnace": {"fields": furnace_fields, "model": Furnace},
-    "Substrate": {"fields": substrate_fields, "model": Substrate},
-    "Environment Conditions": {"fields": environment_conditions_fields, "model": EnvironmentConditions},
-    "Recipe": {"fields": recipe_fields , "model": Recipe},
-    "Preparation": {"fields": preparation_fields, "model": PreparationStep},
-    "Properties": {"fields": properties_fields, "model": Properties},
-    "Raman Analysis": {"fields": raman_fields, "model": RamanAnalysis},
-    "Provenance Information": {"fields": author_fields, "model": Author},
-}
+
+logger = logging.getLogger(__name__)
+
+# Imaging and analytics modules are imported when the tabs using them are first opened.
+cv2 = lazy_import("cv2")
+scipy = lazy_import("scipy")
+signal = lazy_import("scipy.signal")
+gsaimage = lazy_import("gsaimage")
+raw_plotter = lazy_import("gsaraman.raw_plotter")
+stats = lazy_import("gresq.dashboard.stats")
 
 
 def convertScripts(text):
@@ -166,6 +109,15 @@ class GSAQuery(QtGui.QWidget):
             QtGui.QSizePolicy.Maximum, QtGui.QSizePolicy.Maximum
         )
         self.filters_dict = {} # dictionary of filter inputs
+        # Distinct values of every string field, read in one round trip.
+        self.vocabulary = default_vocabulary()
+        self.vocabulary.load(
+            [
+                c
+                for selection in selection_list.values()
+                for c in string_columns(selection["model"], selection["fields"])
+            ]
+        )
         for selection in selection_list.keys():
             for field in selection_list[selection]["fields"]:
                 widget = self.generate_field(
@@ -266,13 +218,27 @@ class GSAQuery(QtGui.QWidget):
         self.secondary_selection.activated[str].emit(
             self.secondary_selection.currentText()
         )
+        self.results.queryFinished.connect(self.connectSelection)
         self.results.plotClicked.connect(
             lambda plot, points: self.preview.select(index=points[0].data())
         )
         self.results.tsneClicked.connect(
             lambda plot, points: self.preview.select(index=points[0].data())
         )
+        self.vocabulary.updated.connect(self.updateVocabulary)
+        self.vocabulary.refresh()
 
+    def updateVocabulary(self):
+        """
+        Refills the class filters with the current distinct values of their fields.
+        """
+        for widget in self.filters_dict.values():
+            if isinstance(widget, ClassFilter):
+                widget.setClasses(
+                    self.vocabulary.values(getattr(widget.model, widget.field))
+                )
+
+    @origin("GSAQuery.generate_field")
     def generate_field(self, model, field):
         """
         Generates an input selected field of selected model.
@@ -294,10 +260,7 @@ class GSAQuery(QtGui.QWidget):
             )
             return vf
         elif sql_validator["str"](getattr(cla, field)) == True:
-            with dal.session_scope() as session:
-                classes = []
-                for v in session.query(getattr(cla, field)).distinct():
-                    classes.append(getattr(v, field))
+            classes = self.vocabulary.values(getattr(cla, field))
             return ClassFilter(model=cla, field=field, classes=classes, validate=str)
         else:
             raise ValueError(
@@ -356,16 +319,25 @@ class GSAQuery(QtGui.QWidget):
 
     def query(self, filters):
         """
-        Runs query on results widget. This is a separate function so as to make the selection signal work properly.
-        This is because the model must be set before selection signalling can be connected.
+        Runs query on results widget. The query runs in the background, so the selection signal is
+        connected in connectSelection once the results model has been set.
         """
         if self.config.canValidate():
             self.results.query(filters)
         else:
             self.results.query(filters + [or_(Experiment.validated == True, Experiment.nanohub_userid == os.getuid())])
+
+    def connectSelection(self):
+        """
+        Connects the results table selection to the preview. This must happen after the model is set
+        because setting a new model replaces the table's selection model.
+        """
         self.results.results_table.selectionModel().currentChanged.connect(
             lambda x: self.preview.select(self.results.results_model, x) if self.results.rowCount() > 0 else None
         )
+        self.results.results_table.selectionModel().currentChanged.connect(
+            lambda x: self.results.prefetchAround(x.row())
+        )
 
 
 class ValueFilter(QtGui.QWidget):
@@ -473,6 +445,17 @@ class ClassFilter(QtGui.QWidget):
     def sqlalchemy_filter(self):
         return operator.eq(getattr(self.model, self.field), self.value)
 
+    def setClasses(self, classes):
+        """
+        Replaces the choices, keeping the current one selected if it is still available.
+        """
+        current = self.classes.currentText()
+        self.classes.clear()
+        self.classes.addItems(classes)
+        index = self.classes.findText(current)
+        if index >= 0:
+            self.classes.setCurrentIndex(index)
+
     def clear(self):
         pass
 
@@ -515,11 +498,19 @@ class PreviewWidget(QtGui.QTabWidget):
         -Raman data (raw and postprocessed)
         -Recipe visualization
         -Provenance information
+
+    Experiments are read with PreviewLoader, together with the rows preview_window rows
+    above and below the selection, so moving the selection through the results table is
+    mostly served from its cache.
     """
 
+    # Rows on each side of the selection whose experiments are read with it.
+    preview_window = 5
+
     def __init__(self, config, parent=None):
         super(PreviewWidget, self).__init__(parent=parent)
         self.config = config
+        self.loader = PreviewLoader()
         self.detail_tab = DetailWidget()
         self.sem_tab = SEMDisplayTab(config=config)
         self.raman_tab = RamanDisplayTab(config=config)
@@ -542,6 +533,7 @@ class PreviewWidget(QtGui.QTabWidget):
             self.addTab(self.admin_tab, "Admin")
 
     @errorCheck(error_text='Error selecting entry!')
+    @origin("PreviewWidget.select")
     def select(self, model=None, index=None):
         """
         Select Experiment model and update preview. Can use ResultsTableModel with corresponding index,
@@ -551,14 +543,18 @@ class PreviewWidget(QtGui.QTabWidget):
         index:              Index from ResultsWidget table or Experiment id if model=None. If None, model refers to a Experiment model.
         """
 
-        session = dal.Session()
-        #with dal.session_scope() as session:
         if index:
             if model:
-                i = int(model.df["id"].values[index.row()])
+                i = model.rowId(index.row())
+                if i is None:
+                    # The page of the row is being read.
+                    return
+                s = self.loader.load(self.windowIds(model, index.row())).get(i)
             else:
                 i = index
-            s = session.query(Experiment).filter(Experiment.id == i)[0]
+                s = self.loader.get(i)
+            if s is None:
+                raise ValueError("Experiment %s not found." % i)
         elif index == None and model != None:
             s = model
         else:
@@ -576,7 +572,23 @@ class PreviewWidget(QtGui.QTabWidget):
         self.sem_tab.update(s)
         self.raman_tab.update(s)
 
-        session.close()
+    def windowIds(self, model, row):
+        """
+        Returns the experiment id of row, followed by those of the rows around it if the
+        loader does not have the next or previous row yet.
+
+        model:              ResultsTableModel (or PagedResultsTableModel).
+        row:                (int) Selected row.
+        """
+        ids = [model.rowId(row)]
+        nrows = model.rowCount()
+        adjacent = [model.rowId(r) for r in (row - 1, row + 1) if 0 <= r < nrows]
+        adjacent = [i for i in adjacent if i is not None]
+        if len(self.loader.cached(adjacent)) < len(adjacent):
+            for r in range(row - self.preview_window, row + self.preview_window + 1):
+                if 0 <= r < nrows and r != row:
+                    ids.append(model.rowId(r))
+        return [i for i in ids if i is not None]
 
 
 class ResultsWidget(QtGui.QTabWidget):
@@ -584,130 +596,308 @@ class ResultsWidget(QtGui.QTabWidget):
     Widget for displaying results associated with a query. Contains tabs:
         - Results:              Each row associated with an  experiment and column corresponding to
                                 a field. Clicking a row selects that experiment for the PreviewWidget.
+                                Rows are read from the database page by page as the table is scrolled.
         - t-SNE:                Allows users to conduct t-SNE visualization on queried data.
         - Plot:                 Allows users to scatter plot queried data.
+
+    The plotting and t-SNE tabs need every row, so the full results are only read (in the
+    background, by the QueryEngine) once one of them is opened, or as soon as the results are
+    counted if there are at most local_rows of them. The full results are kept; a later query
+    that only adds filters on their columns is answered from them without the database, until
+    a write to the database changes the table versions (see gresq.util.versions).
+
+    Export writes the results of the current filters to CSV, Parquet or Arrow, streamed from
+    the database in chunks by an Exporter (see gresq.util.export).
     """
 
     plotClicked = QtCore.pyqtSignal(object, object)
     tsneClicked = QtCore.pyqtSignal(object, object)
+    queryFinished = QtCore.pyqtSignal()
+
+    # Rows prefetched after a query, and rows on each side of the selection.
+    prefetch_rows = 20
+    prefetch_neighbours = 3
+    # Rows sampled when sizing the table columns.
+    resize_sample_rows = 100
+    # Results with at most this many rows are read in full for in-memory refinement.
+    local_rows = 50000
 
     def __init__(self, parent=None):
         super(ResultsWidget, self).__init__(parent=parent)
         self.setTabPosition(QtGui.QTabWidget.North)
+        self.query_engine = QueryEngine(parent=self)
+        self.query_engine.finished.connect(self.setResults)
+        self.query_engine.progress.connect(self.updateProgress)
+        self.query_engine.failed.connect(self.queryFailed)
+        self.count_engine = QueryEngine(max_thread_count=1, parent=self)
+        self.count_engine.finished.connect(self.setCount)
+        self.count_engine.failed.connect(lambda generation, e: self.status_label.setText(""))
+        self.results_query = None
+        self.results_filters = []
+        self.analysis_loaded = True
+        self.analysis_request = None
+        # Full results of the last query read from the database, its filters and the table
+        # versions they were read at.
+        self.frame = None
+        self.frame_filters = None
+        self.frame_versions = None
+        self.prefetcher = Prefetcher(parent=self)
+        self.result_count = None
+        self.exporter = Exporter(parent=self)
+        self.exporter.progress.connect(self.updateExportProgress)
+        self.exporter.finished.connect(self.exportFinished)
+        self.exporter.failed.connect(self.exportFailed)
+        self.exporter.cancelled.connect(self.exportCancelled)
+        self.export_dialog = None
+        self.status_label = BasicLabel("")
+        self.export_button = QtGui.QPushButton("Export...")
+        self.export_button.setEnabled(False)
+        self.export_button.clicked.connect(self.exportResults)
+        corner = QtGui.QWidget()
+        corner_layout = QtGui.QHBoxLayout(corner)
+        corner_layout.setContentsMargins(0, 0, 0, 0)
+        corner_layout.addWidget(self.status_label)
+        corner_layout.addWidget(self.export_button)
+        self.setCornerWidget(corner, QtCore.Qt.TopRightCorner)
         self.results_model = ResultsTableModel()
         self.results_table = QtGui.QTableView()
         self.results_table.setMinimumWidth(400)
         self.results_table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
         self.results_table.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
         self.results_table.setSortingEnabled(True)
+        self.results_table.horizontalHeader().setResizeContentsPrecision(
+            self.resize_sample_rows
+        )
 
         self.setSizePolicy(
             QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Preferred
         )
 
-        self.tsne = TSNEWidget()
-        self.plot = PlotWidget()
+        # The plotting and t-SNE widgets are built when their tab is first opened.
+        self.analysis_model = None
+        self.plot = None
+        self.tsne = None
+        self.plot_tab = LazyTab(self.buildPlot)
+        self.tsne_tab = LazyTab(self.buildTSNE)
 
         self.addTab(self.results_table, "Query Results")
-        self.addTab(self.plot, "Plotting")
-        self.addTab(self.tsne, "t-SNE")
+        self.addTab(self.plot_tab, "Plotting")
+        self.addTab(self.tsne_tab, "t-SNE")
 
+        self.currentChanged.connect(lambda i: self.loadAnalysisResults())
+
+    def buildPlot(self):
+        self.plot = stats.PlotWidget()
         self.plot.sigClicked.connect(
             lambda plot, points: self.plotClicked.emit(plot, points)
         )
+        if self.analysis_model is not None:
+            self.setPlotModel(self.analysis_model)
+        return self.plot
+
+    def buildTSNE(self):
+        self.tsne = stats.TSNEWidget()
         self.tsne.tsneClicked.connect(
             lambda plot, points: self.plotClicked.emit(plot, points)
         )
+        if self.analysis_model is not None:
+            self.setTSNEModel(self.analysis_model)
+        return self.tsne
 
     def rowCount(self):
         return self.results_model.rowCount(parent=None)
 
-    @errorCheck(error_text="Error querying database!")
+    @origin("ResultsWidget.query")
     def query(self, filters):
         """
-        Queries SQL database using list of sqlalchemy filters.
+        Queries SQL database using list of sqlalchemy filters. The results table shows the first
+        page of rows at once and reads more as it is scrolled; the number of results is counted in
+        the background. Any query still running for an earlier filter set is cancelled.
 
         filters:                list of sqlalchemy filters
         """
-        # made changes here - Mitisha
-        
-        self.results_model = ResultsTableModel()
+        self.prefetcher.reset()
+        self.query_engine.cancel()
+        self.count_engine.cancel()
+        self.result_count = None
+        self.export_button.setEnabled(len(filters) > 0)
+        # Clears the plotting and t-SNE tabs until the new results are read.
+        self.setResults(self.query_engine.generation(), pd.DataFrame())
+        if len(filters) > 0 and self.refine(filters):
+            return
         if len(filters) > 0:
-            with dal.session_scope() as session:
-                all_experiment_fields = [
-                    c.key for c in Experiment.__table__.columns
-                ]  # +['author_last_names']
-                experiment_columns = tuple([getattr(Experiment, e) for e in all_experiment_fields])
-                recipe_columns = tuple(
-                    [getattr(Recipe, r) for r in recipe_fields]# + hybrid_recipe_fields]
-                )
-                substrate_columns = tuple(
-                    [getattr(Substrate, sb) for sb in substrate_fields]
-                )
-                furnace_columns = tuple(
-                    [getattr(Furnace, f) for f in furnace_fields]
-                )
-                environment_conditions_columns = tuple(
-                    [getattr(EnvironmentConditions, e) for e in environment_conditions_fields]
-                )
-                
-                properties_columns = tuple(
-                    [getattr(Properties, p) for p in properties_fields]
-                )
-                raman_columns = tuple([getattr(RamanAnalysis, r) for r in raman_fields])
-
-                query_columns = (
-                    furnace_columns + experiment_columns + recipe_columns + raman_columns + properties_columns + substrate_columns + environment_conditions_columns  
-                ) 
-                #What we want is - one-to-many - "some join"(Parent, )
-                #parent.child_id doesnt exist, Child.parent_id exists
-                #Parent.id and Child.id exist
-
-                #
-                q = (
-                    session.query(*query_columns)
-                    #Experiment linked to all by many-to-one
-                    .join(Recipe, Recipe.id == Experiment.recipe_id)
-                    .join(Substrate, Substrate.id == Experiment.substrate_id)
-                    .join(Furnace, Furnace.id == Experiment.furnace_id)
-                    # #Linked to experiment by one-to-one
-                    .outerjoin(EnvironmentConditions, EnvironmentConditions.id == Experiment.environment_conditions_id)
-                    .outerjoin(Properties, Experiment.id == Properties.experiment_id)
-                    # #Linked to experiment by one-to-many
-                    .outerjoin(RamanFile, Experiment.id == RamanFile.experiment_id)
-                    # #Linked to parent by one-to-many
-                    .outerjoin(RamanAnalysis, RamanAnalysis.raman_file_id == RamanFile.id)
-                    .outerjoin(PreparationStep, PreparationStep.recipe_id == Recipe.id) 
-                    # #Linked to Experiment by many-to-many
-                    # ses3.query(Experiment,Recipe).filter(Experiment.recipe_id==Recipe.id)
-                    .outerjoin(Author, Author.id == Experiment.submitted_by) #check: why is it called this? why not author
-                    .filter(*filters)
-                    .distinct()
-                )
+            # The materialized experiment_summary table is used when it exists.
+            q = results_query_for(filters, self.query_engine.bind())
+            self.results_query = q
+            self.results_filters = list(filters)
+            self.analysis_loaded = False
+            self.setTableModel(
+                PagedResultsTableModel(q, bind=self.query_engine.bind())
+            )
+            self.status_label.setText("Counting...")
+            self.count_engine.submit(count_query(q).statement)
+            self.loadAnalysisResults()
+        else:
+            self.results_query = None
+            self.analysis_loaded = True
+            self.setTableModel(ResultsTableModel())
 
-                # result = session.query(Recipe)\
-                # .options(contains_eager(Recipe.experiments))\
-                # .join(Row)\
-                # .filter(Table.name == 'abc', Row.status == True).one()
+    @errorCheck(error_text="Error querying database!")
+    def setTableModel(self, model):
+        """
+        Shows model in the results table. A PagedResultsTableModel starts reading its first
+        page in the background; the table is sized from it in showFirstPage once it arrives.
 
-                self.results_model.read_sqlalchemy(
-                    q.statement, session, models=[Furnace, Experiment, Recipe, PreparationStep, Properties, RamanAnalysis, Substrate, EnvironmentConditions]
-                ) 
-                
+        model:                  (ResultsTableModel or PagedResultsTableModel) Results to show.
+        """
+        if isinstance(self.results_model, PagedResultsTableModel):
+            self.results_model.cancel()
+        if model.columnCount(parent=None) > 0:
+            model.setHeaderMapper(results_models)
+        self.results_model = model
         self.results_table.setModel(self.results_model)
 
-        for c in range(self.results_model.columnCount(parent=None)):
-            if self.results_model.df.columns[c] not in results_fields:
+        columns = self.results_model.columnNames()
+        for c in range(len(columns)):
+            if columns[c] not in results_fields:
                 self.results_table.hideColumn(c)
+        if isinstance(model, PagedResultsTableModel):
+            model.pageLoaded.connect(self.showFirstPage)
+            model.failed.connect(self.pageFailed)
+            model.fetchMore(QtCore.QModelIndex())
+        else:
+            self.showFirstPage(0)
+        self.queryFinished.emit()
+
+    def showFirstPage(self, page):
+        """
+        Sizes the results table from its first rows and prefetches their files.
+
+        page:                   (int) Page of the results model that was read.
+        """
+        if page != 0 or self.sender() not in (None, self.results_model):
+            return
         self.results_table.resizeColumnsToContents()
+        if "id" in self.results_model.columnNames() and self.rowCount() > 0:
+            ids = [
+                self.results_model.rowId(r)
+                for r in range(min(self.prefetch_rows, self.rowCount()))
+            ]
+            self.prefetcher.prefetch([i for i in ids if i is not None])
+
+    def refine(self, filters):
+        """
+        Shows the results of filters computed from the kept full results, if filters only add
+        filters on their columns and the database has not changed since they were read.
+        Returns True if the results were shown.
+
+        filters:                list of sqlalchemy filters
+        """
+        if self.frame is None:
+            return False
+        if current_versions(self.query_engine.bind()) != self.frame_versions:
+            self.frame = None
+            return False
+        df = refine_results(self.frame, self.frame_filters, filters)
+        if df is None:
+            return False
+        self.results_query = None
+        self.results_filters = list(filters)
+        self.analysis_loaded = True
+        model = ResultsTableModel()
+        if df.shape[1] > 0:
+            model.setDataFrame(df)
+        self.setTableModel(model)
+        self.showAnalysisResults(df)
+        return True
+
+    def setCount(self, generation, df):
+        if self.count_engine.isCurrent(generation) and df.shape[0] > 0:
+            count = int(df.iloc[0, 0])
+            self.result_count = count
+            self.status_label.setText("%s results" % count)
+            if count <= self.local_rows:
+                self.loadAnalysisResults(force=True)
+
+    @origin("ResultsWidget.loadAnalysisResults")
+    def loadAnalysisResults(self, force=False):
+        """
+        Reads the full results for the plotting and t-SNE tabs once one of them is shown.
+
+        force:                  (bool) Read them even if neither tab is shown.
+        """
+        if self.analysis_loaded or self.results_query is None:
+            return
+        if not force and self.currentWidget() not in (self.plot_tab, self.tsne_tab):
+            return
+        self.analysis_loaded = True
+        versions = current_versions(self.query_engine.bind())
+        generation = self.query_engine.submit(self.results_query.statement)
+        self.analysis_request = (generation, list(self.results_filters), versions)
+
+    def updateProgress(self, generation, nrows):
+        if self.query_engine.isCurrent(generation):
+            self.status_label.setText("Querying... (%s rows)" % nrows)
+
+    def queryFailed(self, generation, error_text):
+        self.showQueryError(error_text)
+
+    def pageFailed(self, error_text):
+        if self.sender() is self.results_model:
+            self.showQueryError(error_text)
+
+    def showQueryError(self, error_text):
+        self.status_label.setText("")
+        error_dialog = QtWidgets.QMessageBox(self)
+        error_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        error_dialog.setText("Error querying database!")
+        error_dialog.setInformativeText(error_text)
+        error_dialog.exec()
+
+    @errorCheck(error_text="Error querying database!")
+    def setResults(self, generation, df):
+        """
+        Loads the full query results into the plotting and t-SNE tabs. Results from a
+        superseded query are ignored.
+
+        generation:             (int) QueryEngine generation that produced df.
+        df:                     (pd.DataFrame) Query results.
+        """
+        if not self.query_engine.isCurrent(generation):
+            return
+        if self.analysis_request is not None and self.analysis_request[0] == generation:
+            _, self.frame_filters, self.frame_versions = self.analysis_request
+            self.frame = df
+        self.showAnalysisResults(df)
+
+    def showAnalysisResults(self, df):
+        """
+        Loads full query results into the plotting and t-SNE tabs.
+
+        df:                     (pd.DataFrame) Query results.
+        """
+        analysis_model = ResultsTableModel()
+        if df.shape[1] > 0:
+            analysis_model.setDataFrame(df, models=results_models)
+            self.status_label.setText("%s results" % df.shape[0])
+        else:
+            self.status_label.setText("")
+        self.analysis_model = analysis_model
+        if self.plot is not None:
+            self.setPlotModel(analysis_model)
+        if self.tsne is not None:
+            self.setTSNEModel(analysis_model)
+
+    def setPlotModel(self, analysis_model):
         self.plot.setModel(
-            self.results_model,
+            analysis_model,
             xfields= recipe_fields + hybrid_recipe_fields,
             yfields= raman_fields + properties_fields,
         )
 
+    def setTSNEModel(self, analysis_model):
         self.tsne.setModel(
-            self.results_model,
+            analysis_model,
             fields=['id']
             + recipe_fields
             + hybrid_recipe_fields
@@ -715,6 +905,78 @@ class ResultsWidget(QtGui.QTabWidget):
             + properties_fields,
         )
 
+    @errorCheck(error_text="Error exporting results!")
+    def exportResults(self):
+        """
+        Asks for a file and exports the results of the current filters to it in the background.
+        """
+        if len(self.results_filters) == 0 or self.exporter.isRunning():
+            return
+        names = {"csv": "CSV", "parquet": "Parquet", "arrow": "Arrow IPC"}
+        file_filters = ["%s (*%s)" % (names[f], ext) for f, ext in export_formats.items()]
+        path, selected = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export results", "results.csv", ";;".join(file_filters)
+        )
+        if path == "":
+            return
+        format = export_format(path)
+        if format is None:
+            format = list(export_formats)[file_filters.index(selected)]
+            path += export_formats[format]
+        statement = results_query_for(self.results_filters, self.exporter.bind()).statement
+
+        self.export_dialog = QtWidgets.QProgressDialog(
+            "Exporting results...", "Cancel", 0, self.result_count or 0, self
+        )
+        self.export_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self.export_dialog.setMinimumDuration(0)
+        self.export_dialog.canceled.connect(self.exporter.cancel)
+        self.export_dialog.show()
+        self.export_button.setEnabled(False)
+        self.exporter.export(statement, path, format=format)
+
+    def updateExportProgress(self, nrows):
+        if self.export_dialog is not None:
+            if self.export_dialog.maximum() > 0:
+                self.export_dialog.setValue(min(nrows, self.export_dialog.maximum()))
+            self.export_dialog.setLabelText("Exporting results... (%s rows)" % nrows)
+
+    def _closeExportDialog(self):
+        if self.export_dialog is not None:
+            self.export_dialog.canceled.disconnect(self.exporter.cancel)
+            self.export_dialog.close()
+            self.export_dialog = None
+        self.export_button.setEnabled(len(self.results_filters) > 0)
+
+    def exportFinished(self, path, nrows):
+        self._closeExportDialog()
+        self.status_label.setText("Exported %s rows to %s" % (nrows, os.path.basename(path)))
+
+    def exportCancelled(self):
+        self._closeExportDialog()
+
+    def exportFailed(self, error_text):
+        self._closeExportDialog()
+        error_dialog = QtWidgets.QMessageBox(self)
+        error_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        error_dialog.setText("Error exporting results!")
+        error_dialog.setInformativeText(error_text)
+        error_dialog.exec()
+
+    def prefetchAround(self, row):
+        """
+        Prefetches the files of the experiments next to row in the results table, nearest first.
+
+        row:                    (int) Row of the current selection.
+        """
+        if "id" not in self.results_model.columnNames():
+            return
+        neighbours = [
+            self.results_model.rowId(r)
+            for r in neighbour_rows(row, self.prefetch_neighbours, self.rowCount())
+        ]
+        self.prefetcher.prefetch([i for i in neighbours if i is not None])
+
 
 class FieldsDisplayWidget(QtGui.QScrollArea):
     """
@@ -775,8 +1037,8 @@ class FieldsDisplayWidget(QtGui.QScrollArea):
         """
         for field in self.fields.keys():
             if index:
-                if field in model.df.columns:
-                    value = model.df[field].iloc[index.row()]
+                if field in model.columnNames():
+                    value = model.value(field, index.row())
                     if pd.isnull(value):
                         value = ""
                     elif value != None and isinstance(value, float):
@@ -859,8 +1121,8 @@ class MultipleFieldsDisplayWidget(QtGui.QScrollArea):
         """
         for field in self.fields.keys():
             if index:
-                if field in model.df.columns:
-                    value = model.df[field].iloc[index.row()]
+                if field in model.columnNames():
+                    value = model.value(field, index.row())
                     if pd.isnull(value):
                         value = ""
                     elif value != None and isinstance(value, float):
@@ -879,6 +1141,13 @@ class MultipleFieldsDisplayWidget(QtGui.QScrollArea):
 
 
 
+def decode_image(data):
+    """
+    Decodes image file contents into an array.
+    """
+    return np.array(Image.open(io.BytesIO(data)))
+
+
 class RawImageTab(pg.GraphicsLayoutWidget):
     """
     Widget to display an image. Useful for connecting threaded downloads to image display.
@@ -886,6 +1155,7 @@ class RawImageTab(pg.GraphicsLayoutWidget):
     def __init__(self, parent=None):
         super(RawImageTab, self).__init__(parent=parent)
         self._id = None
+        self.decode_job = None
         self.viewbox = self.addViewBox(row=1, col=1)
         self.img_item = pg.ImageItem()
         self.viewbox.addItem(self.img_item)
@@ -900,7 +1170,27 @@ class RawImageTab(pg.GraphicsLayoutWidget):
         info:           (dict) Dictionary of ancillary parameters from DownloadThread.
         """
         self._id = thread_id
-        img = np.array(Image.open(io.BytesIO(data)))
+        # A slower decode of the previous file must not replace this one.
+        if self.decode_job is not None:
+            self.decode_job.cancel()
+        # Decoding large SEM images takes a while; PIL releases the GIL, so use a thread job.
+        # The key spares hashing the whole image to deduplicate the job.
+        self.decode_job = default_job_runner().submit(
+            decode_image,
+            args=(data,),
+            key="decode_image:%s:%s" % (id(self), thread_id),
+            thread=True,
+        )
+        self.decode_job.finished.connect(
+            lambda img, thread_id=thread_id: self.setImage(img, thread_id)
+        )
+
+    def setImage(self, img, thread_id=None):
+        """
+        Shows a decoded image, unless it belongs to a file other than the last one loaded.
+        """
+        if thread_id is not None and thread_id != self._id:
+            return
         self.img_item.setImage(img, levels=(0, 255))
 
 
@@ -925,6 +1215,7 @@ class SEMAdminTab(QtGui.QScrollArea):
             QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Minimum
         )
         self.mask_stack = QtGui.QStackedWidget()
+        self.downloads = DownloadPool(priority=DownloadScheduler.BACKGROUND, parent=self)
 
         with dal.session_scope() as session:
             sem = session.query(SemFile).filter(SemFile.id == self.sem_id).first()
@@ -935,13 +1226,12 @@ class SEMAdminTab(QtGui.QScrollArea):
                 self.sem_list.addItem(str(analysis.id))
                 self.mask_stack.addWidget(mask_widget)
 
-                thread = DownloadThread(
+                request = self.downloads.add(
                     url=analysis.mask_url,
                     thread_id=self.sem_id,
                     info={"analysis_id": analysis.id},
                 )
-                thread.downloadFinished.connect(mask_widget.loadImage)
-                thread.start()
+                request.finished[object, int, object].connect(mask_widget.loadImage)
 
         self.layout = QtGui.QGridLayout(self)
         self.layout.addWidget(self.set_primary_button, 0, 0, 1, 1)
@@ -969,6 +1259,7 @@ class SEMAdminTab(QtGui.QScrollArea):
             )
 
     @errorCheck(error_text="Error setting as default SEM!")
+    @origin("SEMAdminTab.setDefault")
     def setDefault(self):
         analysis_id = int(self.sem_list.currentItem().text())
         with dal.session_scope() as session:
@@ -977,17 +1268,22 @@ class SEMAdminTab(QtGui.QScrollArea):
             )
 
             sem_file_model.default_analysis_id = analysis_id
+            bump_table_versions(session, [SemFile.__table__])
             session.commit()
 
         self.setDefaultStatus(analysis_id)
 
     @errorCheck(error_text="Error setting as primary SEM!")
+    @origin("SEMAdminTab.setPrimary")
     def setPrimary(self):
         with dal.session_scope() as session:
             experiment_model = (
                 session.query(Experiment).filter(Experiment.id == self.experiment_id).first()
             )
             experiment_model.primary_sem_file_id = self.sem_id
+            session.flush()
+            refresh_experiment_summary(session, [self.experiment_id])
+            bump_table_versions(session, [Experiment.__table__])
             session.commit()
 
         self.setPrimaryStatus()
@@ -1013,7 +1309,8 @@ class SEMDisplayTab(QtGui.QScrollArea):
         self.file_list = QtGui.QListWidget()
         self.sem_info = QtGui.QStackedWidget()
         self.experiment_id = None
-        self.threadpool = DownloadPool(2)
+        self.threadpool = DownloadPool(parent=self)
+        self.file_requests = []
 
         self.setWidgetResizable(True)
         self.setWidget(self.contentWidget)
@@ -1026,6 +1323,16 @@ class SEMDisplayTab(QtGui.QScrollArea):
         self.layout.addWidget(self.progress_bar, 1, 0, 1, 1)
 
         self.file_list.currentRowChanged.connect(self.sem_info.setCurrentIndex)
+        self.file_list.currentRowChanged.connect(self.prioritize)
+
+    def prioritize(self, row):
+        """
+        Moves the downloads of the SEM file shown in the tab to the front of the queue.
+        """
+        for r, requests in enumerate(self.file_requests):
+            priority = DownloadScheduler.VISIBLE if r == row else DownloadScheduler.BACKGROUND
+            for request in requests:
+                self.threadpool.setPriority(request, priority)
 
     def upload_file(self, file_path, folder_name=None):
         box_adaptor = BoxAdaptor(self.config.box_config_path)
@@ -1035,6 +1342,7 @@ class SEMDisplayTab(QtGui.QScrollArea):
         return box_file.get_shared_link_download_url(access="open")
 
     @errorCheck(success_text="Successfully submitted mask to database!",error_text='Error submitting mask!')
+    @origin("SEMDisplayTab.submitMask")
     def submitMask(self, sem_id, px_per_um, mask):
         assert isinstance(mask,np.ndarray)
         assert isinstance(px_per_um,int)
@@ -1057,6 +1365,7 @@ class SEMDisplayTab(QtGui.QScrollArea):
             print({i.name: getattr(analysis, i.name) for i in analysis.__table__.columns})
 
             session.add(analysis)
+            bump_table_versions(session, [SemAnalysis.__table__])
             session.commit()
 
             self.update(experiment_model, force_refresh=True)
@@ -1064,7 +1373,7 @@ class SEMDisplayTab(QtGui.QScrollArea):
     def update_progress_bar(self, *args, **kwargs):
         self.progress_bar.setValue(100 * self.threadpool.doneCount() / self.threadpool.count())
 
-    def createSEMTabs(self, sem):
+    def createSEMTabs(self, sem, priority=DownloadScheduler.VISIBLE):
         sem_tabs = QtGui.QTabWidget()
 
         image_tab = RawImageTab()
@@ -1076,25 +1385,32 @@ class SEMDisplayTab(QtGui.QScrollArea):
         edit_tab = None
         admin_tab = None
         if self.config.canValidate():
-            edit_tab = ImageEditor(sem_id=sem.id, config=self.config)
+            edit_tab = gsaimage.ImageEditor(sem_id=sem.id, config=self.config)
             edit_tab.submitClicked.connect(lambda x,y,z: self.submitMask(x,y,z))
             admin_tab = SEMAdminTab(sem_id=sem.id, experiment_id=self.experiment_id)
 
             sem_tabs.addTab(edit_tab, "Mask Editor")
             sem_tabs.addTab(admin_tab, "Admin")
 
-        thread = DownloadThread(url=sem.url, thread_id=sem.experiment_id, info={"sem_id": sem.id})
-        runner = self.threadpool.addThread(thread)
+        requests = []
+        runner = self.threadpool.add(
+            url=sem.url, thread_id=sem.experiment_id, info={"sem_id": sem.id}, priority=priority
+        )
         runner.finished[object, int, object].connect(image_tab.loadImage)
         runner.finished.connect(self.update_progress_bar)
         if edit_tab is not None:
             runner.finished[object, int, object].connect(edit_tab.loadImage)
+        requests.append(runner)
 
         if sem.default_analysis:
-            thread = DownloadThread(url=sem.default_analysis.mask_url, thread_id=sem.id)
-            runner = self.threadpool.addRunner(thread)
+            runner = self.threadpool.add(
+                url=sem.default_analysis.mask_url, thread_id=sem.id, priority=priority
+            )
             runner.finished[object, int, object].connect(mask_tab.loadImage)
+            runner.finished.connect(self.update_progress_bar)
+            requests.append(runner)
 
+        self.file_requests.append(requests)
         return sem_tabs
 
     @errorCheck(error_text="Error updating SEM display!")
@@ -1108,13 +1424,21 @@ class SEMDisplayTab(QtGui.QScrollArea):
                     self.sem_info.removeWidget(self.sem_info.widget(0))
 
                 self.threadpool.terminate()
+                self.file_requests = []
                 self.experiment_id = experiment_model.id
                 if experiment_model.sem_files is not None:
                     if len(experiment_model.sem_files) > 0:
                         self.progress_bar.setValue(1)
-                        for sem in experiment_model.sem_files:
+                        for i, sem in enumerate(experiment_model.sem_files):
                             self.file_list.addItem("SEM ID: %s" % sem.id)
-                            self.sem_info.addWidget(self.createSEMTabs(sem))
+                            self.sem_info.addWidget(
+                                self.createSEMTabs(
+                                    sem,
+                                    priority=DownloadScheduler.VISIBLE
+                                    if i == 0
+                                    else DownloadScheduler.BACKGROUND,
+                                )
+                            )
                         self.threadpool.run()
                     else:
                         self.progress_bar.setValue(100)
@@ -1165,7 +1489,7 @@ class RamanDisplayTab(QtGui.QScrollArea):
             fields=raman_fields, model=RamanAnalysis, elements_per_col=1
         )
         self.experiment_id = None
-        self.threads = []
+        self.downloads = DownloadPool(parent=self)
 
         self.file_list.setFixedWidth(130)
         self.progress_bar.setFixedWidth(130)
@@ -1175,14 +1499,24 @@ class RamanDisplayTab(QtGui.QScrollArea):
         self.layout.addWidget(self.weighted_values, 1, 1, 1, 1)
         self.layout.addWidget(self.progress_bar, 1, 0, 1, 1)
 
+    def updateProgress(self):
+        self.progress_bar.setValue(
+            100 * self.downloads.doneCount() / max(self.downloads.count(), 1)
+        )
+
     def loadSpectrum(self, data, thread_id, spectrum_model):
         raman_tabs = QtGui.QTabWidget()
-        byte_table = io.BytesIO()
-        byte_table.write((io.BytesIO(data)).getvalue())
-        byte_table.seek(0)
-        data_table = pd.read_table(byte_table, index_col=False, error_bad_lines=False, encoding='utf-8')
-        spectrum_plot_tab = RamanQueryWidget(data_table) # Replace QtGui.QWidget() with raman display, should use data to load spectrum. 
-                                            # Note: may have to use io.BytesIO(data) to convert to bytes object to read from.
+        try:
+            spectrum = default_spectrum_store().fromBytes(data)
+        except (ValueError, OSError) as e:
+            logger.warning("Could not read spectrum %s: %s", spectrum_model.id, e)
+            if self.experiment_id == thread_id:
+                self.updateProgress()
+            return
+        data_table = pd.DataFrame(
+            np.array(spectrum, dtype=np.float64), columns=["wavenumber", "intensity"]
+        )
+        spectrum_plot_tab = raw_plotter.RamanQueryWidget(data_table)
         spectrum_properties_tab = FieldsDisplayWidget(
             fields=spectrum_fields, model=RamanAnalysis
         )
@@ -1196,9 +1530,7 @@ class RamanDisplayTab(QtGui.QScrollArea):
                 % (str(self.file_list.count() + 1), round(spectrum_model.percent, 2))
             )
             self.raman_info.addWidget(raman_tabs)
-            self.progress_bar.setValue(
-                100 * sum([t.isFinished() for t in self.threads]) / len(self.threads)
-            )
+            self.updateProgress()
 
     @errorCheck(error_text="Error updating Raman display!")
     # def update(self, raman_file_model=None):
@@ -1245,32 +1577,30 @@ class RamanDisplayTab(QtGui.QScrollArea):
                 ]:
                     self.raman_info.removeWidget(w)
 
-                self.threads = []
+                self.downloads.terminate()
                 raman_files=experiment_model.raman_files
                 raman_file = None
                 #print(f"raman_files ar {raman_files}")
                 if raman_files:
                     raman_file = raman_files[0]
                 experiment_id = experiment_model.id
+                self.experiment_id = experiment_id
                 if raman_file:
                     #this may have problems when multiple raman files are present - need to check
-                    session = dal.Session()
-                    raman_analyses = session.query(RamanAnalysis).filter(RamanAnalysis.raman_file_id == raman_file.id).all()
+                    raman_analyses = related(raman_file, RamanAnalysis)
                     if raman_analyses:
                         self.weighted_values.setData(raman_analyses)
                         if len(raman_analyses) > 0:
                             self.progress_bar.setValue(1)
                             for spectrum in raman_analyses:
-                                thread = DownloadThread(
-                                    url=spectrum.raman_file.url,
+                                request = self.downloads.add(
+                                    url=raman_file.url,
                                     thread_id=experiment_id,
                                     info={"spectrum": spectrum},
                                 )
-                                thread.downloadFinished.connect(
+                                request.finished[object, int, object].connect(
                                     lambda data, thread_id, info: self.loadSpectrum(data, thread_id, info['spectrum'])
                                 )
-                                thread.start()
-                                self.threads.append(thread)
                         else:
                             self.progress_bar.setValue(100)
 
@@ -1323,8 +1653,7 @@ class RecipeDisplayTab(QtGui.QScrollArea):
         self.recipe_plot.clear()
         self.recipe_model = recipe_model
         if self.recipe_model:
-            session = dal.Session()
-            steps = session.query(PreparationStep).filter(PreparationStep.recipe_id == recipe_model.id).all()
+            steps = related(recipe_model, PreparationStep)
             step_list = sorted(
                 steps, key=lambda x: getattr(x, "step")
             )
@@ -1483,6 +1812,7 @@ class AdminDisplayTab(QtGui.QScrollArea):
         else:
             self.delete_button.setEnabled(False)
 
+    @origin("AdminDisplayTab.delete_model")
     def delete_model(self):
         confirmation_dialog = QtGui.QMessageBox(self)
         confirmation_dialog.setText("Are you sure you want to delete this recipe?")
@@ -1498,8 +1828,11 @@ class AdminDisplayTab(QtGui.QScrollArea):
             if btn.text() == "OK":
                 try:
                     with dal.session_scope() as session:
-                        model = session.query(experiment).get(self.experiment_id)
+                        model = session.query(Experiment).get(self.experiment_id)
                         session.delete(model)
+                        delete_experiment_summary(session, [self.experiment_id])
+                        inserted, changed = changed_tables(session)
+                        bump_table_versions(session, changed, inserted=inserted)
                         session.commit()
 
                         success_dialog = QtGui.QMessageBox(self)
@@ -1518,11 +1851,15 @@ class AdminDisplayTab(QtGui.QScrollArea):
         confirmation_dialog.buttonClicked.connect(upload_wrapper)
         confirmation_dialog.exec()
 
+    @origin("AdminDisplayTab.toggle_validate_model")
     def toggle_validate_model(self):
         if self.experiment_id:
             with dal.session_scope() as session:
                 model = session.query(Experiment).get(self.experiment_id)
                 model.validated = not model.validated
+                session.flush()
+                refresh_experiment_summary(session, [self.experiment_id])
+                bump_table_versions(session, [Experiment.__table__])
                 session.commit()
                 self.validate_status_label.setText(str(model.validated))
 
@@ -3,7 +3,6 @@ import pyqtgraph as pg
 import numpy as np
 from pandas.api.types import is_numeric_dtype
 import copy
-from sklearn.manifold import TSNE
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtGui import QColor
 from grdb.database.v1_1_0 import dal, Base
@@ -18,7 +17,9 @@ from grdb.database.v1_1_0.models import (
     SemFile,
     SemAnalysis,
 )
-from gresq.util.util import ItemsetsTableModel, ResultsTableModel, BasicLabel, HeaderLabel, SubheaderLabel
+from gresq.util.util import ItemsetsTableModel, ResultsTableModel, BasicLabel, HeaderLabel, SubheaderLabel, frequent_itemsets
+from gresq.util.jobs import default_job_runner
+from gresq.util.embedding import EmbeddingCache, embedding_key, fit_embedding
 
 
 class PlotWidget(QtGui.QWidget):
@@ -138,13 +139,18 @@ class TSNEWidget(QtGui.QStackedWidget):
         self.tsne.back_button.clicked.connect(
             lambda: self.setCurrentWidget(self.feature)
         )
+        self.itemsets_job = None
 
     def setModel(self, model, fields=None):
         self.results_model = model.copy(fields=fields)
-        self.itemsets_model.update_frequent_itemsets(
-            df=self.results_model.df.select_dtypes(include=[np.number, np.bool]),
-            min_support=float(self.feature.min_support_edit.text()),
+        df = self.results_model.df.select_dtypes(include=[np.number, np.bool])
+        if self.itemsets_job is not None:
+            self.itemsets_job.cancel()
+        self.itemsets_job = default_job_runner().submit(
+            frequent_itemsets, args=(df, float(self.feature.min_support_edit.text()))
         )
+        self.itemsets_model.items = df.columns
+        self.itemsets_job.finished.connect(self.itemsets_model.setFrequentItemsets)
         self.feature.setModel(self.itemsets_model)
         self.tsne.setModel(self.results_model)
 
@@ -162,6 +168,8 @@ class TSNEPlot(QtGui.QWidget):
         self.random_seed = np.random.randint(1, 99999)
         self.perplexity = 30
         self.lr = 200.0
+        self.job = None
+        self.embeddings = EmbeddingCache()
 
         self.plot_widget = pg.PlotWidget()
         self.tsne_plot = pg.ScatterPlotItem(
@@ -238,6 +246,8 @@ class TSNEPlot(QtGui.QWidget):
         self.tsneClicked.emit(plot, points)
 
     def setModel(self, model):
+        if self.job is not None:
+            self.job.cancel()
         self.model = model
         self.select_feature.clear()
         self.select_feature.addItem("No Coloring")
@@ -320,7 +330,6 @@ class TSNEPlot(QtGui.QWidget):
 
     def run(self, features):
         self.features = features
-        self.tsne = TSNE(random_state=self.random_seed)
         # print(self.model.df.columns)
         # TODO: self.nonnull_indexes is often undefined
 
@@ -330,8 +339,8 @@ class TSNEPlot(QtGui.QWidget):
             )
             return
 
-        self.nonnull_indexes = ~self.model.df[self.features].isnull().any(1)
-        if self.nonnull_indexes.empty:
+        nonnull_indexes = ~self.model.df[self.features].isnull().any(1)
+        if nonnull_indexes.empty:
             self.showError(
                 "Features: "
                 + self.features
@@ -340,15 +349,54 @@ class TSNEPlot(QtGui.QWidget):
             )
             return
 
-        tsne_input = self.model.df[self.features][self.nonnull_indexes]
-        ids = self.model.df["id"][self.nonnull_indexes]
+        tsne_input = self.model.df[self.features][nonnull_indexes]
+        ids = self.model.df["id"][nonnull_indexes]
         if tsne_input.empty:
             self.showError("Input dataframe should not be empty.")
             return
         elif tsne_input.shape[0] < 2:
             self.showError("TSNE fit requires a minimum of 2 samples.")
             return
-        self.tsne.fit(tsne_input)
+
+        params = {
+            "perplexity": float(self.perplexity_edit.text() or self.perplexity),
+            "learning_rate": float(self.lr_edit.text() or self.lr),
+            "random_state": int(self.random_seed_edit.text() or self.random_seed),
+        }
+        features = list(self.features)
+        if self.job is not None:
+            self.job.cancel()
+        key = embedding_key(features, ids, tsne_input, params)
+        embedding = self.embeddings.get(key)
+        if embedding is not None:
+            self.showEmbedding(embedding, ids, nonnull_indexes)
+            return
+
+        # The fit runs in a job worker, starting from the previous layout when most rows
+        # were embedded before; the plot is updated when it finishes.
+        init = self.embeddings.warmStart(features, ids, tsne_input, params)
+        # Keyed like the embedding cache, so the input array is not hashed again.
+        self.job = default_job_runner().submit(
+            fit_embedding,
+            args=(tsne_input.values,),
+            kwargs=dict(params, init=init),
+            key="tsne:%s:%s" % (key, "warm" if init is not None else "cold"),
+        )
+        self.job.finished.connect(
+            lambda embedding: self.embeddings.put(key, features, ids, params, embedding)
+        )
+        self.job.finished.connect(
+            lambda embedding: self.showEmbedding(embedding, ids, nonnull_indexes)
+        )
+        self.job.failed.connect(lambda error: self.showError("t-SNE failed:\n" + error))
+        self.job.finished.connect(lambda embedding: self.run_button.setEnabled(True))
+        self.job.failed.connect(lambda error: self.run_button.setEnabled(True))
+        self.job.cancelled.connect(lambda: self.run_button.setEnabled(True))
+        self.run_button.setEnabled(False)
+
+    def showEmbedding(self, embedding, ids, nonnull_indexes):
+        self.embedding = embedding
+        self.nonnull_indexes = nonnull_indexes
         self.tsne_plot.clear()
 
         # if model:
@@ -358,8 +406,8 @@ class TSNEPlot(QtGui.QWidget):
         # s = session.query(sample).filter(sample.id==i)[0]
 
         self.tsne_plot.setData(
-            x=self.tsne.embedding_[:, 0],
-            y=self.tsne.embedding_[:, 1],
+            x=embedding[:, 0],
+            y=embedding[:, 1],
             data=ids.tolist()
         )
         self.resetBounds()
@@ -426,7 +474,7 @@ class FeatureSelectionItem(QtGui.QWidget):
 
     def select_features(self, model, index):
         self.feature_list.clearSelection()
-        for item in model.frequent_itemsets["Feature Set"].iloc[index.row()]:
+        for item in model.frequent_itemsets["Feature Set"].iloc[model.sourceRow(index.row())]:
             list_item = self.feature_list.findItems(item, QtCore.Qt.MatchExactly)[0]
             list_item.setSelected(True)
 
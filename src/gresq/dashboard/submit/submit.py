@@ -28,7 +28,7 @@ from sqlalchemy import String, Integer, Float, Numeric, Date
 from gresq.config import config
 from gresq.util.csv2db import build_db
 from gsaraman import GSARaman
-from gsaraman import auto_fitting
+from gresq.util.fitting import cached_auto_fitting
 from gresq.recipe import Recipe as RecipeMDF
 from gresq.util.mdf_adaptor import MDFAdaptor, MDFException
 from gresq.dashboard.query import convertScripts
@@ -1024,7 +1024,7 @@ class FileUploadTab(QtGui.QWidget):
     def validate_raman_files(self, files_response):
         for ri, ram in enumerate(files_response["Raman Files"]):
             try:
-                params = auto_fitting(ram)
+                params = cached_auto_fitting(ram)
             except:
                 return "File formatting issue with file: %s" % ram
         return True
@@ -1460,7 +1460,7 @@ class ReviewTab(QtGui.QScrollArea):
                 session.add(rf)
                 session.flush()
 
-                params = GSARaman.auto_fitting(ram)
+                params = cached_auto_fitting(ram)
                 r = RamanSpectrum(
                     software_name=gsaraman_soft.name,
                     software_version=gsaraman_soft.version,
@@ -1740,7 +1740,7 @@ def make_test_dict(test_sem_file=None, test_raman_file=None):
                 session.add(rf)
                 session.flush()
 
-                params = GSARaman.auto_fitting(ram)
+                params = cached_auto_fitting(ram)
                 r = RamanSpectrum()
                 r.raman_file_id = rf.id
                 r.set_id = rs.id
@@ -6,6 +6,9 @@ import uuid
 from gresq.util.box_adaptor import BoxAdaptor
 from gresq.util.gwidgets import GStackedWidget, ImageWidget
 from gresq.util.util import BasicLabel, HeaderLabel, SubheaderLabel, sql_validator, ConfigParams, MaxSpacer
+from gresq.util.summary import refresh_experiment_summary
+from gresq.util.versions import bump_table_versions, changed_tables
+from gresq.util.vocabulary import default_vocabulary, string_columns
 from grdb.database import dal, Base
 from gresq import __version__ as GRESQ_VERSION
 from gsaraman import __version__ as GSARAMAN_VERSION
@@ -44,7 +47,8 @@ from sqlalchemy import String, Integer, Float, Numeric, Date
 from gresq.config import config
 from gresq.util.csv2db import build_db
 from gsaraman import GSARaman
-from gsaraman import auto_fitting
+from gresq.util.fitting import cached_auto_fitting
+from gresq.util.jobs import default_job_runner
 from gresq.recipe import Recipe as RecipeMDF
 from gresq.util.mdf_adaptor import MDFAdaptor, MDFException
 from gresq.dashboard.query_2_0 import convertScripts
@@ -211,6 +215,10 @@ class FieldsFormWidget(QtGui.QScrollArea):
         self.input_widgets = {}
         self.other_input = {}
         self.units_input = {}
+        self.choices = {}
+        self.completers = {}
+        self.vocabulary = default_vocabulary()
+        self.vocabulary.load(string_columns(model, fields))
 
         for f, field in enumerate(fields):
             row = f % 9
@@ -219,16 +227,9 @@ class FieldsFormWidget(QtGui.QScrollArea):
             tooltip = info['tooltip'] if 'tooltip' in info.keys() else None
             self.layout.addWidget(BasicLabel(info["verbose_name"],tooltip=tooltip), row, 3 * col)
             if sql_validator["str"](getattr(model, field)):
-                input_set = []
                 if "choices" in info.keys():
-                    input_set.extend(info["choices"])
-                    with dal.session_scope() as session:
-                        if hasattr(self.model, field):
-                            for v in session.query(
-                                getattr(self.model, field)
-                            ).distinct():
-                                if getattr(v, field) not in input_set:
-                                    input_set.append(getattr(v, field))
+                    self.choices[field] = list(info["choices"])
+                    input_set = self.choiceItems(field)
 
                     self.input_widgets[field] = QtGui.QComboBox()
                     self.input_widgets[field].addItems(input_set)
@@ -257,16 +258,9 @@ class FieldsFormWidget(QtGui.QScrollArea):
 
                 else:
                     self.input_widgets[field] = QtGui.QLineEdit()
-                    with dal.session_scope() as session:
-                        if hasattr(self.model, field):
-                            entries = [
-                                v[0]
-                                for v in session.query(
-                                    getattr(self.model, field)
-                                ).distinct()
-                            ]
-                            completer = QtGui.QCompleter(entries)
-                            self.input_widgets[field].setCompleter(completer)
+                    entries = self.vocabulary.values(getattr(self.model, field))
+                    self.completers[field] = QtGui.QCompleter(entries)
+                    self.input_widgets[field].setCompleter(self.completers[field])
                 self.layout.addWidget(self.input_widgets[field], row, 3 * col + 1)
 
             elif sql_validator["date"](getattr(model, field)):
@@ -298,6 +292,34 @@ class FieldsFormWidget(QtGui.QScrollArea):
 
         self.setWidgetResizable(True)
         self.setWidget(self.contentWidget)
+        self.vocabulary.updated.connect(self.updateVocabulary)
+
+    def choiceItems(self, field):
+        """
+        Returns the predefined choices of a field followed by the other values already in the
+        database.
+        """
+        items = list(self.choices[field])
+        for v in self.vocabulary.values(getattr(self.model, field)):
+            if v not in items:
+                items.append(v)
+        return items
+
+    def updateVocabulary(self):
+        """
+        Refills combo boxes and completers with the current distinct values of their fields.
+        """
+        for field in self.choices.keys():
+            combo = self.input_widgets[field]
+            current = combo.currentText()
+            combo.clear()
+            combo.addItems(self.choiceItems(field))
+            combo.addItem("Other")
+            combo.setCurrentIndex(max(combo.findText(current), 0))
+        for field, completer in self.completers.items():
+            completer.setModel(
+                QtCore.QStringListModel(self.vocabulary.values(getattr(self.model, field)), completer)
+            )
 
     def validate(self):
         # Future implementations should use 'required' boolean field in info dict instead of a list.
@@ -936,6 +958,8 @@ class FileUploadTab(QtGui.QWidget):
         self.layout = QtGui.QGridLayout(self)
         self.layout.setAlignment(QtCore.Qt.AlignTop)
         self.config = config
+        # Background Raman fits by file path.
+        self.fit_jobs = {}
 
         self.images = GStackedWidget(border=True)
         self.images.setSizePolicy(QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Minimum)
@@ -1014,6 +1038,10 @@ class FileUploadTab(QtGui.QWidget):
 
         if isinstance(raman_file_path, str) and os.path.isfile(raman_file_path):
             self.spectra.addWidget(RamanFileWidget(raman_file_path),name=raman_file_path) # RamanFileWidget claass should be modified to display spectrum
+            # Fit in the background so validation finds the result in the fit cache.
+            self.fit_jobs[raman_file_path] = default_job_runner().submit(
+                cached_auto_fitting, args=(raman_file_path,)
+            )
 
     def importFile(self):
         if self.config.mode == "local":
@@ -1064,7 +1092,15 @@ class FileUploadTab(QtGui.QWidget):
     def validate_raman_files(self, files_response):
         for ri, ram in enumerate(files_response["Raman Files"]):
             try:
-                params = auto_fitting(ram)
+                job = self.fit_jobs.get(ram)
+                if job is not None and job.future is not None and not job.isCancelled():
+                    # Wait for the background fit instead of fitting the file again; if it
+                    # failed, the file is fitted here to report the error.
+                    try:
+                        job.future.result()
+                    except Exception:
+                        pass
+                params = cached_auto_fitting(ram)
             except:
                 return "File formatting issue with file: %s" % ram
         return True
@@ -1099,6 +1135,9 @@ class FileUploadTab(QtGui.QWidget):
         self.images.clear()
         self.spectra.clear()
         self.wavelength_input.clear()
+        for job in self.fit_jobs.values():
+            job.cancel()
+        self.fit_jobs = {}
 
 
 class ReviewTab(QtGui.QScrollArea):
@@ -1500,7 +1539,7 @@ class ReviewTab(QtGui.QScrollArea):
                 session.add(rf)
                 session.flush()
 
-                params = GSARaman.auto_fitting(ram)
+                params = cached_auto_fitting(ram)
                 r = RamanSpectrum(
                     software_name=gsaraman_soft.name,
                     software_version=gsaraman_soft.version,
@@ -1675,7 +1714,11 @@ class ReviewTab(QtGui.QScrollArea):
                         #   json_name='raman'
                         #   )
                         # dataset_id = self.upload_raman(response_dict,raman_dict,box_file,dataset_id)
+                        refresh_experiment_summary(session, [s.id])
+                        inserted, changed = changed_tables(session)
+                        bump_table_versions(session, changed, inserted=inserted)
                         session.commit()
+                        default_vocabulary().refresh()
                         if config.mode == 'nanohub':
                             for ram in files_response["Raman Files"]:
                                 os.remove(ram)
@@ -1780,7 +1823,7 @@ def make_test_dict(test_sem_file=None, test_raman_file=None):
                 session.add(rf)
                 session.flush()
 
-                params = GSARaman.auto_fitting(ram)
+                params = cached_auto_fitting(ram)
                 r = RamanSpectrum()
                 r.raman_file_id = rf.id
                 r.set_id = rs.id
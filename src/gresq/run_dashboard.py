@@ -1,13 +1,22 @@
 from __future__ import division
 import sys
+import time
+
+_started = time.perf_counter()
+_started_modules = len(sys.modules)
+
 import os
 import argparse
 import logging
 from PyQt5 import QtGui
 from gresq.config import Config
-from grdb.database import dal as dal_2_0
 from grdb.database.v1_1_0 import dal
-from gresq.dashboard import GSADashboard
+from gresq.util.lazy import StartupTimer
+from gresq.util.engines import init_engines
+from gresq.util.instrumentation import default_statement_log
+
+_imported = time.perf_counter()
+_imported_modules = len(sys.modules)
 
 def main():
     """Main program for gresq dashboard.
@@ -41,12 +50,15 @@ def main():
         "--db_mode",
         default="development",
         type=str,
-        help="Database mode: development, testing, or production",
+        help="Database mode: development, testing, production, or replica (production, "
+        "queried through a local SQLite replica)",
     )
     parser.add_argument(
         "-v", "--verbose", help="increase output verbosity", action="store_true"
     )
     kwargs = vars(parser.parse_args())
+    timer = StartupTimer(start=_started)
+    timer.record("base imports", _imported - _started, _imported_modules - _started_modules)
 
     if kwargs["verbose"]:
         logging.basicConfig(level=logging.DEBUG)
@@ -61,7 +73,7 @@ def main():
     db_config_prefix = None
     if kwargs["db_mode"].lower() == "development":
         db_config_prefix = "DEV_DATABASE"
-    elif kwargs["db_mode"].lower() == "production":
+    elif kwargs["db_mode"].lower() in ("production", "replica"):
         db_config_prefix = "PROD_DATABASE"
         db_debug = False
     elif kwargs["db_mode"] == "testing":
@@ -69,6 +81,7 @@ def main():
 
     db_config_suffix = ""
     dbconfig_file = kwargs["db_config_path"]
+    read_config_file = dbconfig_file
     if kwargs["nanohub"] == True:
         mode = "nanohub"
         groups = os.getgroups()
@@ -90,6 +103,7 @@ def main():
             dbconfig_file = os.path.join(
                 kwargs["db_config_path"], "readonly", "db_config.py"
             )
+        read_config_file = os.path.join(kwargs["db_config_path"], "readonly", "db_config.py")
     else:
         mode = "local"
         privileges = {"read": True, "write": True, "validate": True}
@@ -104,22 +118,58 @@ def main():
         debug=db_debug,
         dbconfig_file=dbconfig_file,
     )
+    # Queries, previews and vocabulary lookups use the _READ role when it is configured.
+    read_conf = Config(
+        prefix=db_config_prefix,
+        suffix="_READ",
+        debug=db_debug,
+        multiarg=True,
+        dbconfig_file=read_config_file,
+    )
     # logging.debug(db_conf.DATABASEURI)
     # logging.debug(db_conf.DATABASEARGS)
 
     # dal.init_db(db_conf, privileges=privileges)
-    dal_2_0.init_db(db_conf, privileges=privileges)
+    with timer.phase("database"):
+        writer, reader = init_engines(db_conf, privileges, read_conf=read_conf)
+    default_statement_log().install(writer)
+    if reader is not writer:
+        default_statement_log().install(reader)
+
+    # In replica mode the query tab reads from a local copy once it has been synced; writes
+    # still go to the writer.
+    replica = None
+    if kwargs["db_mode"].lower() == "replica":
+        from gresq.util.replica import Replica, ReplicaSync, replica_path, set_active_replica
+        from gresq.util.vocabulary import default_vocabulary
+
+        with timer.phase("replica"):
+            replica = Replica(replica_path(db_conf), primary=reader)
+            set_active_replica(replica)
+        default_statement_log().install(replica.engine)
 
     box_config_path = os.path.abspath(kwargs["box_config_path"])
 
-    app = QtGui.QApplication([])
-    dashboard = GSADashboard(
-        mode=mode,
-        box_config_path=box_config_path,
-        privileges=privileges,
-        test=kwargs["test"],
-    )
-    dashboard.show()
+    with timer.phase("QApplication"):
+        app = QtGui.QApplication([])
+    with timer.phase("dashboard imports"):
+        from gresq.dashboard import GSADashboard
+    with timer.phase("dashboard window"):
+        dashboard = GSADashboard(
+            mode=mode,
+            box_config_path=box_config_path,
+            privileges=privileges,
+            test=kwargs["test"],
+        )
+    if replica is not None:
+        replica_sync = ReplicaSync(
+            replica, interval=db_conf.REPLICA_SYNC_SECONDS, parent=dashboard
+        )
+        replica_sync.synced.connect(lambda copied: copied and default_vocabulary().refresh())
+        replica_sync.start()
+    timer.watchFirstPaint(app)
+    with timer.phase("first tab"):
+        dashboard.show()
     sys.exit(app.exec_())
 
 
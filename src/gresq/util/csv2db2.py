@@ -13,6 +13,7 @@ from grdb.database.v1_1_0 import (
 )
 from gresq.config import config
 from gresq.recipe import Recipe
+from gresq.util.fitting import cached_auto_fitting
 from sqlalchemy import String, Integer, Float, Numeric
 import pandas as pd
 import os
@@ -260,7 +261,7 @@ def build_db(session, filepath, sem_raman_path=None):
             session.add(rf)
             session.flush()
 
-            params = GSARaman.auto_fitting(ram)
+            params = cached_auto_fitting(ram)
             r = raman_spectrum()
             r.raman_file_id = rf.id
             r.set_id = rs.id
@@ -22,16 +22,20 @@ import pandas as pd
 import os
 import sys
 import datetime
+import logging
 from datetime import date
 
 par = os.path.abspath(os.path.pardir)
 sys.path.append(os.path.join(par, "src", "gresq", "dashboard", "gsaraman", "src"))
-from gsaraman.gsaraman import auto_fitting
+from gresq.util.fitting import FitStream
+from gresq.util.versions import bump_table_versions, changed_tables
 from gresq.dashboard.submit.util import get_or_add_software_row
 from gresq import __version__ as GRESQ_VERSION
 from gsaimage import __version__ as GSAIMAGE_VERSION
 from gsaraman import __version__ as GSARAMAN_VERSION
 
+logger = logging.getLogger(__name__)
+
 sample_key = {"experiment_date": "DATE"}
 properties_key = {
     "average_thickness_of_growth": "PROPERTY: Average Thickness of Growth (nm)",
@@ -129,7 +133,31 @@ def convert_db(data):
     return data
 
 
-def build_db(session, filepath, sem_raman_path=None, nrun=None, box_config_path=None):
+def raman_paths(sem_raman_path, reference_ids):
+    """
+    Returns the Raman spectrum paths of the given sample folders, in the order build_db
+    reads them.
+    """
+    paths = []
+    if sem_raman_path is None:
+        return paths
+    for reference_id in reference_ids:
+        folder = os.path.join(sem_raman_path, reference_id)
+        if os.path.isdir(folder):
+            for f in os.listdir(folder):
+                if f.split(".")[-1] == "txt":
+                    paths.append(os.path.join(folder, f))
+    return paths
+
+
+def build_db(session, filepath, sem_raman_path=None, nrun=None, box_config_path=None, fit_workers=None):
+    """
+    Loads the recipe CSV and the SEM/Raman files of each sample into the database.
+
+    Every Raman spectrum of the run is fitted up front across fit_workers processes; rows are
+    loaded while fitting continues and each row waits only for its own spectra. Spectra that
+    cannot be fitted are skipped and listed in the log at the end.
+    """
     data = pd.read_csv(os.path.join(filepath, "recipe_trial.csv"))
     data = convert_db(data)
     box_adaptor = BoxAdaptor(box_config_path)
@@ -157,286 +185,314 @@ def build_db(session, filepath, sem_raman_path=None, nrun=None, box_config_path=
     if nrun == None:
         nrun = data.shape[0]
 
-    for i in range(nrun):
-        if "Kaihao" in author_column[i]:
-
-            s = Sample(
-                software_name=gresq_soft.name, software_version=gresq_soft.version
-            )
-            s.material_name = "Graphene"
-            s.validated = True
-            date_string = data[sample_key["experiment_date"]][i]
-            if pd.isnull(date_string) == False:
-                s.experiment_date = convert_date(date_string)
-
-            session.add(s)
-            session.flush()
-
-            pr = Properties()
-            pr.sample_id = s.id
-            for key, header in properties_key.items():
-                value = data[header][i]
-                if pd.isnull(value) == False:
-                    value = convert(value, getattr(Properties, key), header=header)
-                    setattr(pr, key, value)
+    fits = FitStream(
+        raman_paths(
+            sem_raman_path,
+            [str(box_folder[i]) for i in range(nrun) if "Kaihao" in author_column[i]],
+        ),
+        max_workers=fit_workers,
+    )
 
-            r = Recipe()
-            r.sample_id = s.id
-            for key, header in recipe_key.items():
-                value = data[header][i]
-                if pd.isnull(value) == False:
-                    value = convert(value, getattr(Recipe, key), header=header)
-                    setattr(r, key, value)
-            session.add(pr)
-            session.add(r)
-            session.commit()
-
-            total_steps = 0
-
-            for j in range(0, annealing_df.shape[1], 9):
-                prep_df = annealing_df.iloc[:, j : j + 9].copy()
-
-                # initial_cols = prep_df.columns
-                for col in prep_df.columns:
-                    for key, value in preparation_step_key.items():
-                        if (
-                            value in col
-                            and preparation_step_key["carbon_source_flow_rate"]
-                            not in col
-                        ):
-                            prep_df.rename(columns={col: value}, inplace=True)
-                        elif (
-                            value in col
-                            and value == preparation_step_key["carbon_source_flow_rate"]
-                        ):
-                            prep_df.rename(columns={col: value}, inplace=True)
-                prep = PreparationStep()
-                prep.name = "Annealing"
-                prep.recipe_id = r.id
-                for key, header in preparation_step_key.items():
-                    try:
-                        value = prep_df[header][i]
-                        if pd.isnull(value) == False:
-                            value = convert(
-                                value, getattr(PreparationStep, key), header=header
-                            )
-                            setattr(prep, key, value)
-                    except Exception as e:
-                        print("###################")
-                        print("%s Row %s Column %s" % (prep.name, i, j))
-                        print("Header:  '%s'" % header)
-                        print(e)
-                if prep.duration != None:
-                    prep.step = total_steps
-                    total_steps += 1
-                    session.add(prep)
-                    session.commit()
-
-            for j in range(0, growing_df.shape[1], 9):
-                prep_df = growing_df.iloc[:, j : j + 9].copy()
-
-                for col in prep_df.columns:
-                    for key, value in preparation_step_key.items():
-                        if (
-                            value in col
-                            and preparation_step_key["carbon_source_flow_rate"]
-                            not in col
-                        ):
-                            prep_df.rename(columns={col: value}, inplace=True)
-                        elif (
-                            value in col
-                            and value == preparation_step_key["carbon_source_flow_rate"]
-                        ):
-                            prep_df.rename(columns={col: value}, inplace=True)
-                prep = PreparationStep()
-                prep.name = "Growing"
-                prep.recipe_id = r.id
-                for key, header in preparation_step_key.items():
-                    try:
-                        value = prep_df[header][i]
-                        if pd.isnull(value) == False:
-                            value = convert(
-                                value, getattr(PreparationStep, key), header=header
+    try:
+        for i in range(nrun):
+            if "Kaihao" in author_column[i]:
+
+                s = Sample(
+                    software_name=gresq_soft.name, software_version=gresq_soft.version
+                )
+                s.material_name = "Graphene"
+                s.validated = True
+                date_string = data[sample_key["experiment_date"]][i]
+                if pd.isnull(date_string) == False:
+                    s.experiment_date = convert_date(date_string)
+
+                session.add(s)
+                session.flush()
+
+                pr = Properties()
+                pr.sample_id = s.id
+                for key, header in properties_key.items():
+                    value = data[header][i]
+                    if pd.isnull(value) == False:
+                        value = convert(value, getattr(Properties, key), header=header)
+                        setattr(pr, key, value)
+
+                r = Recipe()
+                r.sample_id = s.id
+                for key, header in recipe_key.items():
+                    value = data[header][i]
+                    if pd.isnull(value) == False:
+                        value = convert(value, getattr(Recipe, key), header=header)
+                        setattr(r, key, value)
+                session.add(pr)
+                session.add(r)
+                session.commit()
+
+                total_steps = 0
+
+                for j in range(0, annealing_df.shape[1], 9):
+                    prep_df = annealing_df.iloc[:, j : j + 9].copy()
+
+                    # initial_cols = prep_df.columns
+                    for col in prep_df.columns:
+                        for key, value in preparation_step_key.items():
+                            if (
+                                value in col
+                                and preparation_step_key["carbon_source_flow_rate"]
+                                not in col
+                            ):
+                                prep_df.rename(columns={col: value}, inplace=True)
+                            elif (
+                                value in col
+                                and value == preparation_step_key["carbon_source_flow_rate"]
+                            ):
+                                prep_df.rename(columns={col: value}, inplace=True)
+                    prep = PreparationStep()
+                    prep.name = "Annealing"
+                    prep.recipe_id = r.id
+                    for key, header in preparation_step_key.items():
+                        try:
+                            value = prep_df[header][i]
+                            if pd.isnull(value) == False:
+                                value = convert(
+                                    value, getattr(PreparationStep, key), header=header
+                                )
+                                setattr(prep, key, value)
+                        except Exception as e:
+                            print("###################")
+                            print("%s Row %s Column %s" % (prep.name, i, j))
+                            print("Header:  '%s'" % header)
+                            print(e)
+                    if prep.duration != None:
+                        prep.step = total_steps
+                        total_steps += 1
+                        session.add(prep)
+                        session.commit()
+
+                for j in range(0, growing_df.shape[1], 9):
+                    prep_df = growing_df.iloc[:, j : j + 9].copy()
+
+                    for col in prep_df.columns:
+                        for key, value in preparation_step_key.items():
+                            if (
+                                value in col
+                                and preparation_step_key["carbon_source_flow_rate"]
+                                not in col
+                            ):
+                                prep_df.rename(columns={col: value}, inplace=True)
+                            elif (
+                                value in col
+                                and value == preparation_step_key["carbon_source_flow_rate"]
+                            ):
+                                prep_df.rename(columns={col: value}, inplace=True)
+                    prep = PreparationStep()
+                    prep.name = "Growing"
+                    prep.recipe_id = r.id
+                    for key, header in preparation_step_key.items():
+                        try:
+                            value = prep_df[header][i]
+                            if pd.isnull(value) == False:
+                                value = convert(
+                                    value, getattr(PreparationStep, key), header=header
+                                )
+                                setattr(prep, key, value)
+                        except Exception as e:
+                            print("###################")
+                            print("%s Row %s Column %s" % (prep.name, i, j))
+                            print("Header:  '%s'" % header)
+                            print(e)
+                    if prep.duration != None:
+                        prep.step = total_steps
+                        total_steps += 1
+                        session.add(prep)
+                        session.commit()
+
+                for j in range(0, cooling_df.shape[1], 9):
+                    prep_df = cooling_df.iloc[:, j : j + 9].copy()
+                    if prep_df.shape[1] < 9:
+                        break
+                    for col in prep_df.columns:
+                        for key, value in preparation_step_key.items():
+                            if (
+                                value in col
+                                and preparation_step_key["carbon_source_flow_rate"]
+                                not in col
+                            ):
+                                prep_df.rename(columns={col: value}, inplace=True)
+                            elif (
+                                value in col
+                                and value == preparation_step_key["carbon_source_flow_rate"]
+                            ):
+                                prep_df.rename(columns={col: value}, inplace=True)
+                    prep = PreparationStep()
+                    prep.name = "Cooling"
+                    prep.recipe_id = r.id
+                    cooling_value = cooling_rate[i]
+                    if pd.isnull(cooling_value) == False:
+                        prep.cooling_rate = cooling_value
+
+                    for key, header in preparation_step_key.items():
+                        try:
+                            value = prep_df[header][i]
+                            if pd.isnull(value) == False:
+                                value = convert(
+                                    value, getattr(PreparationStep, key), header=header
+                                )
+                                setattr(prep, key, value)
+                        except Exception as e:
+                            print("###################")
+                            print("%s Row %s Column %s" % (prep.name, i, j))
+                            print("Header:  '%s'" % header)
+                            print(e)
+                    if prep.duration != None:
+                        prep.step = total_steps
+                        total_steps += 1
+                        session.add(prep)
+                        session.commit()
+
+                ### RAMAN IS A SEPARATE DATASET FROM SAMPLE ###
+                rs = RamanSet()
+                rs.sample_id = s.id
+                rs.experiment_date = s.experiment_date
+                session.add(rs)
+                session.flush()
+
+                reference_id = str(box_folder[i])
+                if os.path.isdir(os.path.join(sem_raman_path, reference_id)):
+                    files = os.listdir(os.path.join(sem_raman_path, reference_id))
+                    files_response = {
+                        "Raman Files": [],
+                        "SEM Image Files": [],
+                        "Raman Wavelength": 532,
+                    }
+                    for f in files:
+                        if f.split(".")[-1] == "txt":
+                            files_response["Raman Files"].append(
+                                os.path.join(sem_raman_path, reference_id, f)
                             )
-                            setattr(prep, key, value)
-                    except Exception as e:
-                        print("###################")
-                        print("%s Row %s Column %s" % (prep.name, i, j))
-                        print("Header:  '%s'" % header)
-                        print(e)
-                if prep.duration != None:
-                    prep.step = total_steps
-                    total_steps += 1
-                    session.add(prep)
-                    session.commit()
-
-            for j in range(0, cooling_df.shape[1], 9):
-                prep_df = cooling_df.iloc[:, j : j + 9].copy()
-                if prep_df.shape[1] < 9:
-                    break
-                for col in prep_df.columns:
-                    for key, value in preparation_step_key.items():
-                        if (
-                            value in col
-                            and preparation_step_key["carbon_source_flow_rate"]
-                            not in col
-                        ):
-                            prep_df.rename(columns={col: value}, inplace=True)
-                        elif (
-                            value in col
-                            and value == preparation_step_key["carbon_source_flow_rate"]
-                        ):
-                            prep_df.rename(columns={col: value}, inplace=True)
-                prep = PreparationStep()
-                prep.name = "Cooling"
-                prep.recipe_id = r.id
-                cooling_value = cooling_rate[i]
-                if pd.isnull(cooling_value) == False:
-                    prep.cooling_rate = cooling_value
-
-                for key, header in preparation_step_key.items():
-                    try:
-                        value = prep_df[header][i]
-                        if pd.isnull(value) == False:
-                            value = convert(
-                                value, getattr(PreparationStep, key), header=header
+                        elif f.split(".")[-1] == "tif":
+                            files_response["SEM Image Files"].append(
+                                os.path.join(sem_raman_path, reference_id, f)
                             )
-                            setattr(prep, key, value)
-                    except Exception as e:
-                        print("###################")
-                        print("%s Row %s Column %s" % (prep.name, i, j))
-                        print("Header:  '%s'" % header)
-                        print(e)
-                if prep.duration != None:
-                    prep.step = total_steps
-                    total_steps += 1
-                    session.add(prep)
-                    session.commit()
-
-            ### RAMAN IS A SEPARATE DATASET FROM SAMPLE ###
-            rs = RamanSet()
-            rs.sample_id = s.id
-            rs.experiment_date = s.experiment_date
-            session.add(rs)
-            session.flush()
-
-            reference_id = str(box_folder[i])
-            if os.path.isdir(os.path.join(sem_raman_path, reference_id)):
-                files = os.listdir(os.path.join(sem_raman_path, reference_id))
-                files_response = {
-                    "Raman Files": [],
-                    "SEM Image Files": [],
-                    "Raman Wavelength": 532,
-                }
-                for f in files:
-                    if f.split(".")[-1] == "txt":
-                        files_response["Raman Files"].append(
-                            os.path.join(sem_raman_path, reference_id, f)
-                        )
-                    elif f.split(".")[-1] == "tif":
-                        files_response["SEM Image Files"].append(
-                            os.path.join(sem_raman_path, reference_id, f)
-                        )
 
-                if len(files_response["Raman Files"]) > 0:
-                    files_response["Characteristic Percentage"] = [
-                        100 / len(files_response["Raman Files"])
-                    ] * len(files_response["Raman Files"])
-                    for ri, ram in enumerate(files_response["Raman Files"]):
-                        rf = RamanFile()
-                        rf.filename = os.path.basename(ram)
-                        rf.sample_id = s.id
-                        rf.url = upload_file(
-                            box_adaptor, ram, box_config_path=box_config_path
-                        )
-                        if files_response["Raman Wavelength"] != None:
-                            rf.wavelength = files_response["Raman Wavelength"]
-                        session.add(rf)
-                        session.flush()
+                    fitted = {}
+                    for ram in files_response["Raman Files"]:
+                        result = fits.get(ram)
+                        if result.error is None:
+                            fitted[ram] = result.params
+                    files_response["Raman Files"] = [
+                        ram for ram in files_response["Raman Files"] if ram in fitted
+                    ]
 
-                        params = auto_fitting(ram)
-                        r = RamanSpectrum(
-                            software_name=gsaraman_soft.name,
-                            software_version=gsaraman_soft.version,
-                        )
-                        r.raman_file_id = rf.id
-                        r.set_id = rs.id
-                        if files_response["Characteristic Percentage"] != None:
-                            r.percent = float(
-                                files_response["Characteristic Percentage"][ri]
+                    if len(files_response["Raman Files"]) > 0:
+                        files_response["Characteristic Percentage"] = [
+                            100 / len(files_response["Raman Files"])
+                        ] * len(files_response["Raman Files"])
+                        for ri, ram in enumerate(files_response["Raman Files"]):
+                            rf = RamanFile()
+                            rf.filename = os.path.basename(ram)
+                            rf.sample_id = s.id
+                            rf.url = upload_file(
+                                box_adaptor, ram, box_config_path=box_config_path
                             )
-                        else:
-                            r.percent = 0.0
-                        for peak in params.keys():
-                            for v in params[peak].keys():
-                                key = "%s_%s" % (peak, v)
-                                setattr(r, key, float(params[peak][v]))
-                        session.add(r)
-                        session.flush()
-
-                    rs_fields = [
-                        "d_peak_shift",
-                        "d_peak_amplitude",
-                        "d_fwhm",
-                        "g_peak_shift",
-                        "g_peak_amplitude",
-                        "g_fwhm",
-                        "g_prime_peak_shift",
-                        "g_prime_peak_amplitude",
-                        "g_prime_fwhm",
-                    ]
-                    for field in rs_fields:
-                        setattr(
-                            rs,
-                            field,
-                            sum(
-                                [
-                                    getattr(spect, field)
-                                    * getattr(spect, "percent")
-                                    / 100.0
-                                    for spect in rs.raman_spectra
-                                ]
-                            ),
-                        )
-                    rs.d_to_g = sum(
-                        [
-                            getattr(spect, "d_peak_amplitude")
-                            / getattr(spect, "g_peak_amplitude")
-                            * getattr(spect, "percent")
-                            / 100.0
-                            for spect in rs.raman_spectra
-                        ]
-                    )
-                    rs.gp_to_g = sum(
-                        [
-                            getattr(spect, "g_prime_peak_amplitude")
-                            / getattr(spect, "g_peak_amplitude")
-                            * getattr(spect, "percent")
-                            / 100.0
-                            for spect in rs.raman_spectra
+                            if files_response["Raman Wavelength"] != None:
+                                rf.wavelength = files_response["Raman Wavelength"]
+                            session.add(rf)
+                            session.flush()
+
+                            params = fitted[ram]
+                            r = RamanSpectrum(
+                                software_name=gsaraman_soft.name,
+                                software_version=gsaraman_soft.version,
+                            )
+                            r.raman_file_id = rf.id
+                            r.set_id = rs.id
+                            if files_response["Characteristic Percentage"] != None:
+                                r.percent = float(
+                                    files_response["Characteristic Percentage"][ri]
+                                )
+                            else:
+                                r.percent = 0.0
+                            for peak in params.keys():
+                                for v in params[peak].keys():
+                                    key = "%s_%s" % (peak, v)
+                                    setattr(r, key, float(params[peak][v]))
+                            session.add(r)
+                            session.flush()
+
+                        rs_fields = [
+                            "d_peak_shift",
+                            "d_peak_amplitude",
+                            "d_fwhm",
+                            "g_peak_shift",
+                            "g_peak_amplitude",
+                            "g_fwhm",
+                            "g_prime_peak_shift",
+                            "g_prime_peak_amplitude",
+                            "g_prime_fwhm",
                         ]
-                    )
-                    session.flush()
-
-                if len(files_response["SEM Image Files"]) > 0:
-                    for f in files_response["SEM Image Files"]:
-                        sf = SemFile()
-                        sf.sample_id = s.id
-                        sf.filename = os.path.basename(f)
-                        sf.url = upload_file(
-                            box_adaptor, f, box_config_path=box_config_path
+                        for field in rs_fields:
+                            setattr(
+                                rs,
+                                field,
+                                sum(
+                                    [
+                                        getattr(spect, field)
+                                        * getattr(spect, "percent")
+                                        / 100.0
+                                        for spect in rs.raman_spectra
+                                    ]
+                                ),
+                            )
+                        rs.d_to_g = sum(
+                            [
+                                getattr(spect, "d_peak_amplitude")
+                                / getattr(spect, "g_peak_amplitude")
+                                * getattr(spect, "percent")
+                                / 100.0
+                                for spect in rs.raman_spectra
+                            ]
+                        )
+                        rs.gp_to_g = sum(
+                            [
+                                getattr(spect, "g_prime_peak_amplitude")
+                                / getattr(spect, "g_peak_amplitude")
+                                * getattr(spect, "percent")
+                                / 100.0
+                                for spect in rs.raman_spectra
+                            ]
                         )
-                        session.add(sf)
                         session.flush()
 
-            auth = Author()
-            auth.first_name = "Kaihao"
-            auth.last_name = "Zhang"
-            auth.institution = "University of Illinois at Urbana-Champaign"
-
-            if "Kaihao" in author_column[i]:
-                auth.sample_id = s.id
-                auth.raman_id = rs.id
-                session.add(auth)
-
-            session.commit()
+                    if len(files_response["SEM Image Files"]) > 0:
+                        for f in files_response["SEM Image Files"]:
+                            sf = SemFile()
+                            sf.sample_id = s.id
+                            sf.filename = os.path.basename(f)
+                            sf.url = upload_file(
+                                box_adaptor, f, box_config_path=box_config_path
+                            )
+                            session.add(sf)
+                            session.flush()
+
+                auth = Author()
+                auth.first_name = "Kaihao"
+                auth.last_name = "Zhang"
+                auth.institution = "University of Illinois at Urbana-Champaign"
+
+                if "Kaihao" in author_column[i]:
+                    auth.sample_id = s.id
+                    auth.raman_id = rs.id
+                    session.add(auth)
+
+                inserted, changed = changed_tables(session)
+                bump_table_versions(session, changed, inserted=inserted)
+                session.commit()
+
+        fits.finish()
+    finally:
+        fits.close()
+    if len(fits.errors) > 0:
+        logger.warning("%s Raman spectra could not be fitted:" % len(fits.errors))
+        for path, error in fits.errors.items():
+            logger.warning("  %s: %s" % (path, error))
@@ -0,0 +1,154 @@
+"""
+t-SNE embeddings for the stats tab.
+
+EmbeddingCache keeps the embeddings computed in a session, keyed by the feature names, the
+row ids, a hash of the feature matrix and the t-SNE parameters, so going back to a feature
+selection, or recoloring, does not fit again. When the rows of a query changed (a few
+experiments added or removed), warmStart builds an initial layout from the last embedding of
+the same features: known rows keep their coordinates and new rows start next to their
+nearest known neighbour in feature space. Fits started from it need fewer iterations and
+keep the plot in place.
+"""
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Iterations of a warm-started fit (sklearn's minimum is 250; a cold fit runs 1000).
+warm_start_iterations = 500
+
+
+def _iterations_parameter():
+    from sklearn.manifold import TSNE
+
+    parameters = inspect.signature(TSNE).parameters
+    return "max_iter" if "max_iter" in parameters else "n_iter"
+
+
+def fit_embedding(data, perplexity=30.0, learning_rate=200.0, random_state=None, init=None):
+    """
+    Fits t-SNE to the rows of data and returns the 2D embedding. Runs in a job worker.
+
+    data:               (array) Features without missing values, one row per sample.
+    perplexity:         (float) t-SNE perplexity.
+    learning_rate:      (float) t-SNE learning rate.
+    random_state:       (int) Seed of the fit.
+    init:               (array) Initial layout, e.g. from EmbeddingCache.warmStart. Warm
+                        starts skip early exaggeration and run warm_start_iterations.
+    """
+    from sklearn.manifold import TSNE
+
+    kwargs = {
+        "perplexity": perplexity,
+        "learning_rate": learning_rate,
+        "random_state": random_state,
+    }
+    if init is not None:
+        kwargs["init"] = np.asarray(init, dtype=np.float32)
+        kwargs["early_exaggeration"] = 1.0
+        kwargs[_iterations_parameter()] = warm_start_iterations
+    return TSNE(**kwargs).fit(np.asarray(data, dtype=np.float32)).embedding_
+
+
+def _params_key(params):
+    return tuple(sorted(params.items()))
+
+
+def embedding_key(features, ids, data, params):
+    """
+    Returns a key identifying an embedding of data.
+
+    features:           (list of str) Feature names, the columns of data.
+    ids:                (list) Row ids.
+    data:               (DataFrame or array) Feature matrix.
+    params:             (dict) t-SNE parameters.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((list(features), _params_key(params))).encode())
+    digest.update(pd.util.hash_array(np.asarray(ids)).tobytes())
+    digest.update(pd.util.hash_pandas_object(pd.DataFrame(data), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings computed in a session (see the module docstring).
+
+    max_entries:        (int) Number of embeddings kept.
+    min_overlap:        (float) Fraction of the rows that must have been embedded before for
+                        warmStart to return a layout.
+    """
+
+    def __init__(self, max_entries=16, min_overlap=0.5):
+        self.max_entries = max_entries
+        self.min_overlap = min_overlap
+        self.entries = OrderedDict()
+        # Last embedding per (features, params): (ids, embedding).
+        self.latest = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the embedding stored under key, or None.
+        """
+        with self._lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, features, ids, params, embedding):
+        """
+        Stores an embedding and remembers it as the start of later warm starts.
+        """
+        with self._lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.latest[(tuple(features), _params_key(params))] = (
+                np.asarray(ids),
+                np.asarray(embedding),
+            )
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.latest.clear()
+
+    def warmStart(self, features, ids, data, params):
+        """
+        Returns an initial layout for embedding data from the last embedding of the same
+        features and parameters, or None if too few of the rows were embedded before.
+        """
+        with self._lock:
+            previous = self.latest.get((tuple(features), _params_key(params)))
+        if previous is None:
+            return None
+        previous_ids, previous_embedding = previous
+        if not pd.Index(previous_ids).is_unique:
+            return None
+        ids = np.asarray(ids)
+        data = np.asarray(data, dtype=float)
+        position = pd.Index(previous_ids).get_indexer(ids)
+        known = position >= 0
+        if known.sum() < max(2, self.min_overlap * len(ids)):
+            return None
+
+        init = np.empty((len(ids), previous_embedding.shape[1]))
+        init[known] = previous_embedding[position[known]]
+        unknown = np.flatnonzero(~known)
+        if len(unknown) > 0:
+            # New rows start next to the closest known row, with standardized features.
+            scale = data.std(axis=0)
+            scale[scale == 0] = 1.0
+            known_data = data[known] / scale
+            known_init = init[known]
+            spread = known_init.std(axis=0) * 0.01
+            rng = np.random.RandomState(params.get("random_state"))
+            for row in unknown:
+                distances = ((known_data - data[row] / scale) ** 2).sum(axis=1)
+                init[row] = known_init[np.argmin(distances)] + rng.normal(0, spread)
+        return init
@@ -0,0 +1,198 @@
+"""
+Database engines per role.
+
+The dashboard uses two engines: the writer (dal.engine, used through dal.session_scope by
+submissions and admin actions) and the reader used by queries, previews, vocabulary lookups
+and replica syncs. The reader is built from the _READ configuration of the database prefix
+when it points at a database of its own, so query load can be moved to read replicas;
+otherwise reads share the writer.
+
+Engine options are read from the _ARGS variables, a Python dict literal:
+
+    PROD_DATABASE_ARGS_READ="{'pool_size': 10, 'pool_pre_ping': True,
+                              'statement_timeout': 30000, 'stream_results': True,
+                              'ssl_ca': '/path/to/ca.pem'}"
+
+pool_size, max_overflow, pool_timeout, pool_recycle and pool_pre_ping configure the
+connection pool, statement_timeout (ms) makes PostgreSQL and MySQL abort longer statements,
+and stream_results reads results through server-side cursors. Other keys are passed to the
+DBAPI connect() as before.
+
+With psycopg2 (or psycopg 3) the timeout is a startup option of each connection, so the
+rollback of a connection returned to the pool cannot undo it; other drivers set it outside
+a transaction when the connection is opened.
+"""
+import ast
+import copy
+import logging
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from grdb.database import dal
+
+logger = logging.getLogger(__name__)
+
+pool_options = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping")
+engine_options = pool_options + ("statement_timeout", "stream_results")
+
+# Statement setting a per-session timeout in milliseconds, per dialect.
+timeout_statements = {
+    "postgresql": "SET statement_timeout = %d",
+    "mysql": "SET SESSION max_execution_time = %d",
+}
+
+
+def parse_args(args):
+    """
+    Returns the _ARGS value of a Config as a dict.
+
+    args:               (str or dict) Dict literal. None and "" give an empty dict.
+    """
+    if not args:
+        return {}
+    if isinstance(args, dict):
+        return dict(args)
+    try:
+        parsed = ast.literal_eval(args)
+    except (ValueError, SyntaxError):
+        logger.warning("Ignoring database arguments that are not a dict literal: %r", args)
+        return {}
+    if not isinstance(parsed, dict):
+        logger.warning("Ignoring database arguments that are not a dict literal: %r", args)
+        return {}
+    return parsed
+
+
+def split_args(args):
+    """
+    Splits _ARGS into (engine options, DBAPI connect arguments).
+    """
+    parsed = parse_args(args)
+    options = {k: parsed.pop(k) for k in engine_options if k in parsed}
+    return options, parsed
+
+
+def timeout_connect_args(url, timeout, connect_args):
+    """
+    Returns connect_args with the libpq startup option setting statement_timeout for
+    psycopg2 and psycopg connections, or None for other drivers (see create_role_engine).
+
+    url:                (str) Database URL.
+    timeout:            (int) Statement timeout in milliseconds.
+    connect_args:       (dict) DBAPI connect arguments of the role.
+    """
+    url = make_url(url)
+    if url.get_backend_name() != "postgresql" or url.get_driver_name() not in (
+        "psycopg2",
+        "psycopg",
+    ):
+        return None
+    connect_args = dict(connect_args)
+    option = "-c statement_timeout=%d" % int(timeout)
+    if connect_args.get("options"):
+        option = "%s %s" % (connect_args["options"], option)
+    connect_args["options"] = option
+    return connect_args
+
+
+def create_role_engine(url, args=None):
+    """
+    Creates an engine with the pool, timeout and cursor options of args.
+
+    url:                (str) Database URL.
+    args:               (str or dict) _ARGS value of the role.
+    """
+    options, connect_args = split_args(args)
+    timeout = options.get("statement_timeout")
+    startup_args = timeout_connect_args(url, timeout, connect_args) if timeout else None
+    if startup_args is not None:
+        connect_args = startup_args
+    kwargs = {}
+    if connect_args:
+        kwargs["connect_args"] = connect_args
+    for key in pool_options:
+        if key in options:
+            kwargs[key] = options[key]
+    if options.get("stream_results"):
+        kwargs["execution_options"] = {"stream_results": True}
+    try:
+        engine = create_engine(url, **kwargs)
+    except TypeError:
+        # Pools without a size (SQLite files on SQLAlchemy 1.3 use NullPool).
+        logger.debug("Pool sizing is not supported for %s", url)
+        for key in ("pool_size", "max_overflow", "pool_timeout"):
+            kwargs.pop(key, None)
+        engine = create_engine(url, **kwargs)
+
+    statement = timeout_statements.get(engine.dialect.name)
+    if timeout and startup_args is None and statement:
+
+        def set_timeout(dbapi_connection, connection_record):
+            # A SET run in the transaction the driver opens would be rolled back when the
+            # connection is returned to the pool (see the SQLAlchemy docs on "connect").
+            autocommit = getattr(dbapi_connection, "autocommit", None)
+            if isinstance(autocommit, bool):
+                dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute(statement % int(timeout))
+            cursor.close()
+            if isinstance(autocommit, bool):
+                dbapi_connection.autocommit = autocommit
+
+        event.listen(engine, "connect", set_timeout)
+    elif timeout and startup_args is None:
+        logger.debug("statement_timeout is not supported by %s", engine.dialect.name)
+    return engine
+
+
+_reader = None
+
+
+def set_reader_engine(engine):
+    """
+    Sets the engine used for reads. None reads through dal.engine.
+    """
+    global _reader
+    _reader = engine
+
+
+def reader_engine():
+    """
+    Returns the engine of the read role: the configured reader, otherwise dal.engine.
+    """
+    if _reader is not None:
+        return _reader
+    return dal.engine
+
+
+def init_engines(db_conf, privileges, read_conf=None):
+    """
+    Initializes dal with the writer configuration and builds the reader. Returns
+    (writer, reader).
+
+    db_conf:            (Config) Configuration of the user's role, used for writes.
+    privileges:         (dict) Privileges passed to dal.init_db.
+    read_conf:          (Config) Configuration of the read role. The reader shares the writer
+                        when it is None or has the same URL and options.
+    """
+    options, connect_args = split_args(db_conf.DATABASEARGS)
+    if options:
+        # dal passes _ARGS to connect(); only give it the arguments the DBAPI knows.
+        dal_conf = copy.copy(db_conf)
+        dal_conf.DATABASEARGS = repr(connect_args) if connect_args else None
+        dal.init_db(dal_conf, privileges=privileges)
+        writer = create_role_engine(db_conf.DATABASEURI, db_conf.DATABASEARGS)
+        dal.engine = writer
+        dal.Session.configure(bind=writer)
+    else:
+        dal.init_db(db_conf, privileges=privileges)
+
+    reader = None
+    if read_conf is not None and read_conf.DATABASEURI not in (None, "", "sqlite://"):
+        read_args = read_conf.DATABASEARGS or db_conf.DATABASEARGS
+        if (read_conf.DATABASEURI, parse_args(read_args)) != (
+            db_conf.DATABASEURI,
+            parse_args(db_conf.DATABASEARGS),
+        ):
+            reader = create_role_engine(read_conf.DATABASEURI, read_args)
+    set_reader_engine(reader)
+    return dal.engine, reader_engine()
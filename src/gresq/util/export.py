@@ -0,0 +1,536 @@
+"""
+Streaming export of query results.
+
+export_statement runs a statement on a server-side cursor (stream_results) and writes the
+rows to CSV, Parquet or Arrow IPC a chunk at a time, so memory use is bounded by the chunk
+size rather than the size of the results. export_results builds the results query of the
+query tab (experiment_summary when it exists, the experiment join otherwise) for a list of
+filters and exports it. Parquet and Arrow need pyarrow, which is optional.
+
+export_graphs writes the full graph of each experiment matching the filters (recipe and
+preparation steps, properties, substrate, furnace, environment conditions, authors, SEM and
+Raman files and their analyses; see gresq.util.preview) as one JSON object per line. The
+experiments are read in batches with eager loading, so each batch takes a fixed number of
+queries and is released before the next one is read. orjson is used to encode them when it
+is installed.
+
+From a notebook:
+
+    from gresq.util.export import export_results
+    export_results([Experiment.validated == True], "validated.parquet", bind=dal.engine)
+
+or from the command line:
+
+    python -m gresq.util.export --db_mode production --validated validated.parquet
+    python -m gresq.util.export --db_mode production --validated --graphs validated.ndjson
+"""
+import os
+import json
+import argparse
+import datetime
+import decimal
+import importlib
+import logging
+import threading
+import traceback
+import pandas as pd
+from PyQt5 import QtCore
+from sqlalchemy.orm import Query, Session
+from grdb.database import dal
+from grdb.database.models import Experiment
+from gresq.util.summary import results_query_for
+from gresq.util.preview import load_previews, graph_dict
+from gresq.util.replica import read_engine
+
+logger = logging.getLogger(__name__)
+
+# File extension of each format.
+export_formats = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def export_format(path):
+    """
+    Returns the format matching the extension of path, or None.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for name, ext in export_formats.items():
+        if extension == ext or (name == "arrow" and extension in (".feather", ".ipc")):
+            return name
+    return None
+
+
+def _pyarrow():
+    try:
+        return importlib.import_module("pyarrow")
+    except ImportError:
+        raise ImportError("Parquet and Arrow export need pyarrow (pip install pyarrow).")
+
+
+def iter_chunks(statement, bind=None, chunksize=10000):
+    """
+    Yields the rows of statement as DataFrames of at most chunksize rows, read from a
+    server-side cursor where the database supports it. Empty results yield one empty
+    DataFrame with the result columns.
+
+    statement:          SQLAlchemy selectable.
+    bind:               SQLAlchemy engine. Defaults to dal.engine.
+    chunksize:          (int) Rows per DataFrame.
+    """
+    bind = bind if bind is not None else dal.engine
+    with bind.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        try:
+            columns = list(result.keys())
+            first = True
+            while True:
+                rows = result.fetchmany(chunksize)
+                if len(rows) == 0 and not first:
+                    break
+                first = False
+                yield pd.DataFrame.from_records([tuple(r) for r in rows], columns=columns)
+                if len(rows) < chunksize:
+                    break
+        finally:
+            result.close()
+
+
+def _python_type(column_type):
+    try:
+        return column_type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _arrow_type(pa, column_type):
+    """
+    Returns the Arrow type of a SQLAlchemy column type, or None if it has no Python type.
+    """
+    python_type = _python_type(column_type)
+    if python_type is None:
+        return None
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type in (float, decimal.Decimal):
+        return pa.float64()
+    if python_type is str:
+        return pa.string()
+    if python_type is datetime.datetime:
+        return pa.timestamp("us")
+    if python_type is datetime.date:
+        return pa.date32()
+    return None
+
+
+def _statement_columns(statement):
+    columns = getattr(statement, "selected_columns", None)
+    if columns is None:
+        columns = statement.columns
+    return list(columns)
+
+
+class _ArrowWriter:
+    """
+    Writes DataFrame chunks to a Parquet or Arrow IPC file with a schema fixed from the
+    statement's column types. Columns without a Python type take the type of their values in
+    the first chunk (strings if they are all missing).
+    """
+
+    def __init__(self, pa, path, format, statement):
+        self.pa = pa
+        self.path = path
+        self.format = format
+        self.column_types = [_arrow_type(pa, c.type) for c in _statement_columns(statement)]
+        self.schema = None
+        self.writer = None
+        self.sink = None
+
+    def _open(self, df):
+        pa = self.pa
+        fields = []
+        for j, name in enumerate(df.columns):
+            t = self.column_types[j] if j < len(self.column_types) else None
+            if t is None:
+                t = pa.Array.from_pandas(df.iloc[:, j]).type
+                if t == pa.null():
+                    t = pa.string()
+            fields.append(pa.field(str(name), t))
+        self.schema = pa.schema(fields)
+        if self.format == "parquet":
+            parquet = importlib.import_module("pyarrow.parquet")
+            self.writer = parquet.ParquetWriter(self.path, self.schema)
+        else:
+            self.sink = pa.OSFile(self.path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def _array(self, values, t):
+        pa = self.pa
+        if t == pa.bool_():
+            values = values.map(lambda v: None if pd.isnull(v) else bool(v))
+        elif t == pa.string():
+            values = values.map(lambda v: None if v is None or v != v else str(v))
+        return pa.array(values, type=t, from_pandas=True)
+
+    def write(self, df):
+        if self.writer is None:
+            self._open(df)
+        arrays = [
+            self._array(df.iloc[:, j], field.type) for j, field in enumerate(self.schema)
+        ]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+
+def _format_integer(value):
+    return "" if pd.isnull(value) else "%d" % value
+
+
+class _CSVWriter:
+    """
+    Writes DataFrame chunks to a CSV file. Integer columns of the statement are written as
+    integers in every chunk, including chunks where NULLs made pandas read them as floats.
+    """
+
+    def __init__(self, path, statement):
+        self.f = open(path, "w", newline="")
+        self.header = True
+        self.integer_columns = [
+            j
+            for j, c in enumerate(_statement_columns(statement))
+            if _python_type(c.type) is int
+        ]
+
+    def write(self, df):
+        columns = [df.iloc[:, j] for j in range(df.shape[1])]
+        floats = [
+            j for j in self.integer_columns if j < len(columns) and columns[j].dtype.kind == "f"
+        ]
+        if len(floats) > 0:
+            for j in floats:
+                columns[j] = columns[j].map(_format_integer)
+            formatted = pd.DataFrame(dict(enumerate(columns)), columns=range(len(columns)))
+            formatted.columns = df.columns
+            df = formatted
+        df.to_csv(self.f, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.f.close()
+
+
+def export_statement(
+    statement, path, format=None, bind=None, chunksize=10000, progress=None, abort=None
+):
+    """
+    Writes the rows of statement to path a chunk at a time. The file is written under a
+    temporary name and only appears at path once it is complete. Returns the number of rows.
+
+    statement:          SQLAlchemy selectable.
+    path:               (str) Output file.
+    format:             (str) "csv", "parquet" or "arrow". Defaults to the format matching
+                        the extension of path.
+    bind:               SQLAlchemy engine. Defaults to dal.engine.
+    chunksize:          (int) Rows read and written at once.
+    progress:           Callable taking the number of rows written so far.
+    abort:              Callable returning True to stop the export (raises ExportCancelled).
+    """
+    format = format or export_format(path)
+    if format not in export_formats:
+        raise ValueError("Unknown export format for %s." % path)
+    if format == "csv":
+        writer = _CSVWriter(path + ".part", statement)
+    else:
+        writer = _ArrowWriter(_pyarrow(), path + ".part", format, statement)
+
+    nrows = 0
+    try:
+        for df in iter_chunks(statement, bind=bind, chunksize=chunksize):
+            if abort is not None and abort():
+                raise ExportCancelled()
+            writer.write(df)
+            nrows += df.shape[0]
+            if progress is not None:
+                progress(nrows)
+    except BaseException:
+        writer.close()
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        raise
+    writer.close()
+    os.replace(path + ".part", path)
+    logger.info("Exported %s rows to %s" % (nrows, path))
+    return nrows
+
+
+def export_results(filters, path, format=None, bind=None, chunksize=10000, progress=None, abort=None):
+    """
+    Exports the results of the query tab for filters (see results_query_for and
+    export_statement).
+
+    filters:            list of sqlalchemy filters
+    """
+    bind = bind if bind is not None else dal.engine
+    return export_statement(
+        results_query_for(filters, bind).statement,
+        path,
+        format=format,
+        bind=bind,
+        chunksize=chunksize,
+        progress=progress,
+        abort=abort,
+    )
+
+
+def results_ids(filters, bind=None):
+    """
+    Returns the sorted ids of the experiments matching filters in the query tab.
+
+    filters:            list of sqlalchemy filters
+    bind:               SQLAlchemy engine. Defaults to dal.engine.
+    """
+    bind = bind if bind is not None else dal.engine
+    results = results_query_for(filters, bind).subquery()
+    q = Query([results.c.id]).distinct().order_by(results.c.id)
+    with bind.connect() as connection:
+        return [i for (i,) in connection.execute(q.statement)]
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return None
+    raise TypeError("%s is not JSON serializable." % type(value).__name__)
+
+
+def json_encoder():
+    """
+    Returns a function encoding an object as one line of JSON (bytes), using orjson when it
+    is installed.
+    """
+    try:
+        orjson = importlib.import_module("orjson")
+    except ImportError:
+        return lambda obj: json.dumps(
+            obj, default=_json_default, separators=(",", ":")
+        ).encode()
+    return lambda obj: orjson.dumps(obj, default=_json_default)
+
+
+def export_graphs(filters, path, bind=None, batch_size=200, progress=None, abort=None):
+    """
+    Writes the graph of every experiment matching filters to path as NDJSON, one experiment
+    per line in id order. Returns the number of experiments.
+
+    filters:            list of sqlalchemy filters
+    path:               (str) Output file.
+    bind:               SQLAlchemy engine. Defaults to dal.engine.
+    batch_size:         (int) Experiments read at once.
+    progress:           Callable taking the number of experiments written so far.
+    abort:              Callable returning True to stop the export (raises ExportCancelled).
+    """
+    bind = bind if bind is not None else dal.engine
+    ids = results_ids(filters, bind=bind)
+    encode = json_encoder()
+    n = 0
+    session = Session(bind=bind)
+    try:
+        with open(path + ".part", "wb") as f:
+            for b in range(0, len(ids), batch_size):
+                if abort is not None and abort():
+                    raise ExportCancelled()
+                batch = ids[b : b + batch_size]
+                experiments = load_previews(session, batch)
+                for i in batch:
+                    if i in experiments:
+                        f.write(encode(graph_dict(experiments[i])))
+                        f.write(b"\n")
+                        n += 1
+                # Drops the batch so memory does not grow with the export.
+                session.expunge_all()
+                if progress is not None:
+                    progress(n)
+    except BaseException:
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+        raise
+    finally:
+        session.close()
+    os.replace(path + ".part", path)
+    logger.info("Exported %s experiments to %s" % (n, path))
+    return n
+
+
+class _ExportTask(QtCore.QRunnable):
+    def __init__(self, exporter, statement, path, format):
+        super(_ExportTask, self).__init__()
+        self.exporter = exporter
+        self.statement = statement
+        self.path = path
+        self.format = format
+
+    def run(self):
+        exporter = self.exporter
+        try:
+            nrows = export_statement(
+                self.statement,
+                self.path,
+                format=self.format,
+                bind=exporter.bind(),
+                chunksize=exporter.chunksize,
+                progress=exporter.progress.emit,
+                abort=exporter._cancelled.is_set,
+            )
+        except ExportCancelled:
+            exporter.cancelled.emit()
+        except Exception as e:
+            logger.warning(traceback.format_exc())
+            exporter.failed.emit(str(e))
+        else:
+            exporter.finished.emit(self.path, nrows)
+
+
+class Exporter(QtCore.QObject):
+    """
+    Runs export_statement in a background thread for the dashboard.
+
+    bind:               SQLAlchemy engine. Defaults to read_engine(), the replica in
+                        replica mode.
+    chunksize:          (int) Rows read and written at once.
+
+    Signals:
+        progress(rows_written)
+        finished(path, rows)
+        failed(error_text)
+        cancelled()
+    """
+
+    progress = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal(str, int)
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, bind=None, chunksize=10000, parent=None):
+        super(Exporter, self).__init__(parent=parent)
+        self._bind = bind
+        self.chunksize = chunksize
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._cancelled = threading.Event()
+
+    def bind(self):
+        if self._bind is not None:
+            return self._bind
+        return read_engine()
+
+    def export(self, statement, path, format=None):
+        """
+        Starts exporting the rows of statement to path.
+        """
+        self._cancelled.clear()
+        self.pool.start(_ExportTask(self, statement, path, format))
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def isRunning(self):
+        return self.pool.activeThreadCount() > 0
+
+
+def main():
+    from gresq.config import Config
+
+    parser = argparse.ArgumentParser(description="Export query results.")
+    parser.add_argument("path", type=str, help="Output file (.csv, .parquet or .arrow).")
+    parser.add_argument(
+        "--db_mode",
+        default="development",
+        type=str,
+        help="Database mode: development, testing, or production",
+    )
+    parser.add_argument(
+        "--db_config_path",
+        default="",
+        type=str,
+        help="Path to database config secrets.",
+    )
+    parser.add_argument(
+        "--db_suffix",
+        default="_READ",
+        type=str,
+        help="Suffix of the database user settings (_READ, _WRITE, _ADMIN or empty).",
+    )
+    parser.add_argument(
+        "--format", default=None, type=str, help="csv, parquet or arrow (default: from path)."
+    )
+    parser.add_argument(
+        "--validated",
+        action="store_true",
+        default=False,
+        help="Only export validated experiments.",
+    )
+    parser.add_argument(
+        "--graphs",
+        action="store_true",
+        default=False,
+        help="Export the full graph of each experiment as NDJSON instead of result rows.",
+    )
+    parser.add_argument(
+        "--chunksize", default=10000, type=int, help="Rows read and written at once."
+    )
+    parser.add_argument(
+        "--batch_size",
+        default=200,
+        type=int,
+        help="Experiments read at once with --graphs.",
+    )
+    kwargs = vars(parser.parse_args())
+    logging.basicConfig(level=logging.INFO)
+
+    prefixes = {
+        "development": "DEV_DATABASE",
+        "testing": "TEST_DATABASE",
+        "production": "PROD_DATABASE",
+    }
+    db_conf = Config(
+        prefix=prefixes[kwargs["db_mode"].lower()],
+        suffix=kwargs["db_suffix"],
+        debug=kwargs["db_mode"].lower() != "production",
+        dbconfig_file=kwargs["db_config_path"],
+    )
+    dal.init_db(db_conf, privileges={"read": True, "write": False, "validate": False})
+
+    filters = [Experiment.validated == True] if kwargs["validated"] else []
+    if kwargs["graphs"]:
+        export_graphs(
+            filters,
+            kwargs["path"],
+            bind=dal.engine,
+            batch_size=kwargs["batch_size"],
+            progress=lambda n: logger.info("%s experiments" % n),
+        )
+        return
+    export_results(
+        filters,
+        kwargs["path"],
+        format=kwargs["format"],
+        bind=dal.engine,
+        chunksize=kwargs["chunksize"],
+        progress=lambda n: logger.info("%s rows" % n),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import os
+import json
+import copy
+import hashlib
+import tempfile
+import threading
+import logging
+import argparse
+import traceback
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from gsaraman import auto_fitting
+from gsaraman import __version__ as GSARAMAN_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _plain(params):
+    """
+    Converts fitted parameters ({peak: {parameter: value}}) to plain floats so they can be
+    stored as JSON.
+    """
+    return {
+        peak: {k: float(v) for k, v in values.items()} for peak, values in params.items()
+    }
+
+
+class FitCache:
+    """
+    Cache of Raman peak-fitting results keyed by the SHA-256 of the spectrum file contents
+    and the version of the fitting code. Results are kept in memory (bounded LRU) and on disk,
+    so validating a submission and submitting it fit each file once, and re-running a loader
+    over the same directory only fits new or changed files.
+
+    directory:          (str) Directory for stored results. None keeps results in memory only.
+    fit:                Function mapping a spectrum path to {peak: {parameter: value}}.
+                        Defaults to gsaraman.auto_fitting.
+    version:            (str) Version of the fitting code; results of other versions are ignored.
+    memory_size:        (int) Number of results kept in memory.
+    """
+
+    def __init__(self, directory=None, fit=None, version=None, memory_size=4096):
+        self.fit_function = fit if fit is not None else auto_fitting
+        self.version = version if version is not None else GSARAMAN_VERSION
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(self.versionDirectory(), exist_ok=True)
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def versionDirectory(self):
+        return os.path.join(self.directory, str(self.version))
+
+    def resultPath(self, key):
+        return os.path.join(self.versionDirectory(), key[:2], key + ".json")
+
+    def _remember(self, key, params):
+        with self._lock:
+            self.memory[key] = params
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_size:
+                self.memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns the stored result for a content hash, or None.
+        """
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return copy.deepcopy(self.memory[key])
+        if self.directory is None:
+            return None
+        try:
+            with open(self.resultPath(key), "r") as f:
+                params = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, params)
+        return copy.deepcopy(params)
+
+    def put(self, key, params):
+        params = _plain(params)
+        self._remember(key, params)
+        if self.directory is None:
+            return
+        path = self.resultPath(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(params, f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def fit(self, path):
+        """
+        Returns the fitted peak parameters of a spectrum file, fitting it only if the same
+        contents have not been fitted before. Fitting errors are not cached.
+
+        path:               (str) Path to a Raman spectrum file.
+        """
+        key = file_sha256(path)
+        params = self.get(key)
+        if params is not None:
+            with self._lock:
+                self.hits += 1
+            return params
+        with self._lock:
+            self.misses += 1
+        params = _plain(self.fit_function(path))
+        self.put(key, params)
+        return copy.deepcopy(params)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory": len(self.memory)}
+
+
+_default_fit_cache = None
+_default_fit_cache_lock = threading.Lock()
+
+
+def default_fit_cache():
+    """
+    Returns the FitCache shared by the dashboard and the loaders. Results are stored under
+    GRESQ_CACHE_DIR (~/.cache/gresq by default) in fits/.
+    """
+    global _default_fit_cache
+    with _default_fit_cache_lock:
+        if _default_fit_cache is None:
+            directory = os.environ.get(
+                "GRESQ_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gresq")
+            )
+            _default_fit_cache = FitCache(os.path.join(directory, "fits"))
+        return _default_fit_cache
+
+
+def cached_auto_fitting(path):
+    """
+    Drop-in replacement for gsaraman.auto_fitting that reuses earlier results for files with
+    the same contents.
+
+    path:               (str) Path to a Raman spectrum file.
+    """
+    return default_fit_cache().fit(path)
+
+
+FitResult = namedtuple("FitResult", ["path", "params", "error"])
+
+
+def find_spectra(directory, extensions=(".txt",)):
+    """
+    Returns the sorted paths of the spectrum files in an ingest directory laid out as
+    directory/<sample>/<spectrum>.txt (files directly in directory are included too).
+
+    directory:          (str) Ingest directory, e.g. data/SEM_Raman_Data.
+    extensions:         (tuple of str) File extensions treated as spectra.
+    """
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            if os.path.splitext(f)[1].lower() in extensions:
+                paths.append(os.path.join(root, f))
+    return paths
+
+
+def _fit_one(args):
+    fit_function, path = args
+    try:
+        return FitResult(path, _plain(fit_function(path)), None)
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        return FitResult(path, None, "%s: %s" % (type(e).__name__, e))
+
+
+def fit_files(paths, max_workers=None, cache=None):
+    """
+    Fits many spectrum files across a process pool. Returns an iterator over one
+    FitResult(path, params, error) per file, in the order of paths; each result is available
+    as soon as it and all files before it are done. Results already in the cache are not
+    refitted; new results are added to it. A file that cannot be fitted yields its error
+    instead of stopping the batch.
+
+    paths:              (list of str) Spectrum files.
+    max_workers:        (int) Worker processes. Defaults to the number of cores; 1 fits in-process.
+    cache:              (FitCache) Defaults to default_fit_cache().
+    """
+    cache = cache if cache is not None else default_fit_cache()
+    paths = list(paths)
+    keys = {}
+    cached = {}
+    todo = []
+    for path in paths:
+        try:
+            keys[path] = file_sha256(path)
+        except OSError as e:
+            cached[path] = FitResult(path, None, "%s: %s" % (type(e).__name__, e))
+            continue
+        params = cache.get(keys[path])
+        if params is not None:
+            cached[path] = FitResult(path, params, None)
+        else:
+            todo.append(path)
+    logger.info("Fitting %s spectra (%s cached)." % (len(todo), len(paths) - len(todo)))
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(todo)))
+    jobs = [(cache.fit_function, path) for path in todo]
+    executor = None
+    futures = []
+    if max_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(_fit_one, job) for job in jobs]
+        fitted = (future.result() for future in futures)
+    else:
+        fitted = map(_fit_one, jobs)
+
+    # The pool is started before the first result is requested.
+    return _collect(paths, cached, keys, fitted, cache, executor, futures)
+
+
+def _collect(paths, cached, keys, fitted, cache, executor, futures):
+    try:
+        for path in paths:
+            if path in cached:
+                yield cached[path]
+                continue
+            result = next(fitted)
+            if result.error is None:
+                cache.put(keys[path], result.params)
+            yield result
+    finally:
+        if executor is not None:
+            # shutdown(cancel_futures=True) needs Python 3.9.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+class FitStream:
+    """
+    Streams fit results from fit_files into a loader. get(path) returns as soon as that file
+    is fitted while the remaining files keep fitting in the background, so database work can
+    start before the whole batch is done. Failed files are collected in errors.
+
+    paths:              (list of str) Spectrum files, in the order the loader will need them.
+    max_workers:        (int) Worker processes. Defaults to the number of cores.
+    cache:              (FitCache) Defaults to default_fit_cache().
+    """
+
+    def __init__(self, paths, max_workers=None, cache=None):
+        self.paths = list(paths)
+        self.cache = cache if cache is not None else default_fit_cache()
+        self._results = fit_files(self.paths, max_workers=max_workers, cache=self.cache)
+        self.done = OrderedDict()
+        self.errors = OrderedDict()
+
+    def _pull(self):
+        result = next(self._results)
+        self.done[result.path] = result
+        if result.error is not None:
+            self.errors[result.path] = result.error
+            logger.warning("Could not fit %s: %s" % (result.path, result.error))
+        return result
+
+    def get(self, path):
+        """
+        Returns the FitResult of path. Files outside the batch are fitted in-process.
+        """
+        if path not in self.done and path in self.paths:
+            while path not in self.done:
+                self._pull()
+        if path in self.done:
+            return self.done[path]
+        return next(fit_files([path], max_workers=1, cache=self.cache))
+
+    def finish(self):
+        """
+        Waits for the remaining files and returns all results.
+        """
+        while len(self.done) < len(set(self.paths)):
+            try:
+                self._pull()
+            except StopIteration:
+                break
+        return list(self.done.values())
+
+    def close(self):
+        """
+        Stops fitting the remaining files and shuts the worker processes down.
+        """
+        self._results.close()
+
+    def report(self):
+        """
+        Returns a list of (path, status, error) rows for every file fitted so far.
+        """
+        return [
+            (r.path, "ok" if r.error is None else "error", r.error or "")
+            for r in self.done.values()
+        ]
+
+
+def main():
+    import csv
+    import time
+
+    parser = argparse.ArgumentParser(description="Fit every Raman spectrum in an ingest directory.")
+    parser.add_argument("directory", type=str, help="Directory laid out as <sample>/<spectrum>.txt")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: cores)")
+    parser.add_argument("--report", type=str, default=None, help="Write a per-file CSV report")
+    parser.add_argument("--no_cache", action="store_true", default=False, help="Ignore stored results")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    cache = FitCache() if args.no_cache else default_fit_cache()
+    t = time.perf_counter()
+    stream = FitStream(find_spectra(args.directory), max_workers=args.workers, cache=cache)
+    results = stream.finish()
+    elapsed = time.perf_counter() - t
+    print(
+        "Fitted %s spectra in %.1f s (%s errors)."
+        % (len(results), elapsed, len(stream.errors))
+    )
+    for path, error in stream.errors.items():
+        print("  %s: %s" % (path, error))
+    if args.report:
+        with open(args.report, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", "status", "error"])
+            writer.writerows(stream.report())
+
+
+if __name__ == "__main__":
+    main()
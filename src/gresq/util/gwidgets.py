@@ -9,7 +9,6 @@ import operator
 import requests
 import traceback
 import inspect
-from mlxtend.frequent_patterns import apriori
 import functools
 from grdb.database.v1_1_0.models import Sample
 import logging
@@ -0,0 +1,203 @@
+import os
+import tempfile
+import threading
+import logging
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class TransferAborted(Exception):
+    """
+    Raised when a streamed transfer is aborted before the body has been fully received.
+    """
+
+
+def _retry(total, backoff_factor):
+    kwargs = dict(
+        total=total,
+        connect=total,
+        read=total,
+        status=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return Retry(allowed_methods=frozenset(["GET", "HEAD"]), **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(["GET", "HEAD"]), **kwargs)
+
+
+class HostBoundResponse:
+    """
+    Wraps a streamed requests.Response and holds a slot of its host's connection limit
+    until the response is closed. Attribute access is forwarded to the response.
+    """
+
+    def __init__(self, response, semaphore):
+        self._response = response
+        self._semaphore = semaphore
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            self._response.close()
+        finally:
+            self._semaphore.release()
+
+
+class HTTPClient:
+    """
+    Thread-safe HTTP client shared by everything that fetches files from Box or other URLs.
+
+    One requests.Session keeps a pool of keep-alive connections per host, so consecutive
+    downloads reuse warm TLS connections instead of handshaking for every file. The number
+    of concurrent requests per host is bounded, and GET/HEAD requests answered with 429 or
+    a 5xx status (or failing to connect) are retried with exponential backoff, honouring
+    Retry-After.
+
+    max_per_host:           (int) Concurrent requests allowed per host.
+    retries:                (int) Retries on connection errors and 429/5xx responses.
+    backoff_factor:         (float) Backoff between retries: backoff_factor * 2 ** (retry - 1) seconds.
+    timeout:                (float) Default (connect, read) timeout in seconds.
+    chunk_size:             (int) Bytes read per chunk when streaming.
+    """
+
+    def __init__(self, max_per_host=4, retries=5, backoff_factor=0.5, timeout=60, chunk_size=64 * 1024):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=max_per_host,
+            max_retries=_retry(retries, backoff_factor),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _hostSemaphore(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._hosts[host]
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        """
+        Sends a GET request. With stream=True the body is not read; the returned response
+        holds its host slot until it is closed, so callers must close it (or use it as a
+        context manager). Without stream the body is read and the slot released at once.
+
+        url:                (str) Request url.
+        headers:            (dict) Extra request headers.
+        timeout:            (float) Timeout in seconds. Defaults to the client timeout.
+        stream:             (bool) Defer reading the body.
+        """
+        semaphore = self._hostSemaphore(url)
+        semaphore.acquire()
+        try:
+            r = self.session.get(
+                url,
+                headers=headers,
+                timeout=self.timeout if timeout is None else timeout,
+                stream=stream,
+            )
+        except BaseException:
+            semaphore.release()
+            raise
+        if stream:
+            return HostBoundResponse(r, semaphore)
+        semaphore.release()
+        return r
+
+    def iterContent(self, url, abort=None, headers=None, timeout=None):
+        """
+        Yields the body of url in chunks. Raises TransferAborted if abort returns True
+        between chunks.
+
+        url:                (str) Request url.
+        abort:              Callable returning True when the transfer should stop.
+        """
+        with self.get(url, headers=headers, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                if abort is not None and abort():
+                    raise TransferAborted(url)
+                yield chunk
+
+    def fetch(self, url, abort=None, headers=None, timeout=None):
+        """
+        Streams url into memory and returns the body as bytes.
+        """
+        buffer = bytearray()
+        for chunk in self.iterContent(url, abort=abort, headers=headers, timeout=timeout):
+            buffer.extend(chunk)
+        return bytes(buffer)
+
+    def download(self, url, path, abort=None, headers=None, timeout=None):
+        """
+        Streams url to a file. The body is written to a temporary file next to path and
+        renamed into place once complete, so path never holds a partial download.
+        Returns the number of bytes written.
+
+        url:                (str) Request url.
+        path:               (str) Destination file.
+        abort:              Callable returning True when the transfer should stop.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.iterContent(url, abort=abort, headers=headers, timeout=timeout):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return size
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """
+    Returns the HTTPClient shared by the dashboard and scripts. The per-host limit can be set
+    with the GRESQ_HTTP_MAX_PER_HOST environment variable.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HTTPClient(
+                max_per_host=int(os.environ.get("GRESQ_HTTP_MAX_PER_HOST", 4))
+            )
+        return _default_client
@@ -0,0 +1,546 @@
+"""
+SQL statement timing and query plans.
+
+StatementLog listens to the cursor events of SQLAlchemy engines and records every statement
+run through them (SQL, bound parameters, rows reported by the driver, elapsed time, thread
+and origin) in a bounded ring buffer. The origin is the label of the innermost origin()
+block or decorated method on the thread running the statement, e.g.
+
+    @origin("ResultsWidget.query")
+    def query(self, filters):
+        ...
+
+Statements slower than slow_ms can be explained automatically; the EXPLAIN runs on a
+separate connection in a background thread so the statement's own transaction is not
+touched. InstrumentationDock shows the log in the dashboard (Ctrl+Shift+L) and exports it as
+JSON.
+"""
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from PyQt5 import QtCore, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Prefix turning a statement into a query plan request, by dialect.
+explain_prefixes = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+}
+
+
+def current_origin():
+    """
+    Returns the origin label of the calling thread, or None.
+    """
+    stack = getattr(_local, "origins", None)
+    if not stack:
+        return None
+    return " > ".join(stack)
+
+
+@contextmanager
+def origin(label):
+    """
+    Context manager (or method decorator) labelling the statements run by the calling thread
+    inside it. Nested labels are joined with " > ". None leaves the label unchanged, so an
+    origin captured with current_origin can be passed to a worker thread as is.
+
+    label:              (str) Label, usually Class.method of the widget running the statements.
+    """
+    if label is None:
+        yield
+        return
+    if not hasattr(_local, "origins"):
+        _local.origins = []
+    _local.origins.append(label)
+    try:
+        yield
+    finally:
+        _local.origins.pop()
+
+
+def _jsonable(value, max_length=200):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= max_length else value[:max_length] + "..."
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "<%s bytes>" % len(value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v, max_length) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v, max_length) for k, v in value.items()}
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return _jsonable(repr(value), max_length)
+
+
+def _explainable(statement):
+    return statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "WITH")
+
+
+def explain_statement(engine, statement, parameters):
+    """
+    Returns the query plan of statement as text, read on a new DBAPI connection of engine.
+    Returns None if the dialect has no EXPLAIN.
+
+    engine:             SQLAlchemy engine.
+    statement:          (str) SQL as sent to the driver.
+    parameters:         Parameters as sent to the driver.
+    """
+    prefix = explain_prefixes.get(engine.dialect.name)
+    if prefix is None:
+        return None
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        connection.rollback()
+    finally:
+        connection.close()
+    return "\n".join("  ".join(str(c) for c in row) for row in rows)
+
+
+class StatementLog:
+    """
+    Ring buffer of the statements run through the engines it is installed on.
+
+    max_entries:        (int) Number of statements kept.
+    slow_ms:            (float) Statements taking at least this long are explained
+                        automatically. None disables it.
+    """
+
+    def __init__(self, max_entries=2000, slow_ms=None):
+        self.slow_ms = slow_ms
+        self.entries = deque(maxlen=max_entries)
+        self.plans = {}
+        self.count = 0
+        self._engines = []
+        self._lock = threading.Lock()
+        self._explainer = None
+
+    def install(self, engine):
+        """
+        Starts recording the statements of engine.
+        """
+        if engine in self._engines:
+            return
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._error)
+        self._engines.append(engine)
+
+    def uninstall(self, engine):
+        if engine not in self._engines:
+            return
+        event.remove(engine, "before_cursor_execute", self._before)
+        event.remove(engine, "after_cursor_execute", self._after)
+        event.remove(engine, "handle_error", self._error)
+        self._engines.remove(engine)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("gresq_statement_start", []).append(time.perf_counter())
+
+    def _elapsed(self, conn):
+        starts = conn.info.get("gresq_statement_start")
+        if not starts:
+            return None
+        return (time.perf_counter() - starts.pop()) * 1000
+
+    def _add(self, conn, statement, parameters, executemany, elapsed, rows=None, error=None):
+        if executemany:
+            nparameters = len(parameters)
+            parameters = list(parameters[:10])
+        else:
+            nparameters = 1
+        entry = {
+            "time": datetime.datetime.now().isoformat(),
+            "statement": statement,
+            "parameters": _jsonable(parameters),
+            "executemany": nparameters if executemany else False,
+            "rows": rows,
+            "elapsed_ms": elapsed,
+            "origin": current_origin(),
+            "thread": threading.current_thread().name,
+            "database": conn.engine.url.get_backend_name(),
+            "error": error,
+            "plan": None,
+            # DBAPI parameters and engine, kept to explain the statement later.
+            "_parameters": parameters,
+            "_engine": conn.engine,
+        }
+        with self._lock:
+            entry["plan"] = self.plans.get(statement)
+            self.entries.append(entry)
+            self.count += 1
+        return entry
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = self._elapsed(conn)
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        entry = self._add(conn, statement, parameters, executemany, elapsed, rows=rows)
+        if (
+            self.slow_ms is not None
+            and elapsed is not None
+            and elapsed >= self.slow_ms
+            and not executemany
+            and entry["plan"] is None
+            and _explainable(statement)
+        ):
+            self._explainLater(entry)
+
+    def _error(self, context):
+        conn = context.connection
+        if conn is None or context.statement is None:
+            return
+        self._add(
+            conn,
+            context.statement,
+            context.parameters,
+            False,
+            self._elapsed(conn),
+            error=str(context.original_exception),
+        )
+
+    def _explainLater(self, entry):
+        with self._lock:
+            if self._explainer is None:
+                self._explainer = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="gresq-explain"
+                )
+            explainer = self._explainer
+        explainer.submit(self._explainQuietly, entry)
+
+    def _explainQuietly(self, entry):
+        try:
+            self.explain(entry)
+        except Exception:
+            logger.debug(traceback.format_exc())
+
+    def explain(self, entry):
+        """
+        Reads the query plan of a recorded statement on a separate connection, stores it in
+        the entry and returns it. Plans are kept per SQL text, so later runs of the statement
+        are recorded with it.
+
+        entry:          (dict) Entry of records().
+        """
+        if entry["executemany"] or not _explainable(entry["statement"]):
+            return None
+        with self._lock:
+            plan = self.plans.get(entry["statement"])
+        if plan is None:
+            with origin("StatementLog.explain"):
+                plan = explain_statement(
+                    entry["_engine"], entry["statement"], entry["_parameters"]
+                )
+            with self._lock:
+                self.plans[entry["statement"]] = plan
+        entry["plan"] = plan
+        return plan
+
+    def records(self):
+        """
+        Returns the recorded entries, oldest first.
+        """
+        with self._lock:
+            return list(self.entries)
+
+    def summary(self):
+        """
+        Returns the recorded statements grouped by SQL text, slowest in total first. Each
+        group has the statement, count, total_ms, mean_ms, max_ms, rows, errors and origins.
+        """
+        groups = {}
+        for entry in self.records():
+            group = groups.setdefault(
+                entry["statement"],
+                {
+                    "statement": entry["statement"],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "rows": 0,
+                    "errors": 0,
+                    "origins": [],
+                },
+            )
+            elapsed = entry["elapsed_ms"] or 0.0
+            group["count"] += 1
+            group["total_ms"] += elapsed
+            group["max_ms"] = max(group["max_ms"], elapsed)
+            group["rows"] += entry["rows"] or 0
+            group["errors"] += entry["error"] is not None
+            if entry["origin"] is not None and entry["origin"] not in group["origins"]:
+                group["origins"].append(entry["origin"])
+        for group in groups.values():
+            group["mean_ms"] = group["total_ms"] / group["count"]
+        return sorted(groups.values(), key=lambda g: -g["total_ms"])
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.plans.clear()
+            self.count += 1
+
+    def toJSON(self):
+        """
+        Returns the entries and their summary as a JSON-serializable dict.
+        """
+        statements = [
+            {k: v for k, v in entry.items() if not k.startswith("_")}
+            for entry in self.records()
+        ]
+        return {
+            "exported": datetime.datetime.now().isoformat(),
+            "statements": statements,
+            "summary": self.summary(),
+        }
+
+    def export(self, path):
+        """
+        Writes toJSON to path.
+        """
+        with open(path, "w") as f:
+            json.dump(self.toJSON(), f, indent=1)
+        logger.info("Exported %s statements to %s" % (len(self.entries), path))
+
+
+_default_log = None
+_default_log_lock = threading.Lock()
+
+
+def default_statement_log():
+    """
+    Returns the StatementLog of the dashboard. The number of statements kept (2000 by
+    default) is set with the GRESQ_SQL_LOG_SIZE environment variable, and statements slower
+    than GRESQ_SQL_SLOW_MS milliseconds are explained automatically when it is set.
+    """
+    global _default_log
+    with _default_log_lock:
+        if _default_log is None:
+            slow_ms = os.environ.get("GRESQ_SQL_SLOW_MS")
+            _default_log = StatementLog(
+                max_entries=int(os.environ.get("GRESQ_SQL_LOG_SIZE", 2000)),
+                slow_ms=float(slow_ms) if slow_ms else None,
+            )
+        return _default_log
+
+
+class InstrumentationDock(QtWidgets.QDockWidget):
+    """
+    Developer dock listing the statements of a StatementLog, the statements taking the most
+    time in total, and the SQL, parameters and plan of the selected statement.
+
+    log:                StatementLog. Defaults to default_statement_log().
+    """
+
+    statement_columns = ["Time", "ms", "Rows", "Origin", "Statement"]
+    summary_columns = ["Count", "Total ms", "Mean ms", "Max ms", "Origins", "Statement"]
+
+    def __init__(self, log=None, parent=None):
+        super(InstrumentationDock, self).__init__("SQL statements", parent=parent)
+        self.setObjectName("InstrumentationDock")
+        self.log = log if log is not None else default_statement_log()
+        self.shown_count = None
+        self.shown_entries = []
+        self.shown_summary = []
+
+        self.statements = self._table(self.statement_columns)
+        self.statements.currentCellChanged.connect(lambda row, *args: self.showEntry(row))
+        self.hot = self._table(self.summary_columns)
+        self.hot.currentCellChanged.connect(lambda row, *args: self.showGroup(row))
+        self.tabs = QtWidgets.QTabWidget()
+        self.tabs.addTab(self.statements, "Statements")
+        self.tabs.addTab(self.hot, "Hot statements")
+
+        self.details = QtWidgets.QPlainTextEdit()
+        self.details.setReadOnly(True)
+
+        self.explain_slow = QtWidgets.QCheckBox("EXPLAIN statements slower than")
+        self.explain_slow.setChecked(self.log.slow_ms is not None)
+        self.slow_ms = QtWidgets.QSpinBox()
+        self.slow_ms.setRange(1, 600000)
+        self.slow_ms.setSuffix(" ms")
+        self.slow_ms.setValue(int(self.log.slow_ms or 500))
+        self.explain_slow.toggled.connect(self.setSlow)
+        self.slow_ms.valueChanged.connect(self.setSlow)
+        self.explain_button = QtWidgets.QPushButton("Explain")
+        self.explain_button.clicked.connect(self.explainSelected)
+        self.clear_button = QtWidgets.QPushButton("Clear")
+        self.clear_button.clicked.connect(self.log.clear)
+        self.export_button = QtWidgets.QPushButton("Export JSON...")
+        self.export_button.clicked.connect(self.exportJSON)
+
+        controls = QtWidgets.QHBoxLayout()
+        controls.addWidget(self.explain_slow)
+        controls.addWidget(self.slow_ms)
+        controls.addStretch(1)
+        controls.addWidget(self.explain_button)
+        controls.addWidget(self.clear_button)
+        controls.addWidget(self.export_button)
+
+        splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        splitter.addWidget(self.tabs)
+        splitter.addWidget(self.details)
+        widget = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(widget)
+        layout.addWidget(splitter)
+        layout.addLayout(controls)
+        self.setWidget(widget)
+
+        # The log is written from worker threads, so it is polled while the dock is shown.
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def _table(self, columns):
+        table = QtWidgets.QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        table.horizontalHeader().setStretchLastSection(True)
+        table.verticalHeader().hide()
+        return table
+
+    def _fill(self, table, rows):
+        table.setRowCount(len(rows))
+        for r, values in enumerate(rows):
+            for c, value in enumerate(values):
+                text = "" if value is None else str(value)
+                table.setItem(r, c, QtWidgets.QTableWidgetItem(" ".join(text.split())))
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super(InstrumentationDock, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super(InstrumentationDock, self).hideEvent(event)
+
+    def refresh(self, force=False):
+        """
+        Reloads the tables if statements were recorded since the last refresh.
+        """
+        if not force and self.log.count == self.shown_count:
+            return
+        self.shown_count = self.log.count
+        self.shown_entries = list(reversed(self.log.records()))
+        self.shown_summary = self.log.summary()
+        self._fill(
+            self.statements,
+            [
+                (
+                    e["time"][11:23],
+                    "%.1f" % e["elapsed_ms"] if e["elapsed_ms"] is not None else None,
+                    e["rows"] if e["error"] is None else "error",
+                    e["origin"] or e["thread"],
+                    e["statement"],
+                )
+                for e in self.shown_entries
+            ],
+        )
+        self._fill(
+            self.hot,
+            [
+                (
+                    g["count"],
+                    "%.1f" % g["total_ms"],
+                    "%.1f" % g["mean_ms"],
+                    "%.1f" % g["max_ms"],
+                    ", ".join(g["origins"]),
+                    g["statement"],
+                )
+                for g in self.shown_summary
+            ],
+        )
+
+    def selectedEntry(self):
+        row = self.statements.currentRow()
+        if self.tabs.currentWidget() is self.statements and 0 <= row < len(self.shown_entries):
+            return self.shown_entries[row]
+        row = self.hot.currentRow()
+        if self.tabs.currentWidget() is self.hot and 0 <= row < len(self.shown_summary):
+            statement = self.shown_summary[row]["statement"]
+            for entry in self.shown_entries:
+                if entry["statement"] == statement:
+                    return entry
+        return None
+
+    def showEntry(self, row):
+        if not 0 <= row < len(self.shown_entries):
+            return
+        e = self.shown_entries[row]
+        text = [
+            e["statement"],
+            "",
+            "Parameters: %s" % json.dumps(e["parameters"]),
+            "Elapsed: %s ms, rows: %s, origin: %s, thread: %s"
+            % (e["elapsed_ms"], e["rows"], e["origin"], e["thread"]),
+        ]
+        if e["error"] is not None:
+            text.append("Error: %s" % e["error"])
+        if e["plan"] is not None:
+            text += ["", "Plan:", e["plan"]]
+        self.details.setPlainText("\n".join(text))
+
+    def showGroup(self, row):
+        if not 0 <= row < len(self.shown_summary):
+            return
+        g = self.shown_summary[row]
+        text = [
+            g["statement"],
+            "",
+            "Runs: %s, total: %.1f ms, mean: %.1f ms, max: %.1f ms, rows: %s, errors: %s"
+            % (g["count"], g["total_ms"], g["mean_ms"], g["max_ms"], g["rows"], g["errors"]),
+            "Origins: %s" % ", ".join(g["origins"]),
+        ]
+        plan = self.log.plans.get(g["statement"])
+        if plan is not None:
+            text += ["", "Plan:", plan]
+        self.details.setPlainText("\n".join(text))
+
+    def setSlow(self, *args):
+        self.log.slow_ms = self.slow_ms.value() if self.explain_slow.isChecked() else None
+
+    def explainSelected(self):
+        entry = self.selectedEntry()
+        if entry is None:
+            return
+        try:
+            plan = self.log.explain(entry)
+        except Exception as e:
+            self.details.appendPlainText("\nCould not explain statement: %s" % e)
+            return
+        if plan is None:
+            self.details.appendPlainText("\nStatement cannot be explained.")
+            return
+        if self.tabs.currentWidget() is self.statements:
+            self.showEntry(self.statements.currentRow())
+        else:
+            self.showGroup(self.hot.currentRow())
+
+    def exportJSON(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export SQL statements", "sql_statements.json", "JSON (*.json)"
+        )
+        if path:
+            self.log.export(path)
@@ -11,8 +11,13 @@ import traceback
 import inspect
 import functools
 import json
+import hashlib
+import tempfile
+import threading
+import time
 from grdb.database.v1_1_0.models import Sample
 from gresq.util.util import errorCheck
+from gresq.util.http import default_client
 import logging
 from sqlalchemy import String, Integer, Float, Numeric, Date
 from collections.abc import Sequence
@@ -21,6 +26,337 @@ import pyqtgraph as pg
 
 logger = logging.getLogger(__name__)
 
+
+class DownloadCancelled(Exception):
+    """
+    Raised when a download is aborted before its body has been fully received.
+    """
+
+
+class BlobCache:
+    """
+    Persistent on-disk cache for downloaded files (SEM images, masks, Raman spectra).
+
+    Blobs are stored once per content hash (sha256) under directory/blobs, and an index maps
+    each URL to its blob together with the ETag/Last-Modified validators returned by the server.
+    An entry younger than max_age is served from disk without contacting the server. Older
+    entries are revalidated with a conditional GET, so an unchanged file costs a 304 instead of
+    a full download. The least recently used entries are evicted once the blobs exceed max_bytes.
+    Blob and index writes go to a temporary file that is renamed into place, so an interrupted
+    write never leaves a truncated file behind.
+
+    directory:          (str) Cache directory. Created if missing.
+    max_bytes:          (int) Size bound for stored blobs.
+    max_age:            (float) Seconds an entry is served without revalidation.
+    session:            Object with a requests-compatible get method. Defaults to the shared
+                        HTTPClient (keep-alive pool, per-host limit, retries on 429/5xx).
+    timeout:            (float) Request timeout in seconds.
+    chunk_size:         (int) Bytes read per chunk while streaming a download.
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_bytes=2 * 1024 ** 3,
+        max_age=24 * 3600,
+        session=None,
+        timeout=60,
+        chunk_size=64 * 1024,
+    ):
+        self.directory = directory
+        self.blob_directory = os.path.join(directory, "blobs")
+        self.index_path = os.path.join(directory, "index.json")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.session = session if session is not None else default_client()
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.RLock()
+        self._url_locks = {}
+        os.makedirs(self.blob_directory, exist_ok=True)
+        self.index = self._loadIndex()
+
+    def _loadIndex(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Drop entries whose blob has gone missing.
+        return {
+            url: entry
+            for url, entry in index.items()
+            if os.path.exists(self.blobPath(entry["sha256"]))
+        }
+
+    def _atomicWrite(self, path, data, mode="wb"):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, mode) as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _saveIndex(self):
+        self._atomicWrite(self.index_path, json.dumps(self.index), mode="w")
+
+    def _urlLock(self, url):
+        with self._lock:
+            if url not in self._url_locks:
+                self._url_locks[url] = threading.Lock()
+            return self._url_locks[url]
+
+    def blobPath(self, sha256):
+        return os.path.join(self.blob_directory, sha256[:2], sha256)
+
+    def size(self):
+        """
+        Total bytes held by stored blobs.
+        """
+        with self._lock:
+            return sum({e["sha256"]: e["size"] for e in self.index.values()}.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "entries": len(self.index),
+                "bytes": self.size(),
+            }
+
+    def _read(self, url):
+        """
+        Returns the stored blob for url, or None if it is not (or no longer) on disk.
+        """
+        with self._lock:
+            entry = self.index.get(url)
+            if entry is None:
+                return None
+            entry["accessed"] = time.time()
+            path = self.blobPath(entry["sha256"])
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self.index.pop(url, None)
+            return None
+
+    def _addEntry(self, url, sha256, size, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            old = self.index.get(url)
+            self.index[url] = {
+                "sha256": sha256,
+                "size": size,
+                "etag": etag,
+                "last_modified": last_modified,
+                "validated": now,
+                "accessed": now,
+            }
+            if old is not None and old["sha256"] != sha256:
+                self._removeBlob(old["sha256"])
+            self.evict()
+            self._saveIndex()
+
+    def put(self, url, data, etag=None, last_modified=None):
+        """
+        Stores data for url and returns its content hash.
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.blobPath(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._atomicWrite(path, data)
+        self._addEntry(url, sha256, len(data), etag, last_modified)
+        return sha256
+
+    def _store(self, url, response, abort=None):
+        """
+        Streams a response body to disk, hashing it on the way, and indexes it under url.
+        Returns the content hash.
+
+        url:                (str) Download url.
+        response:           Streaming requests-compatible response.
+        abort:              Callable returning True when the transfer should stop.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.blob_directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if abort is not None and abort():
+                        raise DownloadCancelled(url)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            path = self.blobPath(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            response.close()
+        self._addEntry(
+            url,
+            sha256,
+            size,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return sha256
+
+    def _removeBlob(self, sha256):
+        if any(e["sha256"] == sha256 for e in self.index.values()):
+            return
+        try:
+            os.remove(self.blobPath(sha256))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Removes least recently used entries until the stored blobs fit in max_bytes.
+        """
+        with self._lock:
+            by_age = sorted(self.index.items(), key=lambda item: item[1]["accessed"])
+            while self.size() > self.max_bytes and len(by_age) > 0:
+                url, entry = by_age.pop(0)
+                del self.index[url]
+                self._removeBlob(entry["sha256"])
+
+    def invalidate(self, url):
+        with self._lock:
+            entry = self.index.pop(url, None)
+            if entry is not None:
+                self._removeBlob(entry["sha256"])
+                self._saveIndex()
+
+    def clear(self):
+        with self._lock:
+            for url in list(self.index.keys()):
+                entry = self.index.pop(url)
+                self._removeBlob(entry["sha256"])
+            self._saveIndex()
+
+    def get(self, url, abort=None):
+        """
+        Returns the contents of url, from disk when possible. Concurrent requests for the
+        same url share a single download. The body is streamed to disk in chunks, and
+        DownloadCancelled is raised if abort returns True before the transfer completes.
+
+        url:                (str) Download url.
+        abort:              Callable returning True when the transfer should stop.
+        """
+        return self._fetch(url, abort=abort)[0]
+
+    def _fetch(self, url, abort=None):
+        """
+        Implements get. Returns (data, downloaded) where downloaded tells whether the body
+        came over the network.
+        """
+        with self._urlLock(url):
+            if abort is not None and abort():
+                raise DownloadCancelled(url)
+            with self._lock:
+                entry = copy.copy(self.index.get(url))
+            if entry is not None and time.time() - entry["validated"] < self.max_age:
+                data = self._read(url)
+                if data is not None:
+                    with self._lock:
+                        self.hits += 1
+                    return data, False
+                entry = None
+
+            headers = {}
+            if entry is not None:
+                if entry["etag"]:
+                    headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    headers["If-Modified-Since"] = entry["last_modified"]
+            try:
+                r = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+            except requests.RequestException:
+                data = self._read(url) if entry is not None else None
+                if data is None:
+                    raise
+                logger.warning("Could not revalidate %s, serving cached copy." % url)
+                with self._lock:
+                    self.hits += 1
+                return data, False
+
+            if r.status_code == 304 and entry is not None:
+                r.close()
+                data = self._read(url)
+                if data is not None:
+                    with self._lock:
+                        self.hits += 1
+                        self.revalidated += 1
+                        if url in self.index:
+                            self.index[url]["validated"] = time.time()
+                            self._saveIndex()
+                    return data, False
+                r = self.session.get(url, timeout=self.timeout, stream=True)
+
+            try:
+                r.raise_for_status()
+            except Exception:
+                r.close()
+                raise
+            with self._lock:
+                self.misses += 1
+            sha256 = self._store(url, r, abort=abort)
+            with open(self.blobPath(sha256), "rb") as f:
+                return f.read(), True
+
+    def warm(self, url, abort=None):
+        """
+        Makes sure url is in the cache without returning its contents. Returns the number
+        of bytes transferred over the network (0 if a fresh copy was already on disk).
+
+        url:                (str) Download url.
+        abort:              Callable returning True when the transfer should stop.
+        """
+        with self._lock:
+            entry = self.index.get(url)
+            if entry is not None and time.time() - entry["validated"] < self.max_age:
+                return 0
+        data, downloaded = self._fetch(url, abort=abort)
+        return len(data) if downloaded else 0
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    """
+    Returns the BlobCache shared by the dashboard. The location and size bound can be set
+    with the GRESQ_CACHE_DIR and GRESQ_CACHE_MAX_BYTES environment variables.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            directory = os.environ.get(
+                "GRESQ_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gresq")
+            )
+            max_bytes = int(os.environ.get("GRESQ_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+            _default_cache = BlobCache(directory, max_bytes=max_bytes)
+        return _default_cache
+
+
 class DownloadThread(QtCore.QThread):
     """
     Threading class for downloading files. Can be used to download files in parallel.
@@ -28,15 +364,17 @@ class DownloadThread(QtCore.QThread):
     url:                    Box download url.
     thread_id:              Thread ID that used to identify the thread.
     info:                   Dictionary for extra parameters.
+    cache:                  (BlobCache) Cache used for the download. Defaults to default_cache().
     """
 
     downloadFinished = QtCore.pyqtSignal(object, int, object)
 
-    def __init__(self, url, thread_id, info={}):
+    def __init__(self, url, thread_id, info={}, cache=None):
         super(DownloadThread, self).__init__()
         self.url = url
         self.thread_id = thread_id
         self.info = info
+        self.cache = cache
         self.data = None
 
         self.finished.connect(self.signal)
@@ -48,8 +386,12 @@ class DownloadThread(QtCore.QThread):
         self.downloadFinished.emit(self.data, self.thread_id, self.info)
 
     def run(self):
-        r = requests.get(self.url)
-        self.data = r.content
+        cache = self.cache if self.cache is not None else default_cache()
+        try:
+            self.data = cache.get(self.url)
+        except Exception:
+            logger.exception("Error downloading %s" % self.url)
+            self.data = None
 
 class DownloadRunner(QtCore.QObject):
     """
@@ -77,75 +419,288 @@ class DownloadRunner(QtCore.QObject):
         print('Runner [%s] started.'%self.thread.thread_id)
         self.thread.start()
 
+class DownloadRequest(QtCore.QObject):
+    """
+    Handle for a download submitted to a DownloadScheduler. Its finished signal has the same
+    overloads as DownloadRunner, so slots written for DownloadThread.downloadFinished
+    (data, thread_id, info) can be connected directly. No signal is emitted once the
+    request has been cancelled.
+
+    url:                    Box download url.
+    thread_id:              ID passed back to the finished slot.
+    info:                   Dictionary for extra parameters passed back to the finished slot.
+    priority:               (int) Scheduling priority, see DownloadScheduler.
+    warm:                   (bool) Only fill the cache. finished then carries the number of
+                            bytes downloaded instead of the file contents.
+    """
+
+    finished = QtCore.pyqtSignal([], [object, int, object])
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+    _completed = QtCore.pyqtSignal(object, str)
+
+    def __init__(self, url, thread_id=0, info={}, priority=0, warm=False, parent=None):
+        super(DownloadRequest, self).__init__(parent=parent)
+        self.url = url
+        self.thread_id = thread_id
+        self.info = info
+        self.priority = priority
+        self.warm = warm
+        self.data = None
+        self._abort = threading.Event()
+        self._done = False
+        self.task = None
+        # Queued so delivery happens on this object's thread, after any cancel() made there.
+        self._completed.connect(self._deliver, QtCore.Qt.QueuedConnection)
+
+    def isCancelled(self):
+        return self._abort.is_set()
+
+    def isDone(self):
+        return self._done
+
+    def cancel(self):
+        """
+        Stops the request. A queued request is never started; a running transfer is
+        aborted at the next chunk.
+        """
+        if self._done or self._abort.is_set():
+            return
+        self._abort.set()
+        self.cancelled.emit()
+
+    def _deliver(self, data, error_text):
+        if self._done:
+            return
+        self._done = True
+        if self.isCancelled():
+            return
+        if error_text:
+            self.failed.emit(error_text)
+        else:
+            self.data = data
+            self.finished[object, int, object].emit(data, self.thread_id, self.info)
+            self.finished.emit()
+
+
+class DownloadTask(QtCore.QRunnable):
+    """
+    Runnable that fetches one DownloadRequest through a BlobCache.
+    """
+
+    def __init__(self, request, cache):
+        super(DownloadTask, self).__init__()
+        self.setAutoDelete(True)
+        self.request = request
+        self.cache = cache
+
+    def run(self):
+        request = self.request
+        if request.isCancelled():
+            request._completed.emit(None, "")
+            return
+        try:
+            if request.warm:
+                data = self.cache.warm(request.url, abort=request.isCancelled)
+            else:
+                data = self.cache.get(request.url, abort=request.isCancelled)
+        except DownloadCancelled:
+            logger.debug("Download cancelled: %s" % request.url)
+            request._completed.emit(None, "")
+            return
+        except Exception as e:
+            logger.exception("Error downloading %s" % request.url)
+            request._completed.emit(None, str(e) or type(e).__name__)
+            return
+        request._completed.emit(data, "")
+
+
+class DownloadScheduler(QtCore.QObject):
+    """
+    Shared download scheduler. A fixed number of workers fetch requests through a BlobCache,
+    highest priority first: files on the visible tab (VISIBLE), then other files of the
+    selected experiment (BACKGROUND), then prefetching (PREFETCH). Transfers are streamed in
+    chunks, so cancelling a request stops a running download mid-body as well as removing
+    queued ones. Workers share the cache's keep-alive HTTP session, so connections to a host
+    are reused across files.
+
+    max_thread_count:       (int) Number of concurrent downloads.
+    cache:                  (BlobCache) Cache to download through. Defaults to default_cache().
+    """
+
+    VISIBLE = 20
+    BACKGROUND = 10
+    PREFETCH = 0
+
+    def __init__(self, max_thread_count=4, cache=None, parent=None):
+        super(DownloadScheduler, self).__init__(parent=parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_thread_count)
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._requests = set()
+
+    def cache(self):
+        if self._cache is not None:
+            return self._cache
+        return default_cache()
+
+    def maxThreadCount(self):
+        return self.pool.maxThreadCount()
+
+    def pendingCount(self):
+        with self._lock:
+            return len(self._requests)
+
+    def submit(self, url, thread_id=0, info={}, priority=None, warm=False):
+        """
+        Schedules a download and returns its DownloadRequest.
+
+        url:                Download url.
+        thread_id:          ID passed back to the finished slot.
+        info:               Dictionary for extra parameters passed back to the finished slot.
+        priority:           (int) Scheduling priority. Defaults to VISIBLE.
+        warm:               (bool) Only fill the cache, see DownloadRequest.
+        """
+        if priority is None:
+            priority = self.VISIBLE
+        request = DownloadRequest(url, thread_id=thread_id, info=info, priority=priority, warm=warm)
+        request.task = DownloadTask(request, self.cache())
+        with self._lock:
+            self._requests.add(request)
+        request.finished.connect(lambda: self._release(request))
+        request.failed.connect(lambda e: self._release(request))
+        request.cancelled.connect(lambda: self._cancelled(request))
+        self.pool.start(request.task, priority)
+        return request
+
+    def _take(self, request):
+        """
+        Removes a request's task from the queue. Returns False if it is already running or done.
+        """
+        try:
+            return self.pool.tryTake(request.task)
+        except RuntimeError:
+            # The pool has already run and deleted the task.
+            return False
+
+    def setPriority(self, request, priority):
+        """
+        Moves a queued request to another priority lane. Has no effect once it is running.
+        """
+        request.priority = priority
+        if self._take(request):
+            self.pool.start(request.task, priority)
+
+    def cancel(self, request):
+        request.cancel()
+
+    def cancelAll(self):
+        with self._lock:
+            requests_ = list(self._requests)
+        for request in requests_:
+            request.cancel()
+
+    def _cancelled(self, request):
+        if self._take(request):
+            request._done = True
+        self._release(request)
+
+    def _release(self, request):
+        with self._lock:
+            self._requests.discard(request)
+
+
+_default_scheduler = None
+
+
+def default_scheduler():
+    """
+    Returns the DownloadScheduler shared by the dashboard. The number of concurrent downloads
+    can be set with the GRESQ_DOWNLOAD_THREADS environment variable.
+    """
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = DownloadScheduler(
+            max_thread_count=int(os.environ.get("GRESQ_DOWNLOAD_THREADS", 4))
+        )
+    return _default_scheduler
+
+
 class DownloadPool(QtCore.QObject):
     """
-    Thread pooler for handling download threads
+    Group of downloads belonging to one widget, scheduled on the shared DownloadScheduler.
+    terminate() cancels every download of the group that has not been delivered, so
+    switching experiments stops the downloads of the previous one.
 
-    max_thread_count:           (int) Max number of threads running at once.
+    priority:                   (int) Default priority of downloads added to the group.
+    scheduler:                  (DownloadScheduler) Defaults to default_scheduler().
     """
     started = QtCore.pyqtSignal()
     finished = QtCore.pyqtSignal()
     terminated = QtCore.pyqtSignal()
-    def __init__(self,max_thread_count=1):
-        super(DownloadPool,self).__init__()
-        self.max_thread_count = max_thread_count
-        self._count = 0
-        self.queue = deque()
-        self.running = []
-
-        self.started.connect(lambda: print("Threads Started. Count: %s"%self.count()))
-
-    def maxThreadCount(self):
-        return self.max_thread_count
+    def __init__(self, priority=DownloadScheduler.VISIBLE, scheduler=None, parent=None):
+        super(DownloadPool, self).__init__(parent=parent)
+        self.priority = priority
+        self._scheduler = scheduler
+        self.requests = []
+        self._done = 0
+
+    def scheduler(self):
+        if self._scheduler is not None:
+            return self._scheduler
+        return default_scheduler()
 
     def count(self):
-        return self._count
+        return len(self.requests)
 
-    def queueCount(self):
-        return len(self.queue)
+    def doneCount(self):
+        return self._done
 
     def runCount(self):
-        return len(self.running)
-
-    def doneCount(self):
-        return self.count() - self.runCount() - self.queueCount()
-
-    def addThread(self,thread):
-        assert isinstance(thread,DownloadThread)
-        # 'terminated' signal tells all runners to prevent DownloadThread 'finished' signal from emitting
-        runner = DownloadRunner(thread)
-        self.terminated.connect(runner.interrupt)
-        # When runner is interrupted or its DownloadThread finishes, thread is removed from pool
-        runner.finished.connect(lambda: self.running.remove(runner) if runner in self.running else None)
-        runner.terminated.connect(lambda: self.queue.remove(runner) if runner in self.queue else None)
-        # When thread finishes, run next thread in queue
-        runner.finished.connect(self.runNext)
-
-        self.queue.append(runner)
-        self._count += 1
-
-        print("Thread added: %s (Count: %s)"%(runner.thread.thread_id,self.count()))
-
-        return runner
-
-    def runNext(self):
-        if len(self.queue) > 0 and len(self.running) <= self.max_thread_count:
-            runner = self.queue.popleft()
-            self.running.append(runner)
-            runner.start()
-        elif len(self.running) == 0:
+        return self.count() - self.doneCount()
+
+    def add(self, url, thread_id=0, info={}, priority=None):
+        """
+        Schedules a download and returns its DownloadRequest.
+        """
+        request = self.scheduler().submit(
+            url,
+            thread_id=thread_id,
+            info=info,
+            priority=self.priority if priority is None else priority,
+        )
+        request.finished.connect(self._requestDone)
+        request.failed.connect(self._requestDone)
+        request.cancelled.connect(self._requestDone)
+        self.requests.append(request)
+        return request
+
+    def addThread(self, thread):
+        """
+        Schedules the download described by a DownloadThread (the thread itself is not started).
+        """
+        assert isinstance(thread, DownloadThread)
+        return self.add(thread.url, thread.thread_id, thread.info)
+
+    def setPriority(self, request, priority):
+        self.scheduler().setPriority(request, priority)
+
+    def _requestDone(self, *args):
+        self._done += 1
+        if self.count() > 0 and self._done == self.count():
             self.finished.emit()
 
     def run(self):
         self.started.emit()
-        while len(self.running) < self.max_thread_count and len(self.queue) > 0:
-            self.runNext()
 
     def terminate(self):
-        print("Thread pool termminated. (Queue: %s, Running: %s)"%(self.queueCount(),self.runCount()))
+        requests_ = self.requests
+        self.requests = []
+        for request in requests_:
+            request.cancel()
+        self._done = 0
         self.terminated.emit()
-        self._count = 0
-
 
 
 class IO(QtWidgets.QWidget):
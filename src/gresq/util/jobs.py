@@ -0,0 +1,365 @@
+"""
+Background jobs.
+
+Heavy computations started from the dashboard (t-SNE embeddings, frequent itemsets, Raman
+fits, image decoding) run through a JobRunner so the window stays responsive:
+
+    job = default_job_runner().submit(tsne_embedding, args=(data, seed))
+    job.finished.connect(self.showEmbedding)
+
+Jobs run in a pool of worker processes, so the function must be defined at module level and
+its arguments and result must pickle. thread=True runs a job in a thread pool instead, for
+work that releases the GIL (image decoding) or whose arguments are expensive to pickle.
+
+A function with a `context` argument is given a JobContext to report progress and to stop
+early when the job is cancelled:
+
+    def fit_all(paths, context=None):
+        for i, path in enumerate(paths):
+            context.check()
+            ...
+            context.progress(i + 1)
+
+Submitting a job identical to one still running (same function and arguments, or the same
+key) returns the running Job instead of starting another one.
+"""
+import os
+import atexit
+import pickle
+import hashlib
+import inspect
+import logging
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PyQt5 import QtCore
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """
+    Raised by JobContext.check in a job that was cancelled.
+    """
+
+
+class JobContext:
+    """
+    Handed to job functions that take a `context` argument.
+
+    job_id:             (int) Id of the job.
+    event:              Event set when the job is cancelled.
+    queue:              Queue progress is put on, for jobs in worker processes.
+    report:             Function called with progress, for jobs in threads.
+    """
+
+    def __init__(self, job_id, event, queue=None, report=None):
+        self.job_id = job_id
+        self.event = event
+        self.queue = queue
+        self.report = report
+
+    def progress(self, value):
+        """
+        Reports progress; value is emitted by Job.progress.
+        """
+        if self.report is not None:
+            self.report(value)
+        elif self.queue is not None:
+            self.queue.put((self.job_id, value))
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        """
+        Raises JobCancelled if the job was cancelled.
+        """
+        if self.event.is_set():
+            raise JobCancelled()
+
+
+def _call(function, args, kwargs, context):
+    if context is not None:
+        kwargs = dict(kwargs, context=context)
+    return function(*args, **kwargs)
+
+
+def _takes_context(function):
+    try:
+        return "context" in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def job_key(function, args=(), kwargs=None):
+    """
+    Returns a key identifying a call, or None if its arguments cannot be pickled.
+    """
+    try:
+        data = pickle.dumps(
+            (function.__module__, function.__qualname__, args, sorted((kwargs or {}).items())),
+            protocol=4,
+        )
+    except Exception:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+class Job(QtCore.QObject):
+    """
+    A submitted job. Signals are emitted in the thread the job was submitted from, after
+    control returns to its event loop, so they can be connected right after submit.
+
+    Signals:
+        progress(value)
+        finished(result)
+        failed(error_text)
+        cancelled()
+    """
+
+    progress = QtCore.pyqtSignal(object)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+    _report = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, runner, job_id, key, event):
+        super(Job, self).__init__()
+        self.runner = runner
+        self.id = job_id
+        self.key = key
+        self.event = event
+        self.future = None
+        self.done = False
+        self.result = None
+        self.error = None
+        self._report.connect(self._deliver, QtCore.Qt.QueuedConnection)
+
+    def cancel(self):
+        """
+        Cancels the job: a queued job never starts, a running one sees JobContext.cancelled()
+        and its result is discarded.
+        """
+        if self.done:
+            return
+        self.event.set()
+        # Identical jobs submitted from now on start afresh.
+        self.runner._forget(self)
+        if self.future is not None:
+            self.future.cancel()
+
+    def isCancelled(self):
+        return self.event.is_set()
+
+    def _completed(self, future):
+        # Runs in a pool thread, or in the submitting thread if the future is already done.
+        if future.cancelled() or self.event.is_set():
+            self._report.emit("cancelled", None)
+            return
+        try:
+            self._report.emit("finished", future.result())
+        except JobCancelled:
+            self._report.emit("cancelled", None)
+        except BrokenProcessPool:
+            self.runner._discardPool()
+            self._report.emit("failed", traceback.format_exc())
+        except Exception:
+            self._report.emit("failed", traceback.format_exc())
+
+    def _deliver(self, kind, value):
+        if kind == "progress":
+            if not self.done:
+                self.progress.emit(value)
+            return
+        if self.done:
+            return
+        self.done = True
+        self.runner._forget(self)
+        if kind == "finished":
+            self.result = value
+            self.finished.emit(value)
+        elif kind == "failed":
+            self.error = value
+            logger.warning(value)
+            self.failed.emit(value)
+        else:
+            self.cancelled.emit()
+
+
+class JobRunner(QtCore.QObject):
+    """
+    Runs jobs in worker processes or threads and reports back through Job signals (see the
+    module docstring).
+
+    max_workers:        (int) Worker processes. Defaults to one less than the number of cores.
+    max_threads:        (int) Threads for thread=True jobs.
+    start_method:       (str) multiprocessing start method of the workers. "spawn" does not
+                        copy the Qt state of the dashboard into them.
+    """
+
+    def __init__(self, max_workers=None, max_threads=4, start_method="spawn", parent=None):
+        super(JobRunner, self).__init__(parent=parent)
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) - 1)
+        self.max_workers = max_workers
+        self.max_threads = max_threads
+        self.start_method = start_method
+        self._processes = None
+        self._threads = None
+        self._manager = None
+        self._queue = None
+        self._listener = None
+        self._jobs = {}
+        self._running = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _processPool(self):
+        if self._processes is None:
+            context = multiprocessing.get_context(self.start_method)
+            if self._manager is None:
+                self._manager = context.Manager()
+                self._queue = self._manager.Queue()
+                self._listener = threading.Thread(
+                    target=self._listen, args=(self._queue,), daemon=True
+                )
+                self._listener.start()
+            self._processes = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context
+            )
+        return self._processes
+
+    def _threadPool(self):
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(
+                max_workers=self.max_threads, thread_name_prefix="gresq-job"
+            )
+        return self._threads
+
+    def _discardPool(self):
+        with self._lock:
+            processes, self._processes = self._processes, None
+        if processes is not None:
+            processes.shutdown(wait=False)
+
+    def _listen(self, queue):
+        while True:
+            try:
+                item = queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, value = item
+            with self._lock:
+                job = self._running.get(job_id)
+            if job is not None:
+                job._report.emit("progress", value)
+
+    def _forget(self, job):
+        with self._lock:
+            self._running.pop(job.id, None)
+            if job.key is not None and self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+
+    def submit(self, function, args=(), kwargs=None, key=None, thread=False):
+        """
+        Starts a job and returns its Job, or the running Job of an identical call.
+
+        function:       Function to call. Takes an optional `context` argument.
+        args:           (tuple) Positional arguments.
+        kwargs:         (dict) Keyword arguments.
+        key:            (str) Identifies the job for deduplication. Defaults to a hash of
+                        the function and arguments.
+        thread:         (bool) Run in a thread instead of a worker process.
+        """
+        args = tuple(args)
+        kwargs = dict(kwargs or {})
+        if key is None:
+            key = job_key(function, args, kwargs)
+        with self._lock:
+            if key is not None and key in self._jobs:
+                return self._jobs[key]
+            self._next_id += 1
+            job_id = self._next_id
+        takes_context = _takes_context(function)
+
+        if thread:
+            event = threading.Event()
+            job = Job(self, job_id, key, event)
+            context = None
+            if takes_context:
+                context = JobContext(
+                    job_id, event, report=lambda value: job._report.emit("progress", value)
+                )
+            pool = self._threadPool()
+        else:
+            pool = self._processPool()
+            event = self._manager.Event() if takes_context else threading.Event()
+            job = Job(self, job_id, key, event)
+            context = JobContext(job_id, event, queue=self._queue) if takes_context else None
+
+        with self._lock:
+            self._running[job_id] = job
+            if key is not None:
+                self._jobs[key] = job
+        try:
+            job.future = pool.submit(_call, function, args, kwargs, context)
+        except Exception:
+            # The pool was shut down or broke; start a new one for the next job.
+            if not thread:
+                self._discardPool()
+            job.future = None
+            job._report.emit("failed", traceback.format_exc())
+            return job
+        job.future.add_done_callback(job._completed)
+        return job
+
+    def runningJobs(self):
+        with self._lock:
+            return list(self._running.values())
+
+    def cancelAll(self):
+        for job in self.runningJobs():
+            job.cancel()
+
+    def shutdown(self):
+        """
+        Cancels the running jobs and stops the workers.
+        """
+        self.cancelAll()
+        if self._threads is not None:
+            self._threads.shutdown(wait=False)
+            self._threads = None
+        self._discardPool()
+        if self._manager is not None:
+            try:
+                self._queue.put(None)
+            except Exception:
+                pass
+            self._manager.shutdown()
+            self._manager = None
+            self._queue = None
+
+
+_default_job_runner = None
+_default_job_runner_lock = threading.Lock()
+
+
+def default_job_runner():
+    """
+    Returns the JobRunner shared by the dashboard. The number of worker processes can be set
+    with the GRESQ_JOB_WORKERS environment variable.
+    """
+    global _default_job_runner
+    with _default_job_runner_lock:
+        if _default_job_runner is None:
+            workers = os.environ.get("GRESQ_JOB_WORKERS")
+            _default_job_runner = JobRunner(
+                max_workers=int(workers) if workers else None
+            )
+            atexit.register(_default_job_runner.shutdown)
+        return _default_job_runner
@@ -0,0 +1,201 @@
+"""
+Deferred imports, deferred tab construction and startup timing for the dashboard.
+
+Analytics and imaging modules (scikit-learn, scipy, OpenCV, gsaimage, gsaraman) take longer
+to import than the rest of the dashboard together. lazy_import returns a stand-in that
+imports the module on first attribute access, and LazyTab builds a tab's widget the first
+time the tab is shown, so those modules are only loaded once the user opens a tab that
+needs them.
+"""
+import sys
+import time
+import importlib
+import logging
+import threading
+from contextlib import contextmanager
+from PyQt5 import QtCore, QtWidgets
+
+logger = logging.getLogger(__name__)
+
+# Seconds spent importing each module loaded through lazy_import.
+import_times = {}
+_import_lock = threading.RLock()
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported the first time one of its attributes is used.
+
+    name:               (str) Absolute module name.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with _import_lock:
+                module = self.__dict__["_module"]
+                if module is None:
+                    name = self.__dict__["_name"]
+                    t = time.perf_counter()
+                    module = importlib.import_module(name)
+                    if name not in import_times:
+                        import_times[name] = time.perf_counter() - t
+                        logger.debug(
+                            "Imported %s in %.0f ms" % (name, import_times[name] * 1000)
+                        )
+                    self.__dict__["_module"] = module
+        return module
+
+    def isLoaded(self):
+        return self.__dict__["_module"] is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.isLoaded() else "not loaded"
+        return "<lazy module %r (%s)>" % (self.__dict__["_name"], state)
+
+
+def lazy_import(name):
+    """
+    Returns the module if it is already imported, otherwise a LazyModule that imports it on
+    first use.
+
+    name:               (str) Absolute module name.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+class LazyTab(QtWidgets.QWidget):
+    """
+    Placeholder tab that builds its widget the first time it is shown.
+
+    factory:            Callable returning the tab widget.
+
+    Signals:
+        built(widget)   Emitted once the widget has been built.
+    """
+
+    built = QtCore.pyqtSignal(object)
+
+    def __init__(self, factory, parent=None):
+        super(LazyTab, self).__init__(parent=parent)
+        self.factory = factory
+        self._widget = None
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+    def isBuilt(self):
+        return self._widget is not None
+
+    def widget(self):
+        """
+        Returns the tab widget, building it if needed.
+        """
+        if self._widget is None:
+            t = time.perf_counter()
+            QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            try:
+                self._widget = self.factory()
+            finally:
+                QtWidgets.QApplication.restoreOverrideCursor()
+            self.layout().addWidget(self._widget)
+            logger.debug(
+                "Built %s in %.0f ms"
+                % (type(self._widget).__name__, (time.perf_counter() - t) * 1000)
+            )
+            self.built.emit(self._widget)
+        return self._widget
+
+    def showEvent(self, event):
+        self.widget()
+        super(LazyTab, self).showEvent(event)
+
+
+class _FirstPaintFilter(QtCore.QObject):
+    def __init__(self, callback, parent=None):
+        super(_FirstPaintFilter, self).__init__(parent=parent)
+        self.callback = callback
+
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint and self.callback is not None:
+            callback, self.callback = self.callback, None
+            # Report once the paint event has been handled.
+            QtCore.QTimer.singleShot(0, callback)
+        return False
+
+
+class StartupTimer:
+    """
+    Records how long the phases of startup take, how many modules each one imports and when
+    the first window is painted, and logs the breakdown.
+
+    start:              (float) time.perf_counter() value startup is measured from.
+                        Defaults to now.
+    """
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []
+        self.first_paint = None
+        self._filter = None
+
+    def record(self, label, seconds, modules=0):
+        """
+        Records a phase timed elsewhere, e.g. module-level imports.
+        """
+        self.phases.append((label, seconds, modules))
+
+    @contextmanager
+    def phase(self, label):
+        """
+        Context manager timing one phase of startup.
+        """
+        t = time.perf_counter()
+        modules = len(sys.modules)
+        try:
+            yield
+        finally:
+            self.record(label, time.perf_counter() - t, len(sys.modules) - modules)
+
+    def watchFirstPaint(self, app):
+        """
+        Logs the report once the application paints its first widget.
+
+        app:            QApplication.
+        """
+        self._filter = _FirstPaintFilter(lambda: self._painted(app), parent=app)
+        app.installEventFilter(self._filter)
+
+    def _painted(self, app):
+        self.first_paint = time.perf_counter() - self.start
+        app.removeEventFilter(self._filter)
+        self._filter = None
+        self.report()
+
+    def report(self):
+        """
+        Logs the time and imported modules of every phase, the lazy imports made so far and
+        the time to first paint.
+        """
+        lines = ["Startup breakdown:"]
+        for label, seconds, modules in self.phases:
+            lines.append("  %-24s %8.0f ms %6d modules" % (label, seconds * 1000, modules))
+        for name, seconds in sorted(import_times.items(), key=lambda x: -x[1]):
+            lines.append("  %-24s %8.0f ms (deferred import)" % (name, seconds * 1000))
+        if self.first_paint is not None:
+            lines.append("  %-24s %8.0f ms" % ("first paint", self.first_paint * 1000))
+        logger.info("\n".join(lines))
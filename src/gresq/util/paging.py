@@ -0,0 +1,386 @@
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+from PyQt5 import QtCore
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import Query
+from gresq.util.replica import read_engine
+from gresq.util.util import ResultsModel, display_strings
+from gresq.util.query_engine import _dbapi_connection, cancel_statement, runs_inline
+from gresq.util.instrumentation import origin, current_origin
+
+logger = logging.getLogger(__name__)
+
+
+def keyset_filter(sort_column, id_column, last_value, last_id, ascending=True):
+    """
+    Returns the condition selecting the rows that come after (last_value, last_id) when rows
+    are ordered by keyset_order. NULL sort values come after all others.
+
+    sort_column:            Column the rows are sorted by.
+    id_column:              Unique column breaking ties.
+    last_value:             Sort value of the last row already read.
+    last_id:                Id of the last row already read.
+    ascending:              (bool) Sort direction.
+    """
+    if ascending:
+        after = lambda column, value: column > value
+    else:
+        after = lambda column, value: column < value
+    if last_value is None:
+        return and_(sort_column.is_(None), after(id_column, last_id))
+    return or_(
+        after(sort_column, last_value),
+        and_(sort_column == last_value, after(id_column, last_id)),
+        sort_column.is_(None),
+    )
+
+
+def keyset_order(sort_column, id_column, ascending=True):
+    """
+    Returns the ORDER BY clauses matching keyset_filter.
+    """
+    if ascending:
+        return [sort_column.is_(None), sort_column, id_column]
+    return [sort_column.is_(None), sort_column.desc(), id_column.desc()]
+
+
+def count_query(query):
+    """
+    Returns a query counting the rows of query.
+    """
+    return Query([func.count()]).select_from(query.subquery("results"))
+
+
+class PageTask(QtCore.QRunnable):
+    """
+    Runnable reading one page of a PagedResultsTableModel on its own connection. The rows
+    are handed back to the model through its queued _pageRead signal.
+
+    model:                  (PagedResultsTableModel) Model the page belongs to.
+    generation:             (int) Generation of the model when the read was scheduled.
+    page:                   (int) Page number.
+    statement:              SQLAlchemy selectable reading the page.
+    origin:                 (str) Origin label of the statement (see gresq.util.instrumentation).
+    """
+
+    def __init__(self, model, generation, page, statement, origin=None):
+        super(PageTask, self).__init__()
+        self.setAutoDelete(True)
+        self.model = model
+        self.generation = generation
+        self.page = page
+        self.statement = statement
+        self.origin = origin
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._dbapi_connection = None
+
+    def isCancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Flags the task as cancelled and aborts its statement on the server if it is running.
+        """
+        self._cancelled.set()
+        with self._lock:
+            if self._dbapi_connection is not None:
+                try:
+                    cancel_statement(self._dbapi_connection)
+                except Exception:
+                    logger.debug(traceback.format_exc())
+
+    def run(self):
+        with origin(self.origin):
+            self._run()
+
+    def _run(self):
+        if self.isCancelled():
+            return
+        try:
+            with self.model.bind().connect() as connection:
+                with self._lock:
+                    self._dbapi_connection = _dbapi_connection(connection)
+                try:
+                    rows = [tuple(r) for r in connection.execute(self.statement)]
+                finally:
+                    with self._lock:
+                        self._dbapi_connection = None
+        except Exception as e:
+            if not self.isCancelled():
+                logger.exception(traceback.format_exc())
+                self.model._pageFailed.emit(self.generation, self.page, str(e))
+            return
+        if not self.isCancelled():
+            self.model._pageRead.emit(self.generation, self.page, rows)
+
+
+class PagedResultsTableModel(ResultsModel):
+    """
+    Results table model that reads rows from the database a page at a time instead of
+    loading the whole result set. Pages are read with keyset pagination, ordered by the
+    sort column and the id column, so reading any page costs the same however far the user
+    has scrolled. The view pulls further pages through canFetchMore/fetchMore as it is
+    scrolled. Only the most recently used pages are kept in memory; the first row of every
+    page is remembered so evicted pages can be read again. Sorting starts over from the
+    first page of the new order.
+
+    Pages are read by PageTasks in a thread pool, never on the GUI thread: rows are inserted
+    when their page arrives, and cells of an evicted page show placeholder until it has been
+    read again. Sorting or cancel() drops the pages still being read. A page that cannot be
+    read is reported through failed, and no more pages are read until the model is sorted.
+    Display strings are formatted a block of rows of one column at a time, the first time a
+    cell of the block is shown, and dropped with their page.
+
+    query:              SQLAlchemy Query with the result columns (e.g. from results_query).
+    bind:               SQLAlchemy engine used to read pages. Defaults to read_engine(),
+                        the replica in replica mode.
+    id_column:          (str) Name of the unique column used to break ties.
+    page_size:          (int) Rows read per page.
+    max_pages:          (int) Pages kept in memory.
+    max_thread_count:   (int) Pages read at the same time.
+
+    Signals:
+        pageLoaded(page)
+        failed(error_text)
+    """
+
+    pageLoaded = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+    _pageRead = QtCore.pyqtSignal(int, int, object)
+    _pageFailed = QtCore.pyqtSignal(int, int, str)
+
+    # Shown in the cells of a page that is being read.
+    placeholder = "..."
+    # Rows whose display strings are formatted at once.
+    block_size = 64
+
+    def __init__(
+        self,
+        query,
+        bind=None,
+        id_column="id",
+        page_size=500,
+        max_pages=20,
+        max_thread_count=2,
+        parent=None,
+    ):
+        super(PagedResultsTableModel, self).__init__(parent=parent)
+        self.results = query.subquery("results")
+        self.column_names = [c.key for c in self.results.c]
+        self.id_column = id_column
+        self._bind = bind
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.sort_column = None
+        self.ascending = True
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_thread_count)
+        self.generation = 0
+        self.pending = {}
+        self._pageRead.connect(self._receivePage, QtCore.Qt.QueuedConnection)
+        self._pageFailed.connect(self._receiveError, QtCore.Qt.QueuedConnection)
+        self._reset()
+
+    def _reset(self):
+        self.cancel()
+        self.pages = OrderedDict()
+        # Display strings of the pages in memory, by (page, column, block).
+        self.texts = {}
+        # (sort value, id) of the last row of each page read so far.
+        self.boundaries = []
+        self.loaded = 0
+        self.exhausted = False
+        self.error = None
+
+    def cancel(self):
+        """
+        Cancels the page reads in progress; their rows are dropped.
+        """
+        self.generation += 1
+        for task in self.pending.values():
+            task.cancel()
+            try:
+                self.pool.tryTake(task)
+            except RuntimeError:
+                # The pool has already run and deleted the task.
+                pass
+        self.pending = {}
+
+    def bind(self):
+        if self._bind is not None:
+            return self._bind
+        return read_engine()
+
+    def columnNames(self):
+        return self.column_names
+
+    def _pageQuery(self, page):
+        c = self.results.c
+        id_column = c[self.id_column]
+        sort_column = c[self.sort_column] if self.sort_column is not None else None
+        q = Query(list(c))
+        if page > 0:
+            last_value, last_id = self.boundaries[page - 1]
+            if sort_column is None:
+                q = q.filter(id_column > last_id if self.ascending else id_column < last_id)
+            else:
+                q = q.filter(
+                    keyset_filter(sort_column, id_column, last_value, last_id, self.ascending)
+                )
+        if sort_column is None:
+            q = q.order_by(id_column if self.ascending else id_column.desc())
+        else:
+            q = q.order_by(*keyset_order(sort_column, id_column, self.ascending))
+        return q.limit(self.page_size)
+
+    @origin("PagedResultsTableModel")
+    def _schedule(self, page):
+        """
+        Starts reading page unless it is already being read.
+        """
+        if page in self.pending or self.error is not None:
+            return
+        task = PageTask(
+            self, self.generation, page, self._pageQuery(page).statement, origin=current_origin()
+        )
+        self.pending[page] = task
+        if runs_inline(self.bind()):
+            task.setAutoDelete(False)
+            task.run()
+        else:
+            self.pool.start(task)
+
+    def _receivePage(self, generation, page, rows):
+        if generation != self.generation:
+            return
+        self.pending.pop(page, None)
+        self._store(page, rows)
+
+        if page == len(self.boundaries):
+            if len(rows) < self.page_size:
+                self.exhausted = True
+            if len(rows) > 0:
+                last = rows[-1]
+                sort_value = (
+                    last[self.column_names.index(self.sort_column)]
+                    if self.sort_column is not None
+                    else None
+                )
+                self.boundaries.append(
+                    (sort_value, last[self.column_names.index(self.id_column)])
+                )
+                self.beginInsertRows(
+                    QtCore.QModelIndex(), self.loaded, self.loaded + len(rows) - 1
+                )
+                self.loaded += len(rows)
+                self.endInsertRows()
+        elif len(rows) > 0:
+            # An evicted page read again.
+            first = page * self.page_size
+            last = min(first + len(rows), self.loaded) - 1
+            self.dataChanged.emit(
+                self.index(first, 0), self.index(last, len(self.column_names) - 1)
+            )
+        self.pageLoaded.emit(page)
+
+    def _store(self, page, rows):
+        self._dropTexts(page)
+        self.pages[page] = rows
+        self.pages.move_to_end(page)
+        while len(self.pages) > self.max_pages:
+            evicted, _ = self.pages.popitem(last=False)
+            self._dropTexts(evicted)
+
+    def _dropTexts(self, page):
+        blocks = -(-self.page_size // self.block_size)
+        for column in range(len(self.column_names)):
+            for block in range(blocks):
+                self.texts.pop((page, column, block), None)
+
+    def _receiveError(self, generation, page, error_text):
+        if generation != self.generation:
+            return
+        self.pending.pop(page, None)
+        self.error = error_text
+        self.failed.emit(error_text)
+
+    def row(self, row):
+        """
+        Returns the values of a loaded row as a tuple. If its page was evicted, returns None
+        and reads the page again.
+        """
+        page, offset = divmod(row, self.page_size)
+        rows = self.pages.get(page)
+        if rows is None:
+            self._schedule(page)
+            return None
+        self.pages.move_to_end(page)
+        return rows[offset]
+
+    def value(self, column, row):
+        """
+        Returns the value of column (name) in row, or None if its page is being read.
+        """
+        values = self.row(row)
+        if values is None:
+            return None
+        return values[self.column_names.index(column)]
+
+    def rowId(self, row):
+        """
+        Returns the id of row, or None if its page is being read.
+        """
+        value = self.value(self.id_column, row)
+        return int(value) if value is not None else None
+
+    def rowCount(self, parent=None):
+        if parent is not None and parent.isValid():
+            return 0
+        return self.loaded
+
+    def columnCount(self, parent=None):
+        if parent is not None and parent.isValid():
+            return 0
+        return len(self.column_names)
+
+    def canFetchMore(self, parent=None):
+        if parent is not None and parent.isValid():
+            return False
+        return not self.exhausted and self.error is None
+
+    def fetchMore(self, parent=None):
+        """
+        Starts reading the next page; its rows are inserted when it arrives.
+        """
+        if self.canFetchMore(parent):
+            self._schedule(len(self.boundaries))
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            page, offset = divmod(index.row(), self.page_size)
+            rows = self.pages.get(page)
+            if rows is None:
+                self._schedule(page)
+                return self.placeholder
+            self.pages.move_to_end(page)
+            block, offset = divmod(offset, self.block_size)
+            key = (page, index.column(), block)
+            strings = self.texts.get(key)
+            if strings is None:
+                start = block * self.block_size
+                values = [r[index.column()] for r in rows[start : start + self.block_size]]
+                strings = display_strings(values, [v is None or v != v for v in values])
+                self.texts[key] = strings
+            return strings[offset]
+        return QtCore.QVariant()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.beginResetModel()
+        self.sort_column = self.column_names[column]
+        self.ascending = order == QtCore.Qt.AscendingOrder
+        self._reset()
+        self.endResetModel()
+        self.fetchMore()
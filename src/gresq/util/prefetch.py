@@ -0,0 +1,201 @@
+import logging
+import threading
+import traceback
+from collections import deque
+from PyQt5 import QtCore
+from grdb.database.models import SemFile, SemAnalysis, RamanFile
+from gresq.util.io import DownloadScheduler, default_scheduler
+from gresq.util.instrumentation import origin
+from gresq.util.replica import read_session
+
+logger = logging.getLogger(__name__)
+
+
+def experiment_asset_urls(session, experiment_ids):
+    """
+    Returns {experiment_id: [url, ...]} with the files the preview tabs download for each
+    experiment, in the order they are displayed: SEM images, default masks, Raman spectra.
+
+    session:                SQLAlchemy session.
+    experiment_ids:         (list of int) Experiment ids.
+    """
+    urls = {i: [] for i in experiment_ids}
+    if len(experiment_ids) == 0:
+        return urls
+    sem = (
+        session.query(SemFile.experiment_id, SemFile.url)
+        .filter(SemFile.experiment_id.in_(experiment_ids))
+        .order_by(SemFile.id)
+    )
+    masks = (
+        session.query(SemFile.experiment_id, SemAnalysis.mask_url)
+        .join(SemAnalysis, SemAnalysis.id == SemFile.default_analysis_id)
+        .filter(SemFile.experiment_id.in_(experiment_ids))
+        .order_by(SemFile.id)
+    )
+    raman = (
+        session.query(RamanFile.experiment_id, RamanFile.url)
+        .filter(RamanFile.experiment_id.in_(experiment_ids))
+        .order_by(RamanFile.id)
+    )
+    for q in (sem, masks, raman):
+        for experiment_id, url in q:
+            if url:
+                urls[experiment_id].append(url)
+    return urls
+
+
+def neighbour_rows(row, distance, row_count):
+    """
+    Returns the rows within distance of row, nearest first and the next row before the
+    previous one at each distance.
+
+    row:                    (int) Selected row.
+    distance:               (int) Rows on each side.
+    row_count:              (int) Number of rows.
+    """
+    rows = []
+    for d in range(1, distance + 1):
+        for r in (row + d, row - d):
+            if 0 <= r < row_count:
+                rows.append(r)
+    return rows
+
+
+class AssetLookup(QtCore.QRunnable):
+    """
+    Looks up the file urls of a batch of experiments on a worker thread.
+    """
+
+    def __init__(self, prefetcher, generation, experiment_ids):
+        super(AssetLookup, self).__init__()
+        self.prefetcher = prefetcher
+        self.generation = generation
+        self.experiment_ids = experiment_ids
+
+    def run(self):
+        if not self.prefetcher.isCurrent(self.generation):
+            return
+        session = read_session()
+        try:
+            with origin("Prefetcher.prefetch"):
+                urls = experiment_asset_urls(session, self.experiment_ids)
+        except Exception:
+            logger.warning(traceback.format_exc())
+            return
+        finally:
+            session.close()
+        self.prefetcher._urlsReady.emit(self.generation, self.experiment_ids, urls)
+
+
+class Prefetcher(QtCore.QObject):
+    """
+    Warms the download cache with the SEM images, masks and Raman spectra of experiments the
+    user is likely to open next, so selecting them in the results table is served from disk.
+
+    Downloads run on the shared DownloadScheduler in the PREFETCH lane, so anything the user
+    actually opens overtakes them, and only a few are queued at a time. Each query gets a byte
+    budget; once it is spent no new prefetches are started. reset() (called when the query
+    changes) cancels everything outstanding.
+
+    budget:                 (int) Bytes that may be downloaded per query.
+    max_pending:            (int) Prefetch downloads queued or running at once. Defaults to one
+                            less than the scheduler's worker count, so a download the user
+                            asks for always finds a free worker.
+    scheduler:              (DownloadScheduler) Defaults to default_scheduler().
+    """
+
+    _urlsReady = QtCore.pyqtSignal(int, object, object)
+
+    def __init__(self, budget=200 * 1024 ** 2, max_pending=None, scheduler=None, parent=None):
+        super(Prefetcher, self).__init__(parent=parent)
+        self.budget = budget
+        self.max_pending = max_pending
+        self._scheduler = scheduler
+        self.lookup_pool = QtCore.QThreadPool(self)
+        self.lookup_pool.setMaxThreadCount(1)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.spent = 0
+        self.queue = deque()
+        self.requested = set()
+        self.pending = []
+        self._urlsReady.connect(self._enqueue)
+
+    def scheduler(self):
+        if self._scheduler is not None:
+            return self._scheduler
+        return default_scheduler()
+
+    def isCurrent(self, generation):
+        with self._lock:
+            return generation == self._generation
+
+    def remaining(self):
+        return max(self.budget - self.spent, 0)
+
+    def reset(self):
+        """
+        Cancels outstanding prefetches and starts a fresh budget.
+        """
+        with self._lock:
+            self._generation += 1
+        self.lookup_pool.clear()
+        self.queue.clear()
+        self.requested = set()
+        pending, self.pending = self.pending, []
+        for request in pending:
+            request.cancel()
+        self.spent = 0
+
+    def prefetch(self, experiment_ids):
+        """
+        Queues the files of experiment_ids for prefetching, ahead of anything queued earlier.
+        Experiments already requested since the last reset are skipped.
+
+        experiment_ids:     (list of int) Experiment ids, most likely to be opened first.
+        """
+        ids = [int(i) for i in experiment_ids if int(i) not in self.requested]
+        if len(ids) == 0 or self.remaining() == 0:
+            return
+        self.requested.update(ids)
+        with self._lock:
+            generation = self._generation
+        self.lookup_pool.start(AssetLookup(self, generation, ids))
+
+    def _enqueue(self, generation, experiment_ids, urls):
+        if not self.isCurrent(generation):
+            return
+        batch = []
+        for experiment_id in experiment_ids:
+            batch.extend(urls.get(experiment_id, []))
+        # Newest requests are closest to the selection, so they go first.
+        self.queue.extendleft(reversed(batch))
+        self._startNext()
+
+    def _startNext(self):
+        max_pending = self.max_pending
+        if max_pending is None:
+            # Priorities only order the queue: a running prefetch is never preempted.
+            max_pending = max(self.scheduler().maxThreadCount() - 1, 0)
+        while len(self.queue) > 0 and len(self.pending) < max_pending and self.remaining() > 0:
+            url = self.queue.popleft()
+            request = self.scheduler().submit(
+                url, priority=DownloadScheduler.PREFETCH, warm=True
+            )
+            request.finished[object, int, object].connect(
+                lambda nbytes, thread_id, info, r=request: self._done(r, nbytes)
+            )
+            request.failed.connect(lambda e, r=request: self._done(r, 0))
+            self.pending.append(request)
+
+    def _done(self, request, nbytes):
+        if request not in self.pending:
+            return
+        self.pending.remove(request)
+        self.spent += nbytes
+        if self.remaining() == 0:
+            logger.debug("Prefetch budget spent (%s bytes)." % self.spent)
+            self.queue.clear()
+            return
+        self._startNext()
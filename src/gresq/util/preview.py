@@ -0,0 +1,266 @@
+"""
+Loading of the experiment graph shown by the preview tabs.
+
+The preview tabs read an experiment's properties, recipe (with its preparation steps),
+substrate, furnace, environment conditions, authors, SEM files (with their analyses) and
+Raman files (with their analyses). PreviewLoader reads all of that for a batch of
+experiments with eager loading: the one-to-one parts are joined into the experiment query
+and each collection is read with one IN query for the whole batch. The loaded experiments
+are detached from their session and kept in an LRU cache, stamped with the table versions
+(see gresq.util.versions) of the tables they were read from.
+"""
+import threading
+import logging
+from collections import OrderedDict
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.ext.hybrid import hybrid_property
+from gresq.util.replica import read_engine
+from grdb.database.models import (
+    Experiment,
+    Properties,
+    Recipe,
+    Substrate,
+    Furnace,
+    EnvironmentConditions,
+    Author,
+    PreparationStep,
+    SemFile,
+    SemAnalysis,
+    RamanFile,
+    RamanAnalysis,
+)
+from gresq.util.versions import current_versions
+
+logger = logging.getLogger(__name__)
+
+# Classes shown by the preview tabs, with the classes read along with each of them.
+preview_graph = {
+    Properties: [],
+    Recipe: [PreparationStep],
+    Substrate: [],
+    Furnace: [],
+    EnvironmentConditions: [],
+    Author: [],
+    SemFile: [SemAnalysis],
+    RamanFile: [RamanAnalysis],
+}
+
+
+def _relationships(cls, targets):
+    """
+    Returns the relationships of cls leading to any of the target classes.
+    """
+    return [
+        r
+        for r in cls.__mapper__.relationships
+        if r.mapper.class_ in targets and r.lazy not in ("dynamic", "noload", "raise")
+    ]
+
+
+def _load(parent_loader, cls, relationship):
+    """
+    Returns the loader option for relationship: collections are read with one IN query per
+    batch, single objects are joined into the query of their parent.
+    """
+    attribute = getattr(cls, relationship.key)
+    if parent_loader is None:
+        load = selectinload if relationship.uselist else joinedload
+    else:
+        load = (
+            parent_loader.selectinload if relationship.uselist else parent_loader.joinedload
+        )
+    return load(attribute)
+
+
+def preview_options():
+    """
+    Returns the loader options reading the preview graph of experiments.
+    """
+    options = []
+    for relationship in _relationships(Experiment, preview_graph):
+        loader = _load(None, Experiment, relationship)
+        children = _relationships(relationship.mapper.class_, preview_graph[relationship.mapper.class_])
+        if len(children) == 0:
+            options.append(loader)
+        for child in children:
+            options.append(_load(loader, relationship.mapper.class_, child))
+    return options
+
+
+def preview_tables():
+    """
+    Returns the tables the preview graph is read from.
+    """
+    tables = [Experiment.__table__]
+    for cls, children in preview_graph.items():
+        tables.append(cls.__table__)
+        tables.extend(c.__table__ for c in children)
+    return tables
+
+
+def related(instance, cls):
+    """
+    Returns the objects of class cls reached from instance through its relationships (e.g.
+    the preparation steps of a recipe). Relationships that are not loaded are read if
+    instance belongs to a session and skipped if it is detached.
+
+    instance:           Mapped object.
+    cls:                Mapped class.
+    """
+    attached = inspect(instance).session is not None
+    objects = []
+    for relationship in _relationships(type(instance), [cls]):
+        if relationship.key not in instance.__dict__ and not attached:
+            continue
+        value = getattr(instance, relationship.key)
+        if value is None:
+            continue
+        for obj in value if relationship.uselist else [value]:
+            if obj not in objects:
+                objects.append(obj)
+    return objects
+
+
+_graph_field_cache = {}
+
+
+def _graph_fields(cls, targets):
+    """
+    Returns the column and hybrid property names of cls, and (key, uselist, children) for
+    its relationships to targets.
+    """
+    key = (cls, targets)
+    if key not in _graph_field_cache:
+        mapper = inspect(cls)
+        fields = [a.key for a in mapper.column_attrs]
+        fields += [
+            k
+            for k, descriptor in mapper.all_orm_descriptors.items()
+            if isinstance(descriptor, hybrid_property)
+        ]
+        relationships = [
+            (r.key, r.uselist, preview_graph.get(r.mapper.class_, []))
+            for r in _relationships(cls, targets)
+        ]
+        _graph_field_cache[key] = (fields, relationships)
+    return _graph_field_cache[key]
+
+
+def graph_dict(instance, targets=None):
+    """
+    Returns the columns and hybrid properties of instance as a dict, with the objects of the
+    preview graph reached from it nested under their relationship names. Only reads
+    relationships loaded by preview_options, so it issues no queries for experiments read with
+    load_previews.
+
+    instance:           Mapped object, usually an Experiment.
+    targets:            (list) Classes to follow from instance. Defaults to the classes of the
+                        preview graph for an Experiment and their children otherwise.
+    """
+    cls = type(instance)
+    if targets is None:
+        targets = list(preview_graph) if cls is Experiment else preview_graph.get(cls, [])
+    fields, relationships = _graph_fields(cls, tuple(targets))
+    d = {key: getattr(instance, key) for key in fields}
+    for key, uselist, children in relationships:
+        value = getattr(instance, key)
+        if uselist:
+            d[key] = [graph_dict(v, children) for v in value]
+        else:
+            d[key] = None if value is None else graph_dict(value, children)
+    return d
+
+
+def load_previews(session, experiment_ids):
+    """
+    Reads the preview graph of experiments. Returns {id: Experiment}; ids that do not exist
+    are left out.
+
+    session:            SQLAlchemy session.
+    experiment_ids:     (list of int) Experiment ids.
+    """
+    experiment_ids = list(experiment_ids)
+    if len(experiment_ids) == 0:
+        return {}
+    experiments = (
+        session.query(Experiment)
+        .options(*preview_options())
+        .filter(Experiment.id.in_(experiment_ids))
+        .all()
+    )
+    return {e.id: e for e in experiments}
+
+
+class PreviewLoader:
+    """
+    LRU cache of detached experiment graphs for the preview tabs. An experiment is read
+    again when any table of the preview graph has changed since it was read.
+
+    bind:               SQLAlchemy engine. Defaults to read_engine(), the replica in
+                        replica mode.
+    max_entries:        (int) Number of experiments kept.
+    """
+
+    def __init__(self, bind=None, max_entries=256):
+        self._bind = bind
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bind(self):
+        if self._bind is not None:
+            return self._bind
+        return read_engine()
+
+    def cached(self, experiment_ids):
+        """
+        Returns the ids among experiment_ids whose graph is in the cache, without checking
+        whether it is current.
+        """
+        with self._lock:
+            return [i for i in experiment_ids if i in self.entries]
+
+    def load(self, experiment_ids):
+        """
+        Returns {id: Experiment} for experiment_ids, reading the ones missing from the cache
+        or out of date in one batch.
+
+        experiment_ids:     (list of int) Experiment ids.
+        """
+        experiment_ids = list(dict.fromkeys(int(i) for i in experiment_ids))
+        versions = current_versions(self.bind(), preview_tables())
+        previews = {}
+        with self._lock:
+            for i in experiment_ids:
+                entry = self.entries.get(i)
+                if entry is not None and entry[1] == versions:
+                    self.entries.move_to_end(i)
+                    previews[i] = entry[0]
+        missing = [i for i in experiment_ids if i not in previews]
+        if len(missing) > 0:
+            session = Session(bind=self.bind())
+            try:
+                loaded = load_previews(session, missing)
+            finally:
+                # Loaded attributes stay readable once the objects are detached.
+                session.close()
+            logger.debug("Loaded previews of %s experiments." % len(loaded))
+            with self._lock:
+                for i, experiment in loaded.items():
+                    self.entries[i] = (experiment, versions)
+                    self.entries.move_to_end(i)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            previews.update(loaded)
+        return previews
+
+    def get(self, experiment_id):
+        """
+        Returns the Experiment with experiment_id and its preview graph, or None.
+        """
+        return self.load([experiment_id]).get(int(experiment_id))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
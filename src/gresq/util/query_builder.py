@@ -0,0 +1,339 @@
+"""
+Builds the SQL statements behind the query tab.
+
+Each primary field will correspond to a SQLAlchemy model. Each of these are models
+(whose schema is in grdb.database.models). Secondary fields are attributes of these
+models and the fields that will be displayed are controlled via the field lists
+below.
+
+Experiment has a many-to-one or one-to-one relationship with Recipe, Substrate, Furnace,
+EnvironmentConditions and Properties, so those tables are joined directly. Preparation
+steps, Raman analyses and authors can have many rows per experiment. Joining them fans
+every experiment out into one row per combination, which used to be collapsed again with
+DISTINCT. results_query instead turns filters on those tables into EXISTS semi-joins and
+reads Raman values from a subquery aggregated per experiment, so exactly one row is
+returned per experiment.
+"""
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Query
+from sqlalchemy.sql import visitors
+from grdb.database.models import (
+    Experiment,
+    Substrate,
+    EnvironmentConditions,
+    Furnace,
+    Recipe,
+    Properties,
+    Author,
+    PreparationStep,
+    RamanFile,
+    RamanAnalysis,
+)
+
+# made changes here - Mitisha
+preparation_fields = [
+    "name",
+    "duration",
+    "furnace_temperature",
+    "furnace_pressure",
+    "sample_location",
+    "helium_flow_rate",
+    "hydrogen_flow_rate",
+    "carbon_source_flow_rate",
+    "argon_flow_rate",
+    "cooling_rate",
+]
+
+properties_fields = [
+    "growth_coverage",
+    "shape",
+    "average_thickness_of_growth",
+    "standard_deviation_of_growth",
+    "number_of_layers",
+    "domain_size",
+]
+
+substrate_fields = [
+    "catalyst",
+    "thickness",
+    "diameter",
+    "length",
+    "surface_area",
+]
+
+furnace_fields = [
+    "tube_diameter",
+    "cross_sectional_area",
+    "tube_length",
+    "length_of_heated_region",
+]
+
+environment_conditions_fields = [
+    "dew_point",
+    "ambient_temperature",
+]
+
+recipe_fields = [
+    "base_pressure",
+    # "carbon_source",
+]
+
+hybrid_recipe_fields = [
+    "maximum_temperature",
+    "maximum_pressure",
+    "average_carbon_flow_rate",
+    "uses_helium",
+    "uses_hydrogen",
+    "uses_argon",
+]
+
+author_fields = ["last_name", "first_name", "institution"]
+
+raman_fields = ["gp_to_g", "d_to_g"]
+
+spectrum_fields = [
+    "percent",
+    "d_peak_shift",
+    "d_peak_amplitude",
+    "d_fwhm",
+    "g_peak_shift",
+    "g_peak_amplitude",
+    "g_fwhm",
+    "g_prime_peak_shift",
+    "g_prime_peak_amplitude",
+    "g_prime_fwhm",
+]
+
+experiment_fields = ["id", "experiment_date", "validated"]
+
+results_fields = experiment_fields + properties_fields + raman_fields
+
+selection_list = {
+    "Furnace": {"fields": furnace_fields, "model": Furnace},
+    "Substrate": {"fields": substrate_fields, "model": Substrate},
+    "Environment Conditions": {"fields": environment_conditions_fields, "model": EnvironmentConditions},
+    "Recipe": {"fields": recipe_fields , "model": Recipe},
+    "Preparation": {"fields": preparation_fields, "model": PreparationStep},
+    "Properties": {"fields": properties_fields, "model": Properties},
+    "Raman Analysis": {"fields": raman_fields, "model": RamanAnalysis},
+    "Provenance Information": {"fields": author_fields, "model": Author},
+}
+
+# Models used to build the header labels of a results table.
+results_models = [
+    Furnace,
+    Experiment,
+    Recipe,
+    PreparationStep,
+    Properties,
+    RamanAnalysis,
+    Substrate,
+    EnvironmentConditions,
+]
+
+
+def _one_to_many():
+    """
+    Relationships that can match several rows per experiment. Each entry maps a label to the
+    tables it covers and the conditions correlating those tables with Experiment.
+    """
+    return {
+        "preparation": {
+            "tables": {PreparationStep.__table__},
+            "entity": PreparationStep.id,
+            "link": [PreparationStep.recipe_id == Experiment.recipe_id],
+        },
+        "raman": {
+            "tables": {RamanAnalysis.__table__, RamanFile.__table__},
+            "entity": RamanAnalysis.id,
+            "link": [
+                RamanAnalysis.raman_file_id == RamanFile.id,
+                RamanFile.experiment_id == Experiment.id,
+            ],
+        },
+        "author": {
+            "tables": {Author.__table__},
+            "entity": Author.id,
+            "link": [Author.id == Experiment.submitted_by],
+        },
+    }
+
+
+def referenced_tables(clause):
+    """
+    Returns the set of tables whose columns appear in a SQLAlchemy clause.
+
+    clause:             SQLAlchemy filter expression.
+    """
+    tables = set()
+    for element in visitors.iterate(clause, {}):
+        table = getattr(element, "table", None)
+        if table is not None and hasattr(element, "key"):
+            tables.add(table)
+    return tables
+
+
+def split_filters(filters):
+    """
+    Sorts filters into those that can be applied directly to the experiment row and those
+    that reference a one-to-many relationship.
+
+    filters:            list of sqlalchemy filters
+
+    Returns (direct, semi) where direct is a list of filters and semi maps a relationship
+    label (see _one_to_many) to the list of filters that reference it.
+    """
+    relationships = _one_to_many()
+    direct = []
+    semi = {}
+    for f in filters:
+        tables = referenced_tables(f)
+        for label, rel in relationships.items():
+            if tables & rel["tables"]:
+                semi.setdefault(label, []).append(f)
+                break
+        else:
+            direct.append(f)
+    return direct, semi
+
+
+def semi_join_filters(filters):
+    """
+    Converts filters on one-to-many relationships into correlated EXISTS clauses. Filters
+    on the same relationship share one EXISTS so they must hold for the same child row,
+    as they did with the joined plan.
+
+    filters:            list of sqlalchemy filters
+    """
+    relationships = _one_to_many()
+    direct, semi = split_filters(filters)
+    clauses = list(direct)
+    for label, fs in semi.items():
+        rel = relationships[label]
+        clauses.append(
+            Query(rel["entity"]).filter(and_(*(rel["link"] + fs))).exists()
+        )
+    return clauses
+
+
+def raman_summary():
+    """
+    Subquery with one row per experiment holding the mean of each Raman field over all
+    analyses of the experiment's Raman files.
+    """
+    return (
+        Query(
+            [RamanFile.experiment_id.label("experiment_id")]
+            + [func.avg(getattr(RamanAnalysis, r)).label(r) for r in raman_fields]
+        )
+        .join(RamanAnalysis, RamanAnalysis.raman_file_id == RamanFile.id)
+        .group_by(RamanFile.experiment_id)
+        .subquery("raman_summary")
+    )
+
+
+def _base_columns():
+    all_experiment_fields = [
+        c.key for c in Experiment.__table__.columns
+    ]  # +['author_last_names']
+    experiment_columns = tuple([getattr(Experiment, e) for e in all_experiment_fields])
+    recipe_columns = tuple(
+        [getattr(Recipe, r) for r in recipe_fields]# + hybrid_recipe_fields]
+    )
+    substrate_columns = tuple(
+        [getattr(Substrate, sb) for sb in substrate_fields]
+    )
+    furnace_columns = tuple(
+        [getattr(Furnace, f) for f in furnace_fields]
+    )
+    environment_conditions_columns = tuple(
+        [getattr(EnvironmentConditions, e) for e in environment_conditions_fields]
+    )
+    properties_columns = tuple(
+        [getattr(Properties, p) for p in properties_fields]
+    )
+    return (
+        furnace_columns,
+        experiment_columns,
+        recipe_columns,
+        properties_columns,
+        substrate_columns,
+        environment_conditions_columns,
+    )
+
+
+def legacy_results_query(filters, session=None):
+    """
+    The original results plan: outer join every related table onto Experiment and
+    collapse the fan-out with DISTINCT. Kept for benchmarking against results_query.
+
+    filters:            list of sqlalchemy filters
+    session:            Optional session to bind the query to.
+    """
+    (
+        furnace_columns,
+        experiment_columns,
+        recipe_columns,
+        properties_columns,
+        substrate_columns,
+        environment_conditions_columns,
+    ) = _base_columns()
+    raman_columns = tuple([getattr(RamanAnalysis, r) for r in raman_fields])
+
+    query_columns = (
+        furnace_columns + experiment_columns + recipe_columns + raman_columns + properties_columns + substrate_columns + environment_conditions_columns
+    )
+    return (
+        Query(query_columns, session=session)
+        #Experiment linked to all by many-to-one
+        .join(Recipe, Recipe.id == Experiment.recipe_id)
+        .join(Substrate, Substrate.id == Experiment.substrate_id)
+        .join(Furnace, Furnace.id == Experiment.furnace_id)
+        # #Linked to experiment by one-to-one
+        .outerjoin(EnvironmentConditions, EnvironmentConditions.id == Experiment.environment_conditions_id)
+        .outerjoin(Properties, Experiment.id == Properties.experiment_id)
+        # #Linked to experiment by one-to-many
+        .outerjoin(RamanFile, Experiment.id == RamanFile.experiment_id)
+        # #Linked to parent by one-to-many
+        .outerjoin(RamanAnalysis, RamanAnalysis.raman_file_id == RamanFile.id)
+        .outerjoin(PreparationStep, PreparationStep.recipe_id == Recipe.id)
+        .outerjoin(Author, Author.id == Experiment.submitted_by) #check: why is it called this? why not author
+        .filter(*filters)
+        .distinct()
+    )
+
+
+def results_query(filters, session=None):
+    """
+    Builds the results query returning exactly one row per experiment. Raman fields are
+    averaged over the experiment's analyses; filters on preparation steps, Raman analyses
+    and authors become EXISTS semi-joins.
+
+    filters:            list of sqlalchemy filters
+    session:            Optional session to bind the query to.
+    """
+    (
+        furnace_columns,
+        experiment_columns,
+        recipe_columns,
+        properties_columns,
+        substrate_columns,
+        environment_conditions_columns,
+    ) = _base_columns()
+    raman = raman_summary()
+    raman_columns = tuple([getattr(raman.c, r) for r in raman_fields])
+
+    query_columns = (
+        furnace_columns + experiment_columns + recipe_columns + raman_columns + properties_columns + substrate_columns + environment_conditions_columns
+    )
+    return (
+        Query(query_columns, session=session)
+        .select_from(Experiment)
+        .join(Recipe, Recipe.id == Experiment.recipe_id)
+        .join(Substrate, Substrate.id == Experiment.substrate_id)
+        .join(Furnace, Furnace.id == Experiment.furnace_id)
+        .outerjoin(EnvironmentConditions, EnvironmentConditions.id == Experiment.environment_conditions_id)
+        .outerjoin(Properties, Experiment.id == Properties.experiment_id)
+        .outerjoin(raman, raman.c.experiment_id == Experiment.id)
+        .filter(*semi_join_filters(filters))
+    )
@@ -0,0 +1,269 @@
+import threading
+import logging
+import traceback
+import pandas as pd
+from PyQt5 import QtCore
+from gresq.util.replica import read_engine
+from gresq.util.result_cache import default_result_cache
+from gresq.util.instrumentation import origin, current_origin
+
+logger = logging.getLogger(__name__)
+
+
+def _dbapi_connection(connection):
+    """
+    Returns the raw DBAPI connection underlying a SQLAlchemy Connection.
+
+    connection:             SQLAlchemy Connection object.
+    """
+    fairy = connection.connection
+    raw = getattr(fairy, "dbapi_connection", None)
+    if raw is None:
+        raw = getattr(fairy, "connection", fairy)
+    return raw
+
+
+def cancel_statement(dbapi_connection):
+    """
+    Asks the database server to abort the statement currently running on a DBAPI connection.
+    Safe to call from a thread other than the one executing the statement.
+    Returns True if a cancel request could be sent.
+
+    dbapi_connection:       Raw DBAPI connection (psycopg2, sqlite3, ...).
+    """
+    # psycopg2 sends a cancel request over a separate socket.
+    if hasattr(dbapi_connection, "cancel"):
+        dbapi_connection.cancel()
+        return True
+    # sqlite3 aborts the running statement at the next VM step.
+    if hasattr(dbapi_connection, "interrupt"):
+        dbapi_connection.interrupt()
+        return True
+    return False
+
+
+def runs_inline(bind):
+    """
+    Returns True if statements on bind have to run on the calling thread: in-memory SQLite
+    databases are private to a single connection.
+
+    bind:                   SQLAlchemy engine.
+    """
+    url = bind.url
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+class QueryTask(QtCore.QRunnable):
+    """
+    Runnable that executes a SQLAlchemy statement on its own connection and reads
+    the result into a DataFrame chunk by chunk.
+
+    engine:                 (QueryEngine) Engine that owns the task. Signals are emitted through it.
+    generation:             (int) Generation number of the filter set that produced the statement.
+    statement:              SQLAlchemy selectable to execute.
+    chunksize:              (int) Number of rows fetched between progress updates.
+    origin:                 (str) Origin label of the statement (see gresq.util.instrumentation).
+    """
+
+    def __init__(self, engine, generation, statement, chunksize=500, origin=None):
+        super(QueryTask, self).__init__()
+        self.setAutoDelete(True)
+        self.engine = engine
+        self.generation = generation
+        self.statement = statement
+        self.chunksize = chunksize
+        self.origin = origin
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._dbapi_connection = None
+
+    def isCancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Flags the task as cancelled and aborts its statement on the server if it is running.
+        """
+        self._cancelled.set()
+        with self._lock:
+            if self._dbapi_connection is not None:
+                try:
+                    cancel_statement(self._dbapi_connection)
+                except Exception:
+                    logger.debug(traceback.format_exc())
+
+    def run(self):
+        with origin(self.origin):
+            self._run()
+
+    def _run(self):
+        if self.isCancelled():
+            self.engine.taskCancelled(self)
+            return
+
+        self.engine.started.emit(self.generation)
+        cache = self.engine.cache
+        chunks = []
+        nrows = 0
+        try:
+            if cache is not None:
+                df = cache.get(self.statement, self.engine.bind())
+                if df is not None:
+                    self.engine.progress.emit(self.generation, df.shape[0])
+                    self.engine.taskFinished(self, df)
+                    return
+                versions = cache.snapshot(self.statement, self.engine.bind())
+            with self.engine.bind().connect() as connection:
+                with self._lock:
+                    self._dbapi_connection = _dbapi_connection(connection)
+                try:
+                    for chunk in pd.read_sql_query(
+                        self.statement, connection, chunksize=self.chunksize
+                    ):
+                        if self.isCancelled():
+                            break
+                        chunks.append(chunk)
+                        nrows += chunk.shape[0]
+                        self.engine.progress.emit(self.generation, nrows)
+                finally:
+                    with self._lock:
+                        self._dbapi_connection = None
+        except Exception as e:
+            if self.isCancelled():
+                self.engine.taskCancelled(self)
+            else:
+                logger.exception(traceback.format_exc())
+                self.engine.taskFailed(self, str(e))
+            return
+
+        if self.isCancelled():
+            self.engine.taskCancelled(self)
+            return
+
+        if len(chunks) > 0:
+            df = pd.concat(chunks, ignore_index=True)
+        else:
+            df = pd.DataFrame()
+        if cache is not None:
+            cache.put(self.statement, self.engine.bind(), df, versions)
+        self.engine.taskFinished(self, df)
+
+
+class QueryEngine(QtCore.QObject):
+    """
+    Runs SQL queries off the GUI thread. Each submitted statement is stamped with an
+    increasing generation number. Submitting a new statement cancels the running one
+    on the server and discards anything still queued, so only the newest filter set is
+    executed. Results from superseded generations are never emitted.
+
+    bind:                   SQLAlchemy engine used to open connections. Defaults to
+                            read_engine(), the replica in replica mode.
+    max_thread_count:       (int) Number of worker threads.
+    chunksize:              (int) Number of rows fetched between progress updates.
+    cache:                  (ResultCache) Cache of results, checked before running a statement.
+                            Defaults to default_result_cache(); False disables caching.
+
+    Signals:
+        started(generation)
+        progress(generation, rows_fetched)
+        finished(generation, DataFrame)
+        failed(generation, error_text)
+        cancelled(generation)
+    """
+
+    started = QtCore.pyqtSignal(int)
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal(int, object)
+    failed = QtCore.pyqtSignal(int, str)
+    cancelled = QtCore.pyqtSignal(int)
+
+    def __init__(self, bind=None, max_thread_count=2, chunksize=500, cache=None, parent=None):
+        super(QueryEngine, self).__init__(parent=parent)
+        self._bind = bind
+        if cache is None:
+            cache = default_result_cache()
+        self.cache = cache if cache is not False else None
+        self.chunksize = chunksize
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_thread_count)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._tasks = []
+
+    def bind(self):
+        if self._bind is not None:
+            return self._bind
+        return read_engine()
+
+    def generation(self):
+        return self._generation
+
+    def isCurrent(self, generation):
+        return generation == self._generation
+
+    def isRunning(self):
+        with self._lock:
+            return len(self._tasks) > 0
+
+    def submit(self, statement):
+        """
+        Cancels outstanding queries and schedules statement. Returns the new generation number.
+
+        statement:          SQLAlchemy selectable to execute.
+        """
+        self.cancel()
+        self._generation += 1
+        task = QueryTask(
+            self,
+            self._generation,
+            statement,
+            chunksize=self.chunksize,
+            origin=current_origin(),
+        )
+        with self._lock:
+            self._tasks.append(task)
+        if runs_inline(self.bind()):
+            task.setAutoDelete(False)
+            task.run()
+        else:
+            self.pool.start(task)
+        return self._generation
+
+    def cancel(self):
+        """
+        Cancels every queued or running query and bumps the generation so any result
+        already in flight is dropped.
+        """
+        with self._lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+            try:
+                taken = self.pool.tryTake(task)
+            except RuntimeError:
+                # The pool has already run and deleted the task.
+                taken = False
+            if taken:
+                self._release(task)
+        self._generation += 1
+
+    def _release(self, task):
+        with self._lock:
+            if task in self._tasks:
+                self._tasks.remove(task)
+
+    def taskFinished(self, task, df):
+        self._release(task)
+        if self.isCurrent(task.generation):
+            self.finished.emit(task.generation, df)
+        else:
+            logger.debug("Dropping stale query result (generation %s)." % task.generation)
+
+    def taskFailed(self, task, error_text):
+        self._release(task)
+        if self.isCurrent(task.generation):
+            self.failed.emit(task.generation, error_text)
+
+    def taskCancelled(self, task):
+        self._release(task)
+        self.cancelled.emit(task.generation)
@@ -0,0 +1,166 @@
+"""
+In-memory refinement of query results.
+
+Adding a filter to a query can only remove rows from its results. When the extra filters
+only compare fields that are columns of the results already read, they are applied to that
+DataFrame as boolean masks instead of running the query again. Filters on fields that are
+not columns of the results (preparation steps, individual Raman analyses, authors) still go
+to the database.
+"""
+import operator
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy.sql import operators as sql_operators
+from sqlalchemy.sql.elements import (
+    BinaryExpression,
+    BooleanClauseList,
+    BindParameter,
+    Null,
+    True_,
+    False_,
+)
+from gresq.util.summary import summary_column_map
+
+logger = logging.getLogger(__name__)
+
+comparisons = {
+    sql_operators.eq: operator.eq,
+    sql_operators.ne: operator.ne,
+    sql_operators.lt: operator.lt,
+    sql_operators.gt: operator.gt,
+    sql_operators.le: operator.le,
+    sql_operators.ge: operator.ge,
+}
+
+_is = getattr(sql_operators, "is_")
+_is_not = getattr(sql_operators, "is_not", None) or getattr(sql_operators, "isnot")
+_not_in = getattr(sql_operators, "not_in_op", None) or getattr(sql_operators, "notin_op")
+
+
+def _literal(element):
+    """
+    Returns the Python value of a literal clause element, or raises ValueError.
+    """
+    if isinstance(element, BindParameter):
+        return element.effective_value
+    if isinstance(element, Null):
+        return None
+    if isinstance(element, True_):
+        return True
+    if isinstance(element, False_):
+        return False
+    raise ValueError("Not a literal: %s" % element)
+
+
+def _comparable(series, value):
+    """
+    Converts value so it compares with series the way the database compares it.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype) and value is not None:
+        return pd.Timestamp(value)
+    return value
+
+
+def filter_mask(df, clause, columns=None):
+    """
+    Evaluates a filter on a DataFrame of query results. Returns a boolean array selecting the
+    rows for which the filter is true (SQL semantics: comparisons with NULL are not true), or
+    None if the filter cannot be evaluated from the columns of df.
+
+    df:                 (pd.DataFrame) Query results.
+    clause:             SQLAlchemy filter.
+    columns:            Dict mapping model columns to result column names. Defaults to the
+                        columns materialized in experiment_summary.
+    """
+    if columns is None:
+        columns = {c: s.key for c, s in summary_column_map().items()}
+
+    if isinstance(clause, BooleanClauseList):
+        if clause.operator not in (sql_operators.and_, sql_operators.or_):
+            return None
+        masks = [filter_mask(df, c, columns) for c in clause.clauses]
+        if any(m is None for m in masks):
+            return None
+        combine = np.logical_and if clause.operator is sql_operators.and_ else np.logical_or
+        return combine.reduce(masks) if len(masks) > 0 else np.ones(len(df), dtype=bool)
+
+    if not isinstance(clause, BinaryExpression):
+        return None
+    name = columns.get(clause.left)
+    if name is None or name not in df.columns:
+        return None
+    series = df[name]
+    try:
+        if clause.operator in comparisons:
+            value = _comparable(series, _literal(clause.right))
+            if value is None:
+                return np.zeros(len(df), dtype=bool)
+            present = series.notna().values
+            mask = np.zeros(len(df), dtype=bool)
+            mask[present] = np.asarray(
+                comparisons[clause.operator](series[present], value), dtype=bool
+            )
+            return mask
+        if clause.operator in (_is, _is_not):
+            value = _literal(clause.right)
+            if value is None:
+                mask = series.isna()
+            else:
+                mask = series.notna() & (series == value)
+            if clause.operator is _is_not:
+                mask = ~mask
+            return np.asarray(mask, dtype=bool)
+        if clause.operator in (sql_operators.in_op, _not_in):
+            values = [_comparable(series, v) for v in _literal(clause.right)]
+            mask = series.isin(values)
+            if clause.operator is _not_in:
+                mask = ~mask
+            return np.asarray(mask & series.notna(), dtype=bool)
+    except (ValueError, TypeError) as e:
+        logger.debug("Cannot evaluate %s locally: %s" % (clause, e))
+        return None
+    return None
+
+
+def narrowing_filters(previous_filters, filters):
+    """
+    Returns the filters in filters that are not in previous_filters, or None if filters
+    does not contain every filter of previous_filters (so it may select rows the previous
+    query did not).
+
+    previous_filters:   list of sqlalchemy filters of the query that produced the results.
+    filters:            list of sqlalchemy filters of the new query.
+    """
+    remaining = list(filters)
+    for f in previous_filters:
+        for i, g in enumerate(remaining):
+            if g is f or g.compare(f):
+                del remaining[i]
+                break
+        else:
+            return None
+    return remaining
+
+
+def refine_results(df, previous_filters, filters, columns=None):
+    """
+    Returns the results of filters computed from df, the results of previous_filters, or None
+    if the new query does not only narrow the previous one or one of the added filters cannot
+    be evaluated in memory.
+
+    df:                 (pd.DataFrame) Results of previous_filters.
+    previous_filters:   list of sqlalchemy filters.
+    filters:            list of sqlalchemy filters.
+    columns:            Dict mapping model columns to result column names (see filter_mask).
+    """
+    added = narrowing_filters(previous_filters, filters)
+    if added is None:
+        return None
+    mask = np.ones(len(df), dtype=bool)
+    for f in added:
+        m = filter_mask(df, f, columns)
+        if m is None:
+            return None
+        mask &= m
+    return df[mask].reset_index(drop=True)
@@ -0,0 +1,592 @@
+"""
+Local SQLite replica of the database.
+
+In replica mode the query tab (results, previews, dropdown values, prefetching) reads from a
+SQLite file on local disk instead of the remote database, while everything that writes still
+goes to the primary through dal.session_scope. The replica is kept in GRESQ_CACHE_DIR
+(~/.cache/gresq by default), so a new session starts with the data of the last one and
+brings it up to date in the background.
+
+Each sync compares the table_versions counters of the primary with the ones recorded when
+every table was last copied, and only tables that changed are read again:
+
+    - tables with a change column (see change_columns) pull the rows changed since the
+      high-water mark, the largest value of that column in the replica;
+    - tables with an integer primary key that only had rows inserted (their counter and
+      their "<table>:inserts" counter moved together) pull the rows above the largest id in
+      the replica;
+    - other tables are copied again, in one replica transaction, so readers never see a
+      half-copied table;
+    - without table_versions, tables with an integer primary key pull the rows above the
+      largest id in the replica, and tables this session changed other than by inserts (per
+      the local counters kept by bump_table_versions) are copied again. Changes other
+      sessions make to existing rows are then only picked up by a full sync, and a warning
+      says so.
+
+Rows deleted on the primary are removed from the replica when their table is synced. The
+table_versions counters themselves are copied last, so caches stamped with replica versions
+(result cache, vocabulary, previews) are invalidated when the replica catches up.
+
+Sync from the command line with:
+
+    python -m gresq.util.replica --db_mode production [--full]
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from PyQt5 import QtCore
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    String,
+    Integer,
+    Float,
+    Text,
+    create_engine,
+    event,
+    func,
+)
+from sqlalchemy.orm import Query, Session
+from grdb.database import Base, dal
+from gresq.util.versions import (
+    table_versions,
+    versions_available,
+    current_versions,
+    inserts_name,
+)
+from gresq.util.engines import reader_engine
+from gresq.util.summary import experiment_summary, summary_available
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+replica_state = Table(
+    "replica_state",
+    metadata,
+    Column("name", String(64), primary_key=True),
+    Column("database", String(64)),
+    Column("marker", Text),
+    Column("rows", Integer),
+    Column("synced_at", Float),
+)
+
+# Columns holding the time (or revision) of the last change of a row, in order of preference.
+change_columns = ("last_modified", "updated_at", "modified_at")
+
+# Identifies this process in markers made from its local counters, which start over in
+# every process.
+_process = uuid.uuid4().hex
+
+
+def _database_key(bind):
+    return hashlib.sha256(str(bind.url).encode()).hexdigest()[:16]
+
+
+def _primary_key(table):
+    columns = list(table.primary_key.columns)
+    return columns[0] if len(columns) == 1 else None
+
+
+def _change_column(table):
+    for name in change_columns:
+        if name in table.c:
+            return table.c[name]
+    return None
+
+
+def _is_integer(column):
+    try:
+        return column.type.python_type is int
+    except NotImplementedError:
+        return False
+
+
+class Replica:
+    """
+    SQLite copy of the read-only tables of a database (see the module docstring).
+
+    path:               (str) SQLite file of the replica.
+    primary:            SQLAlchemy engine the replica is copied from. Defaults to
+                        reader_engine().
+    batch_size:         (int) Number of rows read from the primary per round trip.
+    """
+
+    def __init__(self, path, primary=None, batch_size=5000):
+        self.path = path
+        self._primary = primary
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._ready = False
+        self._warned = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.engine = create_engine(
+            "sqlite:///%s" % path, connect_args={"check_same_thread": False}
+        )
+        event.listen(self.engine, "connect", self._configure)
+        metadata.create_all(bind=self.engine, checkfirst=True)
+
+    @staticmethod
+    def _configure(dbapi_connection, connection_record):
+        # WAL lets the dashboard keep reading while a sync writes.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    def primary(self):
+        if self._primary is not None:
+            return self._primary
+        return reader_engine()
+
+    def tables(self):
+        """
+        Returns the tables copied to the replica, except table_versions.
+        """
+        # Foreign keys are not enforced by SQLite, so the order does not matter.
+        tables = [Base.metadata.tables[n] for n in sorted(Base.metadata.tables)]
+        if summary_available(self.primary()):
+            tables.append(experiment_summary)
+        return tables
+
+    def state(self):
+        """
+        Returns {table name: {"marker", "rows", "synced_at"}} for the tables copied from
+        the current primary.
+        """
+        database = _database_key(self.primary())
+        with self.engine.connect() as connection:
+            rows = connection.execute(Query([replica_state]).statement).fetchall()
+        return {
+            r.name: {"marker": r.marker, "rows": r.rows, "synced_at": r.synced_at}
+            for r in rows
+            if r.database == database
+        }
+
+    def isReady(self):
+        """
+        Returns True if every table has been copied from the current primary at least once.
+        """
+        if not self._ready:
+            state = self.state()
+            self._ready = all(t.name in state for t in self.tables())
+        return self._ready
+
+    def _primaryVersions(self, connection):
+        if not versions_available(self.primary()):
+            return None
+        q = Query([table_versions.c.name, table_versions.c.version])
+        return dict((n, v) for n, v in connection.execute(q.statement))
+
+    @staticmethod
+    def _counters(table, versions):
+        if table.name in Base.metadata.tables or table.name in versions:
+            return [
+                versions.get(table.name, 0),
+                versions.get("*", 0),
+                versions.get(inserts_name(table), 0),
+            ]
+        # Derived tables (experiment_summary) change with any table.
+        return sorted([list(item) for item in versions.items()])
+
+    @staticmethod
+    def _onlyInserts(before, after):
+        """
+        Returns True if the counters of a table went from before to after by inserts alone.
+        """
+        if len(before) != 3 or len(after) != 3 or not isinstance(before[0], int):
+            return False
+        return before[1] == after[1] and before[0] - before[2] == after[0] - after[2]
+
+    @staticmethod
+    def _recorded(previous):
+        try:
+            return json.loads(previous["marker"] or "null")
+        except ValueError:
+            return None
+
+    def _marker(self, table, versions, local):
+        """
+        Returns the marker of table recorded in replica_state: its table_versions counters,
+        or without table_versions, the local counters of this process.
+        """
+        if versions is not None:
+            return json.dumps(self._counters(table, versions))
+        return json.dumps({"process": _process, "local": self._counters(table, local)})
+
+    def _changedHere(self, table, previous, local):
+        """
+        Returns True if this process changed rows of table other than by inserts since the
+        sync recorded in previous, according to its local counters.
+        """
+        recorded = self._recorded(previous)
+        if isinstance(recorded, dict) and recorded.get("process") == _process:
+            counters = recorded.get("local")
+        else:
+            # Synced by an earlier session: only the changes made by this one are known.
+            counters = self._counters(table, {})
+        current = self._counters(table, local)
+        return counters != current and not self._onlyInserts(counters, current)
+
+    def _insertedOnly(self, table, previous, versions):
+        """
+        Returns True if the table_versions counters show that rows were only inserted into
+        table since the sync recorded in previous.
+        """
+        recorded = self._recorded(previous)
+        if not isinstance(recorded, list):
+            return False
+        return self._onlyInserts(recorded, self._counters(table, versions))
+
+    def _read(self, source, table, statement):
+        result = source.execution_options(stream_results=True).execute(statement)
+        names = [c.key for c in table.columns]
+        while True:
+            rows = result.fetchmany(self.batch_size)
+            if len(rows) == 0:
+                break
+            yield [dict(zip(names, r)) for r in rows]
+
+    def _copy(self, source, target, table):
+        target.execute(table.delete())
+        nrows = 0
+        for rows in self._read(source, table, table.select()):
+            target.execute(table.insert(), rows)
+            nrows += len(rows)
+        return nrows
+
+    def _pullSince(self, source, target, table, column, inclusive):
+        pk = _primary_key(table)
+        high_water = target.execute(Query([func.max(table.c[column.key])]).statement).scalar()
+        statement = table.select()
+        if high_water is not None:
+            statement = statement.where(column >= high_water if inclusive else column > high_water)
+        nrows = 0
+        for rows in self._read(source, table, statement):
+            ids = [r[pk.key] for r in rows]
+            target.execute(table.delete().where(table.c[pk.key].in_(ids)))
+            target.execute(table.insert(), rows)
+            nrows += len(rows)
+        return nrows
+
+    def _removeDeleted(self, source, target, table):
+        pk = _primary_key(table)
+        current = set(i for (i,) in source.execute(Query([pk]).statement))
+        stale = [
+            i
+            for (i,) in target.execute(Query([table.c[pk.key]]).statement)
+            if i not in current
+        ]
+        for start in range(0, len(stale), 500):
+            target.execute(table.delete().where(table.c[pk.key].in_(stale[start : start + 500])))
+        return len(stale)
+
+    def _syncTable(self, source, target, table, versions, local, state, full):
+        """
+        Brings one table up to date in the target transaction. Returns the number of rows
+        read from the primary, or None if the table had not changed.
+        """
+        marker = self._marker(table, versions, local)
+        previous = None if full else state.get(table.name)
+        if versions is not None and previous is not None and previous["marker"] == marker:
+            return None
+
+        pk = _primary_key(table)
+        change = _change_column(table)
+        if previous is None or pk is None:
+            nrows = self._copy(source, target, table)
+        elif versions is None and self._changedHere(table, previous, local):
+            # Existing rows may have been updated, which no high-water mark shows.
+            nrows = self._copy(source, target, table)
+        elif change is not None:
+            nrows = self._pullSince(source, target, table, change, inclusive=True)
+            self._removeDeleted(source, target, table)
+        elif _is_integer(pk) and (
+            versions is None or self._insertedOnly(table, previous, versions)
+        ):
+            nrows = self._pullSince(source, target, table, pk, inclusive=False)
+            self._removeDeleted(source, target, table)
+        else:
+            nrows = self._copy(source, target, table)
+
+        total = target.execute(Query([func.count()]).select_from(table).statement).scalar()
+        target.execute(replica_state.delete().where(replica_state.c.name == table.name))
+        target.execute(
+            replica_state.insert(),
+            [
+                {
+                    "name": table.name,
+                    "database": _database_key(self.primary()),
+                    "marker": marker,
+                    "rows": total,
+                    "synced_at": time.time(),
+                }
+            ],
+        )
+        return nrows
+
+    def _createTables(self, tables):
+        created = []
+        for table in tables:
+            try:
+                table.create(bind=self.engine, checkfirst=True)
+                created.append(table)
+            except Exception:
+                logger.warning("Table %s cannot be replicated:\n%s", table.name, traceback.format_exc())
+        return created
+
+    def sync(self, full=False):
+        """
+        Copies the changes of the primary since the last sync. Returns {table name: rows read}
+        for the tables that changed.
+
+        full:               (bool) Copy every table again.
+        """
+        with self._lock:
+            tables = self._createTables(self.tables())
+            copied = {}
+            state = self.state()
+            with self.primary().connect() as source:
+                versions = self._primaryVersions(source)
+                local = None
+                if versions is None:
+                    local = {n: v[1] for n, v in current_versions(self.primary()).items()}
+                    if not self._warned:
+                        self._warned = True
+                        logger.warning(
+                            "The primary database has no table_versions table: the replica "
+                            "only sees new rows and the changes made by this session. Create "
+                            "it with python -m gresq.util.versions --create."
+                        )
+                for table in tables:
+                    started = time.perf_counter()
+                    with self.engine.begin() as target:
+                        nrows = self._syncTable(
+                            source, target, table, versions, local, state, full
+                        )
+                    if nrows is not None:
+                        copied[table.name] = nrows
+                        logger.info(
+                            "Replicated %s rows of %s in %.2f s",
+                            nrows,
+                            table.name,
+                            time.perf_counter() - started,
+                        )
+            if versions is not None:
+                # The counters read before copying, so the replica never claims to be newer
+                # than its rows.
+                table_versions.create(bind=self.engine, checkfirst=True)
+                with self.engine.begin() as target:
+                    target.execute(table_versions.delete())
+                    target.execute(
+                        table_versions.insert(),
+                        [{"name": n, "version": v} for n, v in versions.items()],
+                    )
+                versions_available(self.engine, refresh=True)
+            summary_available(self.engine, refresh=True)
+            return copied
+
+
+_active_replica = None
+
+
+def set_active_replica(replica):
+    """
+    Makes the query tab read from replica once it is ready. None reads from the primary.
+    """
+    global _active_replica
+    _active_replica = replica
+
+
+def active_replica():
+    return _active_replica
+
+
+def read_engine():
+    """
+    Returns the engine used for reads: the active replica if it has been synced, otherwise
+    the reader of gresq.util.engines.
+    """
+    replica = _active_replica
+    if replica is not None and replica.isReady():
+        return replica.engine
+    return reader_engine()
+
+
+def read_session():
+    """
+    Returns a session bound to read_engine(). Only use it to read.
+    """
+    return Session(bind=read_engine())
+
+
+@contextmanager
+def read_session_scope():
+    """
+    Provide a read-only session bound to read_engine(), closed on exit.
+    """
+    session = read_session()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+class _SyncTask(QtCore.QRunnable):
+    def __init__(self, sync, full):
+        super(_SyncTask, self).__init__()
+        self.sync = sync
+        self.full = full
+
+    def run(self):
+        try:
+            copied = self.sync.replica.sync(full=self.full)
+        except Exception:
+            logger.warning(traceback.format_exc())
+            self.sync._done.emit(None, traceback.format_exc())
+            return
+        self.sync._done.emit(copied, "")
+
+
+class ReplicaSync(QtCore.QObject):
+    """
+    Syncs a Replica in a background thread: when started, every interval seconds, and after
+    every commit on the primary, so writes made in this session reach the replica quickly.
+
+    replica:            (Replica) Replica to keep in sync.
+    interval:           (int) Seconds between syncs. 0 disables periodic syncs.
+    writer:             SQLAlchemy engine whose commits trigger a sync. Defaults to dal.engine.
+
+    Signals:
+        synced(dict)    Emitted after a sync with the rows read per changed table.
+        failed(str)     Emitted when a sync failed.
+    """
+
+    synced = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+    _requested = QtCore.pyqtSignal()
+    _done = QtCore.pyqtSignal(object, str)
+
+    def __init__(self, replica, interval=300, writer=None, parent=None):
+        super(ReplicaSync, self).__init__(parent=parent)
+        self.replica = replica
+        self.writer = writer if writer is not None else dal.engine
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.running = False
+        self.pending = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.start)
+        if interval > 0:
+            self.timer.start(interval * 1000)
+        self._requested.connect(self.start)
+        self._done.connect(self._finished)
+        event.listen(self.writer, "commit", self._onCommit)
+
+    def _onCommit(self, connection):
+        # Called from whichever thread committed.
+        self._requested.emit()
+
+    def start(self, full=False):
+        """
+        Starts a sync, or another one after the running sync finishes.
+        """
+        if self.running:
+            self.pending = True
+            return
+        self.running = True
+        self.pending = False
+        self.pool.start(_SyncTask(self, full))
+
+    def _finished(self, copied, error):
+        self.running = False
+        if copied is None:
+            self.failed.emit(error)
+        else:
+            self.synced.emit(copied)
+        if self.pending:
+            self.start()
+
+    def stop(self):
+        self.timer.stop()
+        if event.contains(self.writer, "commit", self._onCommit):
+            event.remove(self.writer, "commit", self._onCommit)
+        self.pool.waitForDone()
+
+
+def replica_path(db_conf):
+    """
+    Returns the replica file of a database Config.
+    """
+    if db_conf.REPLICA_PATH:
+        return db_conf.REPLICA_PATH
+    directory = os.environ.get(
+        "GRESQ_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gresq")
+    )
+    return os.path.join(directory, "replica_%s.db" % db_conf.PREFIX.lower())
+
+
+def main():
+    from gresq.config import Config
+
+    parser = argparse.ArgumentParser(description="Sync the local SQLite replica.")
+    parser.add_argument(
+        "--db_mode",
+        default="development",
+        type=str,
+        help="Database mode: development, testing, or production",
+    )
+    parser.add_argument(
+        "--db_config_path",
+        default="",
+        type=str,
+        help="Path to database config secrets.",
+    )
+    parser.add_argument(
+        "--db_suffix",
+        default="_READ",
+        type=str,
+        help="Suffix of the database user, e.g. _READ.",
+    )
+    parser.add_argument(
+        "--path", default="", type=str, help="Replica file. Defaults to the configured one."
+    )
+    parser.add_argument(
+        "--full", action="store_true", default=False, help="Copy every table again."
+    )
+    kwargs = vars(parser.parse_args())
+    logging.basicConfig(level=logging.INFO)
+
+    prefixes = {
+        "development": "DEV_DATABASE",
+        "testing": "TEST_DATABASE",
+        "production": "PROD_DATABASE",
+    }
+    db_conf = Config(
+        prefix=prefixes[kwargs["db_mode"].lower()],
+        suffix=kwargs["db_suffix"],
+        debug=kwargs["db_mode"].lower() != "production",
+        dbconfig_file=kwargs["db_config_path"],
+    )
+    dal.init_db(db_conf, privileges={"read": True, "write": False, "validate": False})
+
+    replica = Replica(kwargs["path"] or replica_path(db_conf))
+    started = time.perf_counter()
+    copied = replica.sync(full=kwargs["full"])
+    print("Synced %s in %.2f s" % (replica.path, time.perf_counter() - started))
+    for name, info in sorted(replica.state().items()):
+        print("%-32s %8s rows%s" % (name, info["rows"], "  *" if name in copied else ""))
+
+
+if __name__ == "__main__":
+    main()
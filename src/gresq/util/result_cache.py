@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.expression import TableClause
+from gresq.util.versions import current_versions, versions_available
+
+
+def statement_tables(statement):
+    """
+    Returns the names of the tables a statement reads, including those in subqueries.
+
+    statement:          SQLAlchemy selectable.
+    """
+    return sorted(
+        set(e.name for e in visitors.iterate(statement, {}) if isinstance(e, TableClause))
+    )
+
+
+def statement_key(statement, bind):
+    """
+    Returns a hashable key made of the database URL, the SQL of statement compiled for the
+    database and its bound parameters. In-memory SQLite databases are told apart by engine.
+
+    statement:          SQLAlchemy selectable.
+    bind:               SQLAlchemy engine or connection.
+    """
+    engine = bind.engine if hasattr(bind, "engine") else bind
+    compiled = statement.compile(dialect=engine.dialect)
+    params = tuple(sorted((k, repr(v)) for k, v in compiled.params.items()))
+    url = str(engine.url)
+    if engine.url.get_backend_name() == "sqlite" and engine.url.database in (None, "", ":memory:"):
+        url += "#%s" % id(engine)
+    return (url, str(compiled), params)
+
+
+class ResultCache:
+    """
+    LRU cache of query results (DataFrames) keyed by the compiled SQL and bound parameters of
+    the statement. Each entry remembers the table versions (see gresq.util.versions) of the
+    tables the statement reads at the time it was run; an entry is only served while those
+    versions are unchanged, so results are read again after any submission, admin action or
+    bulk load touching them. Cached DataFrames are shared and must not be modified in place.
+
+    Without the table_versions table the versions only count the writes of this process, so
+    changes made by other users would go unnoticed; nothing is cached then.
+
+    max_bytes:          (int) Memory budget for cached DataFrames.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self, statement, bind):
+        """
+        Returns the current versions of the tables statement reads. Take the snapshot before
+        running the statement and pass it to put.
+        """
+        return current_versions(bind, statement_tables(statement))
+
+    def get(self, statement, bind):
+        """
+        Returns the cached results of statement, or None if they are missing or out of date.
+
+        statement:          SQLAlchemy selectable.
+        bind:               SQLAlchemy engine or connection.
+        """
+        if not versions_available(bind):
+            with self._lock:
+                self.misses += 1
+            return None
+        key = statement_key(statement, bind)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[1] == self.snapshot(statement, bind):
+            with self._lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                self.hits += 1
+            return entry[0]
+        with self._lock:
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+        return None
+
+    def put(self, statement, bind, df, versions):
+        """
+        Stores the results of statement. Results larger than the whole budget are not stored.
+
+        statement:          SQLAlchemy selectable.
+        bind:               SQLAlchemy engine or connection.
+        df:                 (pd.DataFrame) Results.
+        versions:           Snapshot taken with snapshot() before the statement was run.
+        """
+        if not versions_available(bind):
+            return
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        key = statement_key(statement, bind)
+        with self._lock:
+            self._remove(key)
+            self.entries[key] = (df, versions, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def read(self, statement, connection):
+        """
+        Returns the results of statement, from the cache if they are current.
+
+        statement:          SQLAlchemy selectable.
+        connection:         SQLAlchemy connection used if the statement has to be run.
+        """
+        df = self.get(statement, connection)
+        if df is None:
+            versions = self.snapshot(statement, connection)
+            df = pd.read_sql_query(statement, connection)
+            self.put(statement, connection, df, versions)
+        return df
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_result_cache():
+    """
+    Returns the ResultCache shared by the query tabs. Its budget (256 MiB by default) can be
+    set in bytes with the GRESQ_RESULT_CACHE_BYTES environment variable; 0 disables caching.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache(
+                max_bytes=int(os.environ.get("GRESQ_RESULT_CACHE_BYTES", 256 * 1024 ** 2))
+            )
+        return _default_cache
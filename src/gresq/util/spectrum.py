@@ -0,0 +1,214 @@
+"""
+Raman spectrum I/O.
+
+Spectra arrive as two-column text (wavenumber, intensity) separated by tabs, commas or
+spaces, with or without a header line (see data/test_raman.csv and the .txt files in
+data/SEM_Raman_Data). parse_spectrum reads them with a single vectorized conversion
+instead of a DataFrame round trip. Parsed spectra are kept as .npy files of float32
+pairs that can be memory-mapped, and load_spectra stacks many spectra into one 2-D
+array for plotting and statistics.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_DELIMITERS = bytes.maketrans(b"\t,;\r", b"    ")
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_spectrum(source):
+    """
+    Parses a two-column spectrum and returns an (n, 2) float64 array of
+    (wavenumber, intensity) rows. Leading header lines are skipped; columns after the
+    second are ignored and malformed rows are dropped.
+
+    source:             Bytes, str contents, a path or a binary file object.
+    """
+    if isinstance(source, str) and "\n" not in source and os.path.exists(source):
+        with open(source, "rb") as f:
+            data = f.read()
+    elif isinstance(source, str):
+        data = source.encode("utf-8")
+    elif hasattr(source, "read"):
+        data = source.read()
+    else:
+        data = bytes(source)
+
+    lines = data.splitlines()
+    start = 0
+    while start < len(lines):
+        tokens = _tokens(lines[start])
+        if len(tokens) >= 2 and _is_number(tokens[0]) and _is_number(tokens[1]):
+            break
+        start += 1
+    if start == len(lines):
+        raise ValueError("No numeric spectrum data found.")
+    ncols = len(_tokens(lines[start]))
+
+    rows = b"\n".join(lines[start:]).translate(_DELIMITERS).splitlines()
+    # The flat tokens can only be reshaped when every row has the same width.
+    if any(len(row.split()) != ncols for row in rows if row.strip()):
+        return _parse_rows(lines[start:])
+    try:
+        values = np.array(b" ".join(rows).split(), dtype=np.float64)
+        return values.reshape(-1, ncols)[:, :2].copy()
+    except ValueError:
+        return _parse_rows(lines[start:])
+
+
+def _tokens(line):
+    return line.translate(_DELIMITERS).split()
+
+
+def _parse_rows(lines):
+    """
+    Row-by-row fallback for files with ragged or non-numeric rows.
+    """
+    rows = []
+    for line in lines:
+        tokens = _tokens(line)
+        if len(tokens) < 2:
+            continue
+        try:
+            rows.append((float(tokens[0]), float(tokens[1])))
+        except ValueError:
+            continue
+    return np.array(rows, dtype=np.float64).reshape(-1, 2)
+
+
+def save_spectrum(path, spectrum):
+    """
+    Writes a spectrum as an (n, 2) float32 .npy file. The file is written next to path and
+    renamed into place.
+    """
+    spectrum = np.ascontiguousarray(spectrum, dtype=np.float32)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, spectrum)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_spectrum(path, mmap=True):
+    """
+    Reads a spectrum written by save_spectrum. With mmap the array is memory-mapped
+    read-only instead of read into memory.
+    """
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+class SpectrumStore:
+    """
+    Directory of parsed spectra in the binary format, keyed by the SHA-256 of the source
+    bytes. A spectrum is parsed the first time its contents are seen and memory-mapped
+    afterwards.
+
+    directory:          (str) Directory for .npy files. Created if missing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def fromBytes(self, data):
+        """
+        Returns the (n, 2) float32 spectrum contained in data.
+
+        data:               (bytes) Spectrum file contents, e.g. a Raman file download.
+        """
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+        if os.path.exists(path):
+            try:
+                return load_spectrum(path)
+            except (OSError, ValueError):
+                logger.warning("Discarding unreadable spectrum %s" % path)
+        spectrum = parse_spectrum(data)
+        save_spectrum(path, spectrum)
+        return load_spectrum(path)
+
+    def fromFile(self, path):
+        with open(path, "rb") as f:
+            return self.fromBytes(f.read())
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_spectrum_store():
+    """
+    Returns the SpectrumStore shared by the dashboard, under GRESQ_CACHE_DIR
+    (~/.cache/gresq by default) in spectra/.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            directory = os.environ.get(
+                "GRESQ_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gresq")
+            )
+            _default_store = SpectrumStore(os.path.join(directory, "spectra"))
+        return _default_store
+
+
+def load_spectra(sources, grid=None):
+    """
+    Loads many spectra into one array. Returns (wavenumbers, intensities) where
+    intensities has one row per spectrum. If the spectra do not share the same
+    wavenumbers they are linearly interpolated onto grid, which defaults to the range
+    covered by all spectra at the finest median spacing among them. Points outside a
+    spectrum's range are NaN rather than extrapolated.
+
+    sources:            List of (n, 2) arrays, bytes, or paths (.npy files are memory-mapped).
+    grid:               (1-D array) Wavenumbers to resample onto.
+    """
+    spectra = []
+    for source in sources:
+        if isinstance(source, np.ndarray):
+            spectra.append(source)
+        elif isinstance(source, str) and source.endswith(".npy"):
+            spectra.append(load_spectrum(source))
+        else:
+            spectra.append(parse_spectrum(source))
+    if len(spectra) == 0:
+        return np.zeros(0), np.zeros((0, 0))
+
+    first = spectra[0][:, 0]
+    if grid is None and all(
+        s.shape == spectra[0].shape and np.array_equal(s[:, 0], first) for s in spectra
+    ):
+        return np.asarray(first, dtype=np.float64), np.stack([s[:, 1] for s in spectra])
+
+    if grid is None:
+        lo = min(float(np.min(s[:, 0])) for s in spectra)
+        hi = max(float(np.max(s[:, 0])) for s in spectra)
+        step = min(float(np.median(np.abs(np.diff(s[:, 0])))) for s in spectra if len(s) > 1)
+        grid = np.arange(lo, hi + step / 2, step)
+    grid = np.asarray(grid, dtype=np.float64)
+
+    intensities = np.empty((len(spectra), grid.size), dtype=np.float64)
+    for i, s in enumerate(spectra):
+        order = np.argsort(s[:, 0])
+        x = np.asarray(s[order, 0], dtype=np.float64)
+        y = np.asarray(s[order, 1], dtype=np.float64)
+        intensities[i] = np.interp(grid, x, y, left=np.nan, right=np.nan)
+    return grid, intensities
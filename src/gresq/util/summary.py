@@ -0,0 +1,360 @@
+"""
+Materialized experiment summary.
+
+experiment_summary holds one typed row per experiment with every field shown by the
+query tab: the experiment columns, recipe (including the hybrid recipe fields computed
+from preparation steps), substrate, furnace, environment conditions, properties and the
+per-experiment mean of the Raman ratios. The query tab reads this single indexed table
+instead of rebuilding the join for every filter.
+
+The table is kept current by calling refresh_experiment_summary/delete_experiment_summary
+from code that writes experiments (submission, admin actions, bulk loaders). It can be
+rebuilt from scratch with:
+
+    python -m gresq.util.summary --db_mode production --rebuild
+"""
+import argparse
+import logging
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    Float,
+    Boolean,
+    and_,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, selectinload
+from sqlalchemy.sql import visitors
+from grdb.database.models import (
+    Experiment,
+    Substrate,
+    EnvironmentConditions,
+    Furnace,
+    Recipe,
+    Properties,
+    PreparationStep,
+)
+from gresq.util.query_builder import (
+    recipe_fields,
+    hybrid_recipe_fields,
+    substrate_fields,
+    furnace_fields,
+    environment_conditions_fields,
+    properties_fields,
+    raman_fields,
+    results_query,
+    referenced_tables,
+    split_filters,
+    _one_to_many,
+)
+from gresq.util.versions import bump_table_versions
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+# Tables whose fields are copied into experiment_summary, with the fields copied.
+materialized_fields = [
+    (Recipe, recipe_fields),
+    (Substrate, substrate_fields),
+    (Furnace, furnace_fields),
+    (EnvironmentConditions, environment_conditions_fields),
+    (Properties, properties_fields),
+]
+
+hybrid_recipe_types = {
+    "maximum_temperature": Float,
+    "maximum_pressure": Float,
+    "average_carbon_flow_rate": Float,
+    "uses_helium": Boolean,
+    "uses_hydrogen": Boolean,
+    "uses_argon": Boolean,
+}
+
+
+def _build_table():
+    columns = []
+    for c in Experiment.__table__.columns:
+        columns.append(
+            Column(
+                c.key,
+                c.type.copy(),
+                primary_key=c.key == "id",
+                autoincrement=False,
+                index=c.key in ("validated", "nanohub_userid", "experiment_date"),
+            )
+        )
+    for model, fields in materialized_fields:
+        for field in fields:
+            columns.append(
+                Column(field, getattr(model, field).property.columns[0].type.copy(), index=True)
+            )
+    for field in hybrid_recipe_fields:
+        columns.append(Column(field, hybrid_recipe_types[field](), index=True))
+    for field in raman_fields:
+        columns.append(Column(field, Float(), index=True))
+    return Table("experiment_summary", metadata, *columns)
+
+
+experiment_summary = _build_table()
+
+_available = {}
+
+
+def summary_available(bind, refresh=False):
+    """
+    Returns True if the experiment_summary table exists in the database. The answer is
+    cached per database URL.
+
+    bind:               SQLAlchemy engine or connection.
+    refresh:            (bool) Ignore the cached answer.
+    """
+    key = str(bind.engine.url) if hasattr(bind, "engine") else str(bind.url)
+    if refresh or key not in _available:
+        if isinstance(bind, Connection):
+            _available[key] = bind.dialect.has_table(bind, experiment_summary.name)
+        else:
+            with bind.connect() as connection:
+                _available[key] = bind.dialect.has_table(
+                    connection, experiment_summary.name
+                )
+    return _available[key]
+
+
+def create_summary_table(bind):
+    metadata.create_all(bind=bind, tables=[experiment_summary], checkfirst=True)
+    summary_available(bind, refresh=True)
+
+
+def summary_column_map():
+    """
+    Maps the source model columns materialized in experiment_summary to the summary
+    columns that replace them.
+    """
+    mapping = {}
+    for c in Experiment.__table__.columns:
+        mapping[c] = experiment_summary.c[c.key]
+    for model, fields in materialized_fields:
+        for field in fields:
+            mapping[getattr(model, field).property.columns[0]] = experiment_summary.c[field]
+    return mapping
+
+
+def _translate(clause, mapping):
+    """
+    Rewrites a clause so that materialized source columns point at experiment_summary.
+    """
+    return visitors.replacement_traverse(clause, {}, lambda e: mapping.get(e))
+
+
+def summary_results_query(filters, session=None):
+    """
+    Builds the results query against experiment_summary. Filters on materialized fields
+    are applied to the summary row; filters on preparation steps, Raman analyses and
+    authors become EXISTS semi-joins correlated with the summary row, as in results_query.
+    Returns None if a filter cannot be expressed against the summary, in which case the
+    caller should use results_query.
+
+    filters:            list of sqlalchemy filters
+    session:            Optional session to bind the query to.
+    """
+    mapping = summary_column_map()
+    relationships = _one_to_many()
+    direct, semi = split_filters(filters)
+
+    clauses = []
+    for f in direct:
+        t = _translate(f, mapping)
+        if referenced_tables(t) - {experiment_summary}:
+            return None
+        clauses.append(t)
+    for label, fs in semi.items():
+        rel = relationships[label]
+        link = [_translate(l, mapping) for l in rel["link"]]
+        clauses.append(Query(rel["entity"]).filter(and_(*(link + fs))).exists())
+
+    # Same columns as results_query so the results tab behaves identically.
+    c = experiment_summary.c
+    query_columns = (
+        [c[f] for f in furnace_fields]
+        + [c[col.key] for col in Experiment.__table__.columns]
+        + [c[f] for f in recipe_fields]
+        + [c[f] for f in raman_fields]
+        + [c[f] for f in properties_fields]
+        + [c[f] for f in substrate_fields]
+        + [c[f] for f in environment_conditions_fields]
+    )
+    return Query(query_columns, session=session).filter(*clauses)
+
+
+def results_query_for(filters, bind):
+    """
+    Returns the results query of the query tab for filters: summary_results_query when
+    experiment_summary exists and can express the filters, results_query otherwise.
+
+    filters:            list of sqlalchemy filters
+    bind:               SQLAlchemy engine or connection the query will run on.
+    """
+    q = None
+    if summary_available(bind):
+        q = summary_results_query(filters)
+    if q is None:
+        q = results_query(filters)
+    return q
+
+
+def compute_summary_rows(session, experiment_ids):
+    """
+    Computes the experiment_summary rows for a list of experiment ids. Ids that no longer
+    exist are skipped.
+
+    session:            SQLAlchemy session.
+    experiment_ids:     (list of int) Experiment ids.
+    """
+    experiment_ids = list(experiment_ids)
+    if len(experiment_ids) == 0:
+        return []
+
+    rows = {}
+    q = results_query([Experiment.id.in_(experiment_ids)], session=session)
+    for r in q:
+        row = dict(r._asdict())
+        rows[row["id"]] = {c.key: row.get(c.key) for c in experiment_summary.columns}
+
+    recipe_ids = set(row["recipe_id"] for row in rows.values() if row.get("recipe_id") is not None)
+    if len(recipe_ids) > 0:
+        step_relationships = [
+            getattr(Recipe, r.key)
+            for r in Recipe.__mapper__.relationships
+            if r.mapper.class_ is PreparationStep
+        ]
+        recipes = (
+            session.query(Recipe)
+            .options(*[selectinload(r) for r in step_relationships])
+            .filter(Recipe.id.in_(recipe_ids))
+        )
+        hybrids = {}
+        for recipe in recipes:
+            values = {}
+            for field in hybrid_recipe_fields:
+                try:
+                    values[field] = getattr(recipe, field)
+                except Exception as e:
+                    logger.warning("Could not compute %s for recipe %s: %s" % (field, recipe.id, e))
+                    values[field] = None
+            hybrids[recipe.id] = values
+        for row in rows.values():
+            row.update(hybrids.get(row.get("recipe_id"), {}))
+
+    return list(rows.values())
+
+
+def delete_experiment_summary(session, experiment_ids):
+    """
+    Removes experiments from experiment_summary. Does nothing if the table does not exist.
+
+    session:            SQLAlchemy session. The caller commits.
+    experiment_ids:     (list of int) Experiment ids.
+    """
+    experiment_ids = list(experiment_ids)
+    if len(experiment_ids) == 0 or not summary_available(session.get_bind()):
+        return
+    session.execute(
+        experiment_summary.delete().where(experiment_summary.c.id.in_(experiment_ids))
+    )
+    bump_table_versions(session, [experiment_summary])
+
+
+def refresh_experiment_summary(session, experiment_ids):
+    """
+    Recomputes the experiment_summary rows of the given experiments from the source tables.
+    Call it after flushing any change to an experiment or its related rows. Does nothing if
+    the table does not exist.
+
+    session:            SQLAlchemy session. The caller commits.
+    experiment_ids:     (list of int) Experiment ids.
+    """
+    experiment_ids = [int(i) for i in experiment_ids if i is not None]
+    if len(experiment_ids) == 0 or not summary_available(session.get_bind()):
+        return
+    rows = compute_summary_rows(session, experiment_ids)
+    delete_experiment_summary(session, experiment_ids)
+    if len(rows) > 0:
+        session.execute(experiment_summary.insert(), rows)
+    logger.debug("Refreshed experiment_summary for %s experiments." % len(rows))
+
+
+def rebuild_experiment_summary(session, batch_size=500):
+    """
+    Creates experiment_summary if needed and recomputes every row.
+
+    session:            SQLAlchemy session. The caller commits.
+    batch_size:         (int) Number of experiments computed per batch.
+    """
+    create_summary_table(session.get_bind())
+    session.execute(experiment_summary.delete())
+    ids = [i for (i,) in session.query(Experiment.id).order_by(Experiment.id)]
+    for b in range(0, len(ids), batch_size):
+        rows = compute_summary_rows(session, ids[b : b + batch_size])
+        if len(rows) > 0:
+            session.execute(experiment_summary.insert(), rows)
+        logger.info("experiment_summary: %s/%s" % (min(b + batch_size, len(ids)), len(ids)))
+    bump_table_versions(session, [experiment_summary])
+    return len(ids)
+
+
+def main():
+    from gresq.config import Config
+    from grdb.database import dal
+
+    parser = argparse.ArgumentParser(description="Maintain the experiment_summary table.")
+    parser.add_argument(
+        "--db_mode",
+        default="development",
+        type=str,
+        help="Database mode: development, testing, or production",
+    )
+    parser.add_argument(
+        "--db_config_path",
+        default="",
+        type=str,
+        help="Path to database config secrets.",
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", default=False, help="Rebuild every row."
+    )
+    parser.add_argument(
+        "--refresh",
+        nargs="+",
+        type=int,
+        default=[],
+        help="Experiment ids to refresh.",
+    )
+    kwargs = vars(parser.parse_args())
+    logging.basicConfig(level=logging.INFO)
+
+    prefixes = {
+        "development": "DEV_DATABASE",
+        "testing": "TEST_DATABASE",
+        "production": "PROD_DATABASE",
+    }
+    db_conf = Config(
+        prefix=prefixes[kwargs["db_mode"].lower()],
+        suffix="_ADMIN",
+        debug=kwargs["db_mode"].lower() != "production",
+        dbconfig_file=kwargs["db_config_path"],
+    )
+    dal.init_db(db_conf, privileges={"read": True, "write": True, "validate": True})
+
+    with dal.session_scope() as session:
+        if kwargs["rebuild"]:
+            n = rebuild_experiment_summary(session)
+            logger.info("Rebuilt experiment_summary (%s experiments)." % n)
+        elif len(kwargs["refresh"]) > 0:
+            refresh_experiment_summary(session, kwargs["refresh"])
+        session.commit()
+
+
+if __name__ == "__main__":
+    main()
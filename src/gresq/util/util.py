@@ -9,7 +9,6 @@ import operator
 import requests
 import traceback
 import inspect
-from mlxtend.frequent_patterns import apriori
 import functools
 import logging
 from sqlalchemy import String, Integer, Float, Numeric, Date
@@ -17,9 +16,13 @@ from collections.abc import Sequence
 from collections import OrderedDict, deque
 import pyqtgraph as pg
 from gresq.util.gwidgets import LabelMaker, SpacerMaker, BasicLabel, SubheaderLabel, HeaderLabel, MaxSpacer
+from gresq.util.result_cache import default_result_cache
+from gresq.util.lazy import lazy_import
 
 logger = logging.getLogger(__name__)
 
+frequent_patterns = lazy_import("mlxtend.frequent_patterns")
+
 sql_validator = {
     "int": lambda x: isinstance(x.property.columns[0].type, Integer),
     "float": lambda x: isinstance(x.property.columns[0].type, Float),
@@ -112,33 +115,191 @@ class ConfigParams:
         self.validate = flag
 
 
-class ResultsTableModel(QtCore.QAbstractTableModel):
+def display_strings(values, missing):
     """
-    This PyQt TableModel is used for displaying data queried from a SQL query 
-    in a TableView.
+    Formats values as the strings shown in a table: str(value), or an empty string where
+    missing is True.
+
+    values:             (list) Values to format.
+    missing:            (array of bool) Missing value mask.
+    """
+    return ["" if m else str(v) for v, m in zip(values, missing)]
+
+
+class DisplayCache:
+    """
+    Display strings of a DataFrame for table models. When the DataFrame is set, each column
+    is split into a NumPy array of values and a missing value mask. Strings are formatted
+    from those arrays a block of rows of one column at a time, the first time a cell of the
+    block is shown, so repaints and scrolling look strings up instead of indexing the
+    DataFrame cell by cell. Call clear whenever the DataFrame changes, and setOrder when the
+    rows are shown in a different order.
+
+    df:                 (pd.DataFrame) Data shown by the model.
+    block_size:         (int) Rows formatted at once.
+    """
+
+    def __init__(self, df, block_size=64):
+        self.block_size = block_size
+        self.order = None
+        self.clear(df)
+
+    def setOrder(self, order):
+        """
+        Sets the DataFrame row shown in each table row.
+
+        order:          (array of int) Permutation of the DataFrame rows. None shows them in
+                        DataFrame order.
+        """
+        self.order = order
+        self.blocks = {}
+
+    def clear(self, df=None):
+        if df is not None:
+            self.df = df
+            self.order = None
+        self.blocks = {}
+        self.columns = []
+        for j in range(self.df.shape[1]):
+            column = self.df.iloc[:, j]
+            # Plain NumPy columns are sliced directly; str() of their scalars matches str()
+            # of the pandas values. Other dtypes (dates, categoricals, ...) are boxed by pandas.
+            if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcOSU":
+                values = column.values
+            else:
+                values = None
+            self.columns.append((values, column.isna().values))
+
+    def text(self, row, column):
+        block, offset = divmod(row, self.block_size)
+        key = (column, block)
+        strings = self.blocks.get(key)
+        if strings is None:
+            start = block * self.block_size
+            stop = start + self.block_size
+            rows = slice(start, stop) if self.order is None else self.order[start:stop]
+            values, missing = self.columns[column]
+            if values is not None:
+                values = values[rows].tolist()
+            else:
+                values = self.df.iloc[rows, column].tolist()
+            strings = display_strings(values, missing[rows])
+            self.blocks[key] = strings
+        return strings[offset]
+
+
+class SortIndex:
+    """
+    Sort permutations of a DataFrame for table models. Sorting a model picks the row order
+    from here instead of reordering the DataFrame, so the DataFrame is never copied and row
+    positions in it stay fixed. Each column is ranked once; permutations are cached per list
+    of sort keys, so sorting again by the same keys is a lookup. Sorts are stable and missing
+    values come last in both directions, as with DataFrame.sort_values.
+
+    df:                 (pd.DataFrame) Data shown by the model.
+    max_permutations:   (int) Number of permutations kept.
+    """
+
+    def __init__(self, df, max_permutations=16):
+        self.max_permutations = max_permutations
+        self.clear(df)
+
+    def clear(self, df=None):
+        if df is not None:
+            self.df = df
+        self.ranks = {}
+        self.permutations = OrderedDict()
+
+    def rank(self, column):
+        """
+        Returns (codes, n) for the column at position column: the dense rank of each value,
+        from 0 to n - 1, and -1 for missing values.
+        """
+        if column not in self.ranks:
+            values = self.df.iloc[:, column]
+            try:
+                codes, uniques = pd.factorize(values, sort=True)
+            except TypeError:
+                # Mixed types (e.g. tuples of different lengths) are ranked by their text.
+                codes, uniques = pd.factorize(
+                    values.map(lambda v: None if v is None else str(v)), sort=True
+                )
+            self.ranks[column] = (codes, len(uniques))
+        return self.ranks[column]
+
+    def _key(self, column, ascending):
+        codes, n = self.rank(column)
+        key = codes if ascending else n - 1 - codes
+        return np.where(codes < 0, n, key)
+
+    def permutation(self, keys):
+        """
+        Returns the DataFrame row shown in each table row when sorted by keys.
+
+        keys:           (list of (int, bool)) Column positions and whether they are sorted
+                        ascending, most significant first.
+        """
+        keys = tuple((int(c), bool(a)) for c, a in keys)
+        order = self.permutations.get(keys)
+        if order is None:
+            if len(keys) == 1:
+                order = np.argsort(self._key(*keys[0]), kind="stable")
+            else:
+                # np.lexsort sorts by the last key first.
+                order = np.lexsort([self._key(c, a) for c, a in reversed(keys)])
+            self.permutations[keys] = order
+            while len(self.permutations) > self.max_permutations:
+                self.permutations.popitem(last=False)
+        else:
+            self.permutations.move_to_end(keys)
+        return order
+
+
+def move_persistent_rows(model, old_order, new_order):
+    """
+    Moves the persistent indexes of model (selection, current index) so they stay on the same
+    DataFrame rows when the row order changes. Call between layoutAboutToBeChanged and
+    layoutChanged.
+
+    old_order:          (array of int) Previous permutation, or None for DataFrame order.
+    new_order:          (array of int) New permutation, or None for DataFrame order.
+    """
+    indexes = model.persistentIndexList()
+    if len(indexes) == 0:
+        return
+    if new_order is not None:
+        position = np.empty(len(new_order), dtype=np.intp)
+        position[new_order] = np.arange(len(new_order))
+    moved = []
+    for index in indexes:
+        row = index.row()
+        if old_order is not None:
+            row = old_order[row]
+        if new_order is not None:
+            row = position[row]
+        moved.append(model.index(int(row), index.column()))
+    model.changePersistentIndexList(indexes, moved)
+
+
+class ResultsModel(QtCore.QAbstractTableModel):
+    """
+    Base of the table models showing query results: column names, header labels and the
+    experiment id of each row. Subclasses implement columnNames and value.
     """
 
     def __init__(self, parent=None):
-        super(ResultsTableModel, self).__init__(parent=parent)
-        self.df = pd.DataFrame()
+        super(ResultsModel, self).__init__(parent=parent)
         self.header_mapper = None
 
-    def copy(self, fields=None):
-        model = ResultsTableModel()
-        model.df = self.df.copy()
-        model.header_mapper = copy.deepcopy(self.header_mapper)
-
-        if fields:
-            for col in model.df.columns:
-                if col not in fields:
-                    model.df.drop(columns=col, inplace=True)
-                    del model.header_mapper[col]
+    def columnNames(self):
+        raise NotImplementedError
 
-        return model
+    def value(self, column, row):
+        raise NotImplementedError
 
     def setHeaderMapper(self, models):
         self.header_mapper = {}
-        for column in list(self.df.columns):
+        for column in self.columnNames():
             for model in models:
                 if hasattr(model, column):
                     info = getattr(model, column).info
@@ -155,9 +316,90 @@ class ResultsTableModel(QtCore.QAbstractTableModel):
                     self.header_mapper[column] = value
                     break
 
+    def rowId(self, row):
+        """
+        Returns the experiment id shown in row.
+        """
+        return int(self.value("id", row))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        columns = self.columnNames()
+        if (
+            role == QtCore.Qt.DisplayRole
+            and orientation == QtCore.Qt.Horizontal
+            and section < len(columns)
+        ):
+            column = columns[section]
+            if self.header_mapper:
+                return self.header_mapper[column]
+            else:
+                return column
+
+        return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
+
+
+class ResultsTableModel(ResultsModel):
+    """
+    This PyQt TableModel is used for displaying data queried from a SQL query 
+    in a TableView.
+
+    Sorting does not reorder df: order holds the df row shown in each table row (see
+    SortIndex), and rowId, value and sourceRow take table rows.
+    """
+
+    # Sort keys kept as tie-breakers when a header is clicked.
+    max_sort_keys = 3
+
+    def __init__(self, parent=None):
+        super(ResultsTableModel, self).__init__(parent=parent)
+        self.df = pd.DataFrame()
+        self.display = DisplayCache(self.df)
+        self.sorting = SortIndex(self.df)
+        self.order = None
+        self.sort_keys = []
+
+    def copy(self, fields=None):
+        """
+        Returns a model with a copy of the data in table order.
+        """
+        model = ResultsTableModel()
+        if self.order is None:
+            model.df = self.df.copy()
+        else:
+            model.df = self.df.take(self.order).reset_index(drop=True)
+        model.header_mapper = copy.deepcopy(self.header_mapper)
+
+        if fields:
+            for col in model.df.columns:
+                if col not in fields:
+                    model.df.drop(columns=col, inplace=True)
+                    del model.header_mapper[col]
+
+        model.display.clear(model.df)
+        model.sorting.clear(model.df)
+        return model
+
+    def columnNames(self):
+        return list(self.df.columns)
+
     def read_sqlalchemy(self, statement, session, models=None):
+        self.setDataFrame(
+            default_result_cache().read(statement, session.connection()), models=models
+        )
+
+    def setDataFrame(self, df, models=None):
+        """
+        Replaces the model contents with an already fetched DataFrame (e.g. from a QueryEngine).
+
+        df:                 (pd.DataFrame) Query results.
+        models:             (list) SQLAlchemy models used to build header labels.
+        """
         self.beginResetModel()
-        self.df = pd.read_sql_query(statement, session.connection())
+        self.df = df
+        self.display.clear(df)
+        self.sorting.clear(df)
+        self.order = None
+        self.sort_keys = []
 
         if models:
             self.setHeaderMapper(models)
@@ -166,10 +408,19 @@ class ResultsTableModel(QtCore.QAbstractTableModel):
 
         self.endResetModel()
 
+    def sourceRow(self, row):
+        """
+        Returns the position in df of the row shown in table row.
+        """
+        if self.order is None:
+            return row
+        return int(self.order[row])
+
     def value(self, column, row):
-        if isinstance(column, str):
-            item = self.df[column]
-            return item.iloc[row].values[0]
+        """
+        Returns the value of column (name) in table row.
+        """
+        return self.df[column].values[self.sourceRow(row)]
 
     def rowCount(self,parent):
         return self.df.shape[0]
@@ -180,32 +431,52 @@ class ResultsTableModel(QtCore.QAbstractTableModel):
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if index.isValid():
             if role == QtCore.Qt.DisplayRole:
-                i, j = index.row(), index.column()
-                value = self.df.iloc[i, j]
-                if pd.isnull(value):
-                    return ""
-                else:
-                    return str(value)
+                return self.display.text(index.row(), index.column())
         return QtCore.QVariant()
 
-    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
-        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
-            if self.header_mapper:
-                return self.header_mapper[self.df.columns[section]]
-            else:
-                return self.df.columns[section]
-
-        return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
-
     def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """
+        Sorts by column; the previous sort keys break ties.
+        """
+        keys = [(column, order == QtCore.Qt.AscendingOrder)]
+        keys += [k for k in self.sort_keys if k[0] != column]
+        self.sortBy(keys[: self.max_sort_keys])
+
+    def sortBy(self, keys):
+        """
+        Sorts the table rows by several columns.
+
+        keys:               (list of (int, bool)) Column positions and whether they are
+                            sorted ascending, most significant first. An empty list restores
+                            the order of df.
+        """
         self.layoutAboutToBeChanged.emit()
-        if order == QtCore.Qt.AscendingOrder:
-            self.df = self.df.sort_values(by=self.df.columns[column], ascending=True)
-        elif order == QtCore.Qt.DescendingOrder:
-            self.df = self.df.sort_values(by=self.df.columns[column], ascending=False)
+        order = self.sorting.permutation(keys) if len(keys) > 0 else None
+        move_persistent_rows(self, self.order, order)
+        self.order = order
+        self.sort_keys = list(keys)
+        self.display.setOrder(order)
         self.layoutChanged.emit()
 
 
+def frequent_itemsets(df, min_support=0.5):
+    """
+    Returns the sets of columns of df that are non-null together in at least min_support of
+    the rows, with columns Support, # Features and Feature Set, largest sets first.
+
+    df:                 (DataFrame) Data whose missing values are counted.
+    min_support:        (float) Minimum fraction of rows.
+    """
+    dfisnull = ~pd.isnull(df)
+    itemsets = frequent_patterns.apriori(dfisnull, use_colnames=True, min_support=min_support)
+    itemsets.columns = ["Support", "Feature Set"]
+    itemsets["# Features"] = itemsets["Feature Set"].apply(lambda x: len(x))
+    itemsets["Feature Set"] = itemsets["Feature Set"].apply(lambda x: tuple(x))
+    itemsets["Support"] = itemsets["Support"].apply(lambda x: round(x, 4))
+    itemsets.sort_values(by="# Features", ascending=False, inplace=True)
+    return itemsets[["Support", "# Features", "Feature Set"]]
+
+
 class ItemsetsTableModel(QtCore.QAbstractTableModel):
     """
     Creates a PyQt TableModel that determines the support for different sets of attributes.
@@ -213,13 +484,30 @@ class ItemsetsTableModel(QtCore.QAbstractTableModel):
     data for a set, the support is '0'. This model is useful for conducting analyses on
     datasets where some rows are missing data. It can help determine which sets of attributes
     should be used on the basis of how much support there is for a particular set.
+
+    Like ResultsTableModel, sorting sets order instead of reordering frequent_itemsets; use
+    sourceRow to find the itemset shown in a table row.
     """
 
+    max_sort_keys = 3
+
     def __init__(self, parent=None):
         super(ItemsetsTableModel, self).__init__(parent=parent)
         self.frequent_itemsets = pd.DataFrame()
+        self.display = DisplayCache(self.frequent_itemsets)
+        self.sorting = SortIndex(self.frequent_itemsets)
+        self.order = None
+        self.sort_keys = []
         self.items = []
 
+    def sourceRow(self, row):
+        """
+        Returns the position in frequent_itemsets of the row shown in table row.
+        """
+        if self.order is None:
+            return row
+        return int(self.order[row])
+
     def rowCount(self, parent):
         return self.frequent_itemsets.shape[0]
 
@@ -229,12 +517,7 @@ class ItemsetsTableModel(QtCore.QAbstractTableModel):
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if index.isValid():
             if role == QtCore.Qt.DisplayRole:
-                i, j = index.row(), index.column()
-                value = self.frequent_itemsets.iloc[i, j]
-                if pd.isnull(value):
-                    return ""
-                else:
-                    return str(value)
+                return self.display.text(index.row(), index.column())
         return QtCore.QVariant()
 
     def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
@@ -243,36 +526,37 @@ class ItemsetsTableModel(QtCore.QAbstractTableModel):
         return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
 
     def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """
+        Sorts by column; the previous sort keys break ties.
+        """
+        keys = [(column, order == QtCore.Qt.AscendingOrder)]
+        keys += [k for k in self.sort_keys if k[0] != column]
+        self.sortBy(keys[: self.max_sort_keys])
+
+    def sortBy(self, keys):
+        """
+        Sorts the table rows by several columns (see ResultsTableModel.sortBy).
+        """
         self.layoutAboutToBeChanged.emit()
-        if order == QtCore.Qt.AscendingOrder:
-            self.frequent_itemsets.sort_values(
-                by=self.frequent_itemsets.columns[column], ascending=True, inplace=True
-            )
-        elif order == QtCore.Qt.DescendingOrder:
-            self.frequent_itemsets.sort_values(
-                by=self.frequent_itemsets.columns[column], ascending=False, inplace=True
-            )
+        order = self.sorting.permutation(keys) if len(keys) > 0 else None
+        move_persistent_rows(self, self.order, order)
+        self.order = order
+        self.sort_keys = list(keys)
+        self.display.setOrder(order)
         self.layoutChanged.emit()
 
     def update_frequent_itemsets(self, df, min_support=0.5):
-        self.beginResetModel()
-        dfisnull = ~pd.isnull(df)
         self.items = df.columns
-        self.frequent_itemsets = apriori(dfisnull, use_colnames=True, min_support=0.5)
-        self.frequent_itemsets.columns = ["Support", "Feature Set"]
-        self.frequent_itemsets["# Features"] = self.frequent_itemsets[
-            "Feature Set"
-        ].apply(lambda x: len(x))
-        self.frequent_itemsets["Feature Set"] = self.frequent_itemsets[
-            "Feature Set"
-        ].apply(lambda x: tuple(x))
-        self.frequent_itemsets["Support"] = self.frequent_itemsets["Support"].apply(
-            lambda x: round(x, 4)
-        )
-        self.frequent_itemsets.sort_values(
-            by="# Features", ascending=False, inplace=True
-        )
-        self.frequent_itemsets = self.frequent_itemsets[
-            ["Support", "# Features", "Feature Set"]
-        ]
+        self.setFrequentItemsets(frequent_itemsets(df, min_support=min_support))
+
+    def setFrequentItemsets(self, itemsets):
+        """
+        Shows itemsets returned by frequent_itemsets, e.g. from a background job.
+        """
+        self.beginResetModel()
+        self.frequent_itemsets = itemsets
+        self.display.clear(self.frequent_itemsets)
+        self.sorting.clear(self.frequent_itemsets)
+        self.order = None
+        self.sort_keys = []
         self.endResetModel()
\ No newline at end of file
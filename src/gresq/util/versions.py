@@ -0,0 +1,248 @@
+"""
+Table version counters.
+
+table_versions holds one counter per database table. Code that writes experiments (submission,
+admin actions, bulk loaders) bumps the counters of the tables it changed in the same
+transaction, so anything holding results computed from those tables (cached query results,
+in-memory refinements) can tell that they are out of date by comparing a snapshot of the
+counters. The "*" counter is bumped by writes that may touch any table.
+
+Writes that only insert rows also bump a second counter, "<table>:inserts", so readers that
+copy tables (see gresq.util.replica) can pull the new rows instead of reading the table
+again. changed_tables returns the tables a session has inserted into and changed.
+
+When the table does not exist, counters are kept per process, so only writes made by this
+process are seen. Create the table with:
+
+    python -m gresq.util.versions --db_mode production --create
+"""
+import argparse
+import logging
+import threading
+from sqlalchemy import MetaData, Table, Column, String, Integer, event
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, Session, object_mapper
+from grdb.database import Base
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+table_versions = Table(
+    "table_versions",
+    metadata,
+    Column("name", String(64), primary_key=True),
+    Column("version", Integer, nullable=False, default=0),
+)
+
+ALL_TABLES = "*"
+
+_available = {}
+_local_versions = {}
+_local_lock = threading.Lock()
+
+
+def _name(table):
+    return table if isinstance(table, str) else table.name
+
+
+def inserts_name(table):
+    """
+    Returns the name of the counter bumped when rows are only inserted into table.
+    """
+    return "%s:inserts" % _name(table)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session, flush_context):
+    inserted, changed = session.info.setdefault("flushed_tables", (set(), set()))
+    for instances, tables in (
+        (session.new, inserted),
+        (session.dirty, changed),
+        (session.deleted, changed),
+    ):
+        for instance in instances:
+            tables.update(t.name for t in object_mapper(instance).tables)
+    for instance in session.deleted:
+        # Children may be deleted by the database (passive_deletes) without being loaded.
+        for relationship in object_mapper(instance).relationships:
+            if relationship.cascade.delete:
+                changed.update(t.name for t in relationship.mapper.tables)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _forget_flushes(session):
+    session.info.pop("flushed_tables", None)
+
+
+def changed_tables(session):
+    """
+    Flushes session and returns (inserted, changed): the names of the tables its transaction
+    has only inserted rows into, and of the tables it has updated or deleted rows of. Rows
+    changed with Query.update, Query.delete or session.execute are not seen.
+
+    session:            SQLAlchemy session.
+    """
+    session.flush()
+    inserted, changed = session.info.get("flushed_tables", (set(), set()))
+    return sorted(inserted - changed), sorted(changed)
+
+
+def versions_available(bind, refresh=False):
+    """
+    Returns True if the table_versions table exists in the database. The answer is cached
+    per database URL.
+
+    bind:               SQLAlchemy engine or connection.
+    refresh:            (bool) Ignore the cached answer.
+    """
+    key = str(bind.engine.url) if hasattr(bind, "engine") else str(bind.url)
+    if refresh or key not in _available:
+        if isinstance(bind, Connection):
+            _available[key] = bind.dialect.has_table(bind, table_versions.name)
+        else:
+            with bind.connect() as connection:
+                _available[key] = bind.dialect.has_table(connection, table_versions.name)
+    return _available[key]
+
+
+def create_versions_table(bind):
+    """
+    Creates table_versions with a zero counter for every table in the schema.
+    """
+    metadata.create_all(bind=bind, tables=[table_versions], checkfirst=True)
+    names = sorted(Base.metadata.tables) + [ALL_TABLES]
+    with bind.begin() as connection:
+        existing = set(
+            n for (n,) in connection.execute(Query([table_versions.c.name]).statement)
+        )
+        missing = [{"name": n, "version": 0} for n in names if n not in existing]
+        if len(missing) > 0:
+            connection.execute(table_versions.insert(), missing)
+    versions_available(bind, refresh=True)
+
+
+def bump_table_versions(session, tables=None, inserted=None):
+    """
+    Bumps the counters of tables. Call it in the transaction that changes them; the caller
+    commits.
+
+    session:            SQLAlchemy session.
+    tables:             (list of Table or str) Changed tables. None bumps the "*" counter,
+                        which invalidates results computed from any table.
+    inserted:           (list of Table or str) Tables that only had rows inserted.
+    """
+    if tables is None and inserted is None:
+        names = [ALL_TABLES]
+    else:
+        names = set(_name(t) for t in (tables or []))
+        for table in inserted or []:
+            names.update([_name(table), inserts_name(table)])
+        names = sorted(names)
+    if len(names) == 0:
+        return
+    with _local_lock:
+        for name in names:
+            _local_versions[name] = _local_versions.get(name, 0) + 1
+    if not versions_available(session.get_bind()):
+        return
+    result = session.execute(
+        table_versions.update()
+        .where(table_versions.c.name.in_(names))
+        .values(version=table_versions.c.version + 1)
+    )
+    if result.rowcount < len(names):
+        existing = set(
+            n
+            for (n,) in session.execute(
+                Query([table_versions.c.name])
+                .filter(table_versions.c.name.in_(names))
+                .statement
+            )
+        )
+        missing = [{"name": n, "version": 1} for n in names if n not in existing]
+        if len(missing) > 0:
+            session.execute(table_versions.insert(), missing)
+
+
+def current_versions(bind, tables=None):
+    """
+    Returns a snapshot of the counters of tables (and the "*" counter) that compares equal to
+    a later snapshot only if none of the tables were changed in between.
+
+    bind:               SQLAlchemy engine or connection.
+    tables:             (list of Table or str) Tables of interest. None includes every table.
+    """
+    names = None
+    if tables is not None:
+        names = set(_name(t) for t in tables) | {ALL_TABLES}
+    with _local_lock:
+        local = dict(_local_versions)
+    database = {}
+    if versions_available(bind):
+        q = Query([table_versions.c.name, table_versions.c.version])
+        if names is not None:
+            q = q.filter(table_versions.c.name.in_(names))
+        if isinstance(bind, Connection):
+            database = dict((n, v) for n, v in bind.execute(q.statement))
+        else:
+            with bind.connect() as connection:
+                database = dict((n, v) for n, v in connection.execute(q.statement))
+    keys = set(local) | set(database)
+    if names is not None:
+        keys &= names
+    return {k: (database.get(k, 0), local.get(k, 0)) for k in sorted(keys)}
+
+
+def main():
+    from gresq.config import Config
+    from grdb.database import dal
+
+    parser = argparse.ArgumentParser(description="Maintain the table_versions table.")
+    parser.add_argument(
+        "--db_mode",
+        default="development",
+        type=str,
+        help="Database mode: development, testing, or production",
+    )
+    parser.add_argument(
+        "--db_config_path",
+        default="",
+        type=str,
+        help="Path to database config secrets.",
+    )
+    parser.add_argument(
+        "--create", action="store_true", default=False, help="Create the table."
+    )
+    parser.add_argument(
+        "--bump", action="store_true", default=False, help="Invalidate results of every table."
+    )
+    kwargs = vars(parser.parse_args())
+    logging.basicConfig(level=logging.INFO)
+
+    prefixes = {
+        "development": "DEV_DATABASE",
+        "testing": "TEST_DATABASE",
+        "production": "PROD_DATABASE",
+    }
+    db_conf = Config(
+        prefix=prefixes[kwargs["db_mode"].lower()],
+        suffix="_ADMIN",
+        debug=kwargs["db_mode"].lower() != "production",
+        dbconfig_file=kwargs["db_config_path"],
+    )
+    dal.init_db(db_conf, privileges={"read": True, "write": True, "validate": True})
+
+    if kwargs["create"]:
+        create_versions_table(dal.engine)
+    if kwargs["bump"]:
+        with dal.session_scope() as session:
+            bump_table_versions(session)
+            session.commit()
+    for name, version in current_versions(dal.engine).items():
+        print("%-32s %s" % (name, version[0]))
+
+
+if __name__ == "__main__":
+    main()
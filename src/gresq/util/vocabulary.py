@@ -0,0 +1,270 @@
+"""
+Distinct values of string columns, used to fill filter combo boxes and form completers.
+
+The values of every requested column are read with a single UNION ALL statement instead of
+one SELECT DISTINCT per column. They are kept in memory for the session and in
+GRESQ_CACHE_DIR/vocabulary.json (~/.cache/gresq by default), stamped with the table
+versions (see gresq.util.versions) of the tables they were read from; the file is only
+reused while those versions are unchanged. refresh() checks the versions in the background
+and re-reads the values, emitting updated, when they have changed.
+"""
+import os
+import json
+import hashlib
+import threading
+import logging
+import traceback
+from PyQt5 import QtCore
+from sqlalchemy import String, literal, cast, union_all
+from sqlalchemy.orm import Query
+from gresq.util.replica import read_engine
+from gresq.util.versions import current_versions, versions_available
+from gresq.util.instrumentation import origin
+
+logger = logging.getLogger(__name__)
+
+
+def _column(attribute):
+    """
+    Returns the table Column of a model attribute (or the column itself).
+    """
+    if hasattr(attribute, "property"):
+        return attribute.property.columns[0]
+    return attribute
+
+
+def column_key(attribute):
+    """
+    Returns the "table.column" name used to store the values of a column.
+    """
+    column = _column(attribute)
+    return "%s.%s" % (column.table.name, column.name)
+
+
+def string_columns(model, fields):
+    """
+    Returns the attributes of model among fields that are string columns.
+
+    model:              SQLAlchemy model.
+    fields:             (list of str) Attribute names.
+    """
+    columns = []
+    for field in fields:
+        attribute = getattr(model, field, None)
+        if attribute is None or not hasattr(attribute, "property"):
+            continue
+        if not hasattr(attribute.property, "columns"):
+            continue
+        if isinstance(_column(attribute).type, String):
+            columns.append(attribute)
+    return columns
+
+
+def vocabulary_query(columns):
+    """
+    Returns a statement selecting (name, value) for the distinct values of every column,
+    where name is the column_key of the column.
+
+    columns:            (list) Model attributes or table columns.
+    """
+    selects = [
+        Query(
+            [
+                literal(column_key(c)).label("name"),
+                cast(_column(c), String).label("value"),
+            ]
+        )
+        .filter(_column(c).isnot(None))
+        .distinct()
+        .statement
+        for c in columns
+    ]
+    return union_all(*selects)
+
+
+def read_vocabulary(bind, columns):
+    """
+    Reads the distinct values of columns in one round trip. Returns a dict mapping the
+    column_key of each column to its sorted values.
+
+    bind:               SQLAlchemy engine or connection.
+    columns:            (list) Model attributes or table columns.
+    """
+    values = {column_key(c): [] for c in columns}
+    if len(columns) == 0:
+        return values
+    with bind.connect() as connection:
+        for name, value in connection.execute(vocabulary_query(columns)):
+            values[name].append(value)
+    for name in values:
+        values[name].sort()
+    return values
+
+
+class _RefreshTask(QtCore.QRunnable):
+    def __init__(self, vocabulary):
+        super(_RefreshTask, self).__init__()
+        self.vocabulary = vocabulary
+
+    def run(self):
+        try:
+            with origin("Vocabulary.refresh"):
+                self.vocabulary.update()
+        except Exception:
+            logger.warning(traceback.format_exc())
+
+
+class Vocabulary(QtCore.QObject):
+    """
+    Distinct values of the string columns registered through load, read in batches and
+    cached in memory and on disk (see the module docstring).
+
+    bind:               SQLAlchemy engine. Defaults to read_engine(), the replica in
+                        replica mode.
+    path:               (str) JSON file caching the values across sessions. None disables it.
+
+    Signals:
+        updated()       Emitted from refresh when the values were read again.
+    """
+
+    updated = QtCore.pyqtSignal()
+
+    def __init__(self, bind=None, path=None, parent=None):
+        super(Vocabulary, self).__init__(parent=parent)
+        self._bind = bind
+        self.path = path
+        self.columns = {}
+        self._values = {}
+        self.versions = None
+        self._lock = threading.Lock()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def bind(self):
+        if self._bind is not None:
+            return self._bind
+        return read_engine()
+
+    def values(self, attribute):
+        """
+        Returns the known values of a column. Call load first.
+        """
+        with self._lock:
+            return list(self._values.get(column_key(attribute), []))
+
+    def _tables(self):
+        return sorted(set(_column(c).table.name for c in self.columns.values()))
+
+    @origin("Vocabulary.load")
+    def load(self, columns):
+        """
+        Registers columns and makes sure their values are known, reading the values that are
+        neither in memory nor in the cache file with one statement.
+
+        columns:        (list) Model attributes or table columns.
+        """
+        with self._lock:
+            for c in columns:
+                self.columns.setdefault(column_key(c), c)
+            missing = [c for c in columns if column_key(c) not in self._values]
+        if len(missing) == 0:
+            return
+        versions = current_versions(self.bind(), self._tables())
+        stored = self._readFile(versions)
+        missing = [c for c in missing if column_key(c) not in stored]
+        values = read_vocabulary(self.bind(), missing)
+        with self._lock:
+            self._values.update(stored)
+            self._values.update(values)
+            # Values read earlier stay current only if their tables have not changed since.
+            previous = self.versions or {}
+            if all(versions.get(k) == v for k, v in previous.items()):
+                self.versions = versions
+        self._writeFile()
+
+    def update(self):
+        """
+        Re-reads the values of every registered column if their tables changed since they
+        were read. Returns True if they were read again.
+        """
+        with self._lock:
+            columns = list(self.columns.values())
+        if len(columns) == 0:
+            return False
+        versions = current_versions(self.bind(), self._tables())
+        if versions == self.versions:
+            return False
+        values = read_vocabulary(self.bind(), columns)
+        with self._lock:
+            self._values = values
+            self.versions = versions
+        self._writeFile()
+        self.updated.emit()
+        return True
+
+    def refresh(self):
+        """
+        Runs update in a background thread; updated is emitted if the values changed.
+        """
+        self.pool.start(_RefreshTask(self))
+
+    def _fileKey(self):
+        return hashlib.sha256(str(self.bind().url).encode()).hexdigest()
+
+    def _readFile(self, versions):
+        """
+        Returns the values stored in the cache file if they were read at the same database
+        versions, otherwise an empty dict.
+        """
+        if self.path is None or not os.path.isfile(self.path):
+            return {}
+        if not versions_available(self.bind()):
+            return {}
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            logger.debug(traceback.format_exc())
+            return {}
+        if stored.get("database") != self._fileKey():
+            return {}
+        if stored.get("versions") != {k: v[0] for k, v in versions.items()}:
+            return {}
+        return stored.get("values", {})
+
+    def _writeFile(self):
+        if self.path is None or not versions_available(self.bind()):
+            return
+        with self._lock:
+            stored = {
+                "database": self._fileKey(),
+                "versions": {k: v[0] for k, v in (self.versions or {}).items()},
+                "values": dict(self._values),
+            }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = "%s.%s.tmp" % (self.path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.debug(traceback.format_exc())
+
+
+_default_vocabulary = None
+_default_vocabulary_lock = threading.Lock()
+
+
+def default_vocabulary():
+    """
+    Returns the Vocabulary shared by the dashboard tabs, cached in GRESQ_CACHE_DIR
+    (~/.cache/gresq by default).
+    """
+    global _default_vocabulary
+    with _default_vocabulary_lock:
+        if _default_vocabulary is None:
+            directory = os.environ.get(
+                "GRESQ_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gresq")
+            )
+            _default_vocabulary = Vocabulary(path=os.path.join(directory, "vocabulary.json"))
+        return _default_vocabulary
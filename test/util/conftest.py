@@ -0,0 +1,42 @@
+import os
+import pytest
+from sqlalchemy import create_engine, event
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """
+    Engine on an empty SQLite file. A file rather than an in-memory database, so the code
+    under test can open connections from other threads.
+    """
+    engine = create_engine("sqlite:///%s" % (tmp_path / "test.db"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def count_statements():
+    """
+    Returns a function that starts recording the SQL run on an engine, and returns the list
+    the statements are appended to.
+    """
+    listeners = []
+
+    def count(engine):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        listeners.append((engine, listener))
+        return statements
+
+    yield count
+    for engine, listener in listeners:
+        event.remove(engine, "before_cursor_execute", listener)
+
+
+@pytest.fixture(scope="module")
+def app():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtWidgets
+
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
@@ -0,0 +1,116 @@
+import os
+import time
+import pytest
+import requests
+from gresq.util.io import BlobCache, DownloadCancelled
+
+
+class FakeResponse:
+    def __init__(self, content=b"", status_code=200, headers=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """Serves fixed content per url and honours If-None-Match."""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+        self.online = True
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        headers = headers or {}
+        self.requests.append((url, dict(headers)))
+        if not self.online:
+            raise requests.ConnectionError("offline")
+        content = self.files[url]
+        etag = '"%s"' % hash(content)
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(status_code=304, headers={"ETag": etag})
+        return FakeResponse(content, headers={"ETag": etag})
+
+
+@pytest.fixture
+def server():
+    return FakeServer({"a": b"a" * 100, "b": b"b" * 100, "c": b"c" * 100, "a2": b"a" * 100})
+
+
+class TestBlobCache:
+    def test_repeat_get_is_served_from_disk(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server)
+        assert cache.get("a") == b"a" * 100
+        assert cache.get("a") == b"a" * 100
+        assert len(server.requests) == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_persists_across_instances(self, tmp_path, server):
+        BlobCache(str(tmp_path), session=server).get("a")
+        cache = BlobCache(str(tmp_path), session=server)
+        assert cache.get("a") == b"a" * 100
+        assert len(server.requests) == 1
+
+    def test_stale_entry_is_revalidated(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server, max_age=0)
+        cache.get("a")
+        assert cache.get("a") == b"a" * 100
+        assert "If-None-Match" in server.requests[-1][1]
+        assert cache.revalidated == 1
+
+    def test_changed_content_replaces_blob(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server, max_age=0)
+        cache.get("a")
+        old_sha = cache.index["a"]["sha256"]
+        server.files["a"] = b"new"
+        assert cache.get("a") == b"new"
+        assert not os.path.exists(cache.blobPath(old_sha))
+
+    def test_identical_content_shares_blob(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server)
+        cache.get("a")
+        cache.get("a2")
+        assert cache.index["a"]["sha256"] == cache.index["a2"]["sha256"]
+        assert cache.size() == 100
+
+    def test_lru_eviction(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server, max_bytes=250)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.get("b")
+        time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.get("c")
+        assert set(cache.index) == {"a", "c"}
+        assert cache.size() <= 250
+
+    def test_offline_serves_stale_copy(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server, max_age=0)
+        cache.get("a")
+        server.online = False
+        assert cache.get("a") == b"a" * 100
+        with pytest.raises(requests.ConnectionError):
+            cache.get("b")
+
+    def test_abort_mid_body_leaves_nothing_behind(self, tmp_path, server):
+        cache = BlobCache(str(tmp_path), session=server, chunk_size=10)
+        chunks = []
+        with pytest.raises(DownloadCancelled):
+            cache.get("a", abort=lambda: chunks.append(1) or len(chunks) > 3)
+        assert "a" not in cache.index
+        assert not any(
+            name.startswith(".tmp-") for name in os.listdir(cache.blob_directory)
+        )
+        assert cache.get("a") == b"a" * 100
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gresq.util.embedding import EmbeddingCache, embedding_key, fit_embedding
+
+params = {"perplexity": 5.0, "learning_rate": 200.0, "random_state": 3}
+
+
+def frame(ids):
+    ids = np.asarray(ids, dtype=float)
+    return pd.DataFrame({"a": ids, "b": 0.0, "c": 0.5})
+
+
+class TestEmbeddingCache:
+    def test_key(self):
+        ids = np.arange(10)
+        data = frame(ids)
+        key = embedding_key(["a", "b", "c"], ids, data, params)
+        assert key == embedding_key(["a", "b", "c"], ids, data.copy(), dict(params))
+        assert key != embedding_key(["a", "b", "c"], ids, data, dict(params, perplexity=6.0))
+        changed = data.copy()
+        changed.iloc[0, 1] += 1
+        assert key != embedding_key(["a", "b", "c"], ids, changed, params)
+
+    def test_lru(self):
+        cache = EmbeddingCache(max_entries=2)
+        for key in "xyz":
+            cache.put(key, ["a"], [1, 2], params, np.zeros((2, 2)))
+        assert cache.get("x") is None
+        assert cache.get("z") is not None
+
+    def test_warm_start(self):
+        cache = EmbeddingCache()
+        features = ["a", "b", "c"]
+        ids = np.arange(20)
+        embedding = np.column_stack([ids * 2.0, -ids * 1.0])
+        cache.put("k", features, ids, params, embedding)
+
+        new_ids = np.arange(2, 23)
+        init = cache.warmStart(features, new_ids, frame(new_ids), params)
+        assert init.shape == (21, 2)
+        np.testing.assert_array_equal(init[:18], embedding[2:])
+        # Each new row starts next to the closest known row.
+        # Rows 20-22 start next to row 19, the closest in feature a.
+        np.testing.assert_allclose(init[18:], np.tile(embedding[19], (3, 1)), atol=1.0)
+
+        assert cache.warmStart(features, np.arange(100, 130), frame(range(30)), params) is None
+        assert cache.warmStart(["a"], new_ids, frame(new_ids), params) is None
+
+    def test_fit_from_init(self):
+        pytest.importorskip("sklearn")
+        data = frame(range(30)).values
+        cold = fit_embedding(data, **params)
+        warm = fit_embedding(data, init=cold, **params)
+        assert warm.shape == (30, 2)
+        assert np.isfinite(warm).all()
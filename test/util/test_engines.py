@@ -0,0 +1,70 @@
+import os
+import pytest
+from sqlalchemy import create_engine, text
+from grdb.database import dal
+from gresq.util.engines import (
+    parse_args,
+    split_args,
+    create_role_engine,
+    timeout_connect_args,
+    set_reader_engine,
+    reader_engine,
+)
+from gresq.util.replica import read_engine
+
+# PostgreSQL database for the tests that need a server, e.g. postgresql://user@localhost/test
+postgres_url = os.environ.get("GRESQ_TEST_POSTGRES_URL")
+
+
+class TestEngines:
+    def test_split_args(self):
+        options, connect_args = split_args(
+            "{'pool_size': 8, 'pool_pre_ping': True, 'statement_timeout': 30000,"
+            " 'ssl_ca': '/certs/ca.pem'}"
+        )
+        assert options == {"pool_size": 8, "pool_pre_ping": True, "statement_timeout": 30000}
+        assert connect_args == {"ssl_ca": "/certs/ca.pem"}
+        assert parse_args(None) == {}
+        assert parse_args("not a dict") == {}
+
+    def test_role_engine_options(self, tmp_path):
+        engine = create_role_engine(
+            "sqlite:///%s" % (tmp_path / "role.db"),
+            {"pool_pre_ping": True, "stream_results": True, "statement_timeout": 1000},
+        )
+        assert engine.pool._pre_ping
+        assert engine.get_execution_options()["stream_results"]
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT 1")).scalar() == 1
+
+    def test_reads_go_to_the_reader(self):
+        reader = create_engine("sqlite://")
+        set_reader_engine(reader)
+        try:
+            assert reader_engine() is reader
+            assert read_engine() is reader
+        finally:
+            set_reader_engine(None)
+        assert reader_engine() is dal.engine
+
+    def test_psycopg_timeout_is_a_startup_option(self):
+        url = "postgresql+psycopg2://user@localhost/gresq"
+        assert timeout_connect_args(url, 30000, {"sslmode": "require"}) == {
+            "sslmode": "require",
+            "options": "-c statement_timeout=30000",
+        }
+        assert timeout_connect_args(url, 500, {"options": "-c search_path=gresq"}) == {
+            "options": "-c search_path=gresq -c statement_timeout=500"
+        }
+        assert timeout_connect_args("postgresql+psycopg://localhost/gresq", 500, {})["options"]
+        assert timeout_connect_args("postgresql+pg8000://localhost/gresq", 500, {}) is None
+        assert timeout_connect_args("mysql+pymysql://localhost/gresq", 500, {}) is None
+
+    @pytest.mark.skipif(postgres_url is None, reason="GRESQ_TEST_POSTGRES_URL is not set")
+    def test_timeout_survives_check_in(self):
+        engine = create_role_engine(postgres_url, {"pool_size": 1, "statement_timeout": 1234})
+        for _ in range(3):
+            # Each checkout reuses the pooled connection after its reset-on-return rollback.
+            with engine.connect() as connection:
+                assert connection.execute(text("SHOW statement_timeout")).scalar() == "1234ms"
+        engine.dispose()
@@ -0,0 +1,159 @@
+import os
+import json
+import datetime
+import pandas as pd
+import pytest
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Query, Session
+from grdb.database import Base
+from grdb.database.models import (
+    Experiment,
+    Recipe,
+    PreparationStep,
+    Substrate,
+    Furnace,
+    RamanFile,
+    RamanAnalysis,
+)
+from gresq.util.export import export_statement, export_format, export_graphs, ExportCancelled
+
+ExportBase = declarative_base()
+
+
+class Sample(ExportBase):
+    __tablename__ = "export_sample"
+    id = Column(Integer, primary_key=True)
+    catalyst = Column(String(32))
+    pressure = Column(Float)
+    validated = Column(Boolean)
+    date = Column(Date)
+    layers = Column(Integer)
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    engine = sqlite_engine
+    ExportBase.metadata.create_all(engine)
+    session = Session(bind=engine)
+    session.add_all(
+        [
+            Sample(
+                id=i,
+                catalyst=None if i % 4 == 0 else "Copper %s" % i,
+                pressure=None if i % 3 == 0 else i * 0.5,
+                validated=i % 2 == 0,
+                date=datetime.date(2019, 1, 1) + datetime.timedelta(days=i),
+                layers=None if i % 5 == 0 else i,
+            )
+            for i in range(1, 12)
+        ]
+    )
+    session.commit()
+    session.close()
+    return engine
+
+
+def statement(*filters):
+    columns = [Sample.id, Sample.catalyst, Sample.pressure, Sample.validated, Sample.date]
+    return Query(columns).filter(*filters).statement
+
+
+class TestExport:
+    def test_csv_in_chunks(self, engine, tmp_path):
+        path = str(tmp_path / "results.csv")
+        progress = []
+        nrows = export_statement(
+            statement(), path, bind=engine, chunksize=4, progress=progress.append
+        )
+        assert nrows == 11
+        assert progress == [4, 8, 11]
+        df = pd.read_csv(path)
+        assert list(df.columns) == ["id", "catalyst", "pressure", "validated", "date"]
+        assert list(df["id"]) == list(range(1, 12))
+        assert df["pressure"].isnull().sum() == 3
+
+    def test_csv_integers_with_nulls(self, engine, tmp_path):
+        path = str(tmp_path / "layers.csv")
+        export_statement(
+            Query([Sample.id, Sample.layers]).statement, path, bind=engine, chunksize=4
+        )
+        with open(path) as f:
+            lines = f.read().splitlines()
+        # Rows 5 and 10 are NULL, so the second and third chunks hold NULLs.
+        assert lines[1:] == [
+            "%s,%s" % (i, "" if i % 5 == 0 else i) for i in range(1, 12)
+        ]
+
+    def test_empty_results_have_a_header(self, engine, tmp_path):
+        path = str(tmp_path / "empty.csv")
+        assert export_statement(statement(Sample.id < 0), path, bind=engine) == 0
+        with open(path) as f:
+            assert f.read().strip() == "id,catalyst,pressure,validated,date"
+
+    def test_cancel_leaves_no_file(self, engine, tmp_path):
+        path = str(tmp_path / "cancelled.csv")
+        with pytest.raises(ExportCancelled):
+            export_statement(
+                statement(), path, bind=engine, chunksize=4, abort=lambda: True
+            )
+        # Neither the file nor its temporary file is left next to the database.
+        assert [f for f in os.listdir(str(tmp_path)) if not f.endswith(".db")] == []
+
+    @pytest.mark.parametrize("name", ["results.parquet", "results.arrow"])
+    def test_arrow_formats(self, engine, tmp_path, name):
+        pa = pytest.importorskip("pyarrow")
+        path = str(tmp_path / name)
+        export_statement(statement(), path, bind=engine, chunksize=4)
+        if export_format(path) == "parquet":
+            table = pytest.importorskip("pyarrow.parquet").read_table(path)
+        else:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        assert table.num_rows == 11
+        assert table.schema.field("id").type == pa.int64()
+        assert table.schema.field("validated").type == pa.bool_()
+        assert table.schema.field("date").type == pa.date32()
+        assert table.column("catalyst").null_count == 2
+        assert table.column("pressure").null_count == 3
+
+
+@pytest.fixture
+def graph_engine(sqlite_engine):
+    engine = sqlite_engine
+    Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    for i in range(1, 8):
+        session.add_all([Recipe(id=i), Substrate(id=i), Furnace(id=i)])
+        session.add_all([PreparationStep(recipe_id=i, step=s) for s in range(3)])
+        session.add(
+            Experiment(
+                id=i, recipe_id=i, substrate_id=i, furnace_id=i, validated=i % 2 == 1
+            )
+        )
+        session.add(RamanFile(id=i, experiment_id=i, url="raman_%s" % i))
+        session.add_all([RamanAnalysis(raman_file_id=i) for _ in range(2)])
+    session.commit()
+    session.close()
+    return engine
+
+
+class TestGraphExport:
+    def test_ndjson_graphs(self, graph_engine, tmp_path):
+        path = str(tmp_path / "graphs.ndjson")
+        progress = []
+        n = export_graphs(
+            [Experiment.validated == True],
+            path,
+            bind=graph_engine,
+            batch_size=3,
+            progress=progress.append,
+        )
+        assert n == 4
+        assert progress == [3, 4]
+        with open(path) as f:
+            graphs = [json.loads(line) for line in f]
+        assert [g["id"] for g in graphs] == [1, 3, 5, 7]
+        assert [s["step"] for s in graphs[0]["recipe"]["preparation_steps"]] == [0, 1, 2]
+        assert graphs[1]["raman_files"][0]["url"] == "raman_3"
+        analyses = [v for v in graphs[1]["raman_files"][0].values() if isinstance(v, list)]
+        assert [len(a) for a in analyses] == [2]
@@ -0,0 +1,134 @@
+import os
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from gresq.util.fitting import FitCache, FitStream, fit_files, find_spectra
+
+
+class CountingFit:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, path):
+        self.calls.append(path)
+        with open(path, "rb") as f:
+            n = len(f.read())
+        return {"d": {"peak_shift": np.float64(n), "fwhm": 1}, "g": {"peak_shift": 2.5}}
+
+
+@pytest.fixture
+def spectra(tmp_path):
+    paths = []
+    for i, text in enumerate(["1 2\n3 4\n", "1 2\n3 4\n", "5 6\n"]):
+        path = tmp_path / ("spectrum_%s.txt" % i)
+        path.write_text(text)
+        paths.append(str(path))
+    return paths
+
+
+class TestFitCache:
+    def test_same_contents_fitted_once(self, tmp_path, spectra):
+        fit = CountingFit()
+        cache = FitCache(str(tmp_path / "fits"), fit=fit, version="1")
+        first = cache.fit(spectra[0])
+        assert cache.fit(spectra[1]) == first
+        assert cache.fit(spectra[2]) != first
+        assert len(fit.calls) == 2
+        assert cache.stats()["hits"] == 1
+        assert isinstance(first["d"]["fwhm"], float)
+
+    def test_results_persist_on_disk(self, tmp_path, spectra):
+        FitCache(str(tmp_path / "fits"), fit=CountingFit(), version="1").fit(spectra[0])
+        fit = CountingFit()
+        cache = FitCache(str(tmp_path / "fits"), fit=fit, version="1")
+        cache.fit(spectra[0])
+        assert fit.calls == []
+
+    def test_version_change_refits(self, tmp_path, spectra):
+        FitCache(str(tmp_path / "fits"), fit=CountingFit(), version="1").fit(spectra[0])
+        fit = CountingFit()
+        FitCache(str(tmp_path / "fits"), fit=fit, version="2").fit(spectra[0])
+        assert len(fit.calls) == 1
+
+    def test_returned_results_are_copies(self, tmp_path, spectra):
+        cache = FitCache(fit=CountingFit(), version="1")
+        cache.fit(spectra[0])["d"]["fwhm"] = -1
+        assert cache.fit(spectra[0])["d"]["fwhm"] == 1.0
+
+    def test_errors_are_not_cached(self, tmp_path, spectra):
+        def broken(path):
+            raise ValueError("cannot parse")
+
+        cache = FitCache(fit=broken, version="1")
+        with pytest.raises(ValueError):
+            cache.fit(spectra[0])
+        cache.fit_function = CountingFit()
+        assert cache.fit(spectra[0])["g"]["peak_shift"] == 2.5
+
+
+def fit_or_fail(path):
+    with open(path) as f:
+        text = f.read()
+    if "bad" in text:
+        raise ValueError("cannot parse")
+    return {"g": {"peak_shift": float(len(text))}}
+
+
+class TestFitFiles:
+    @pytest.fixture
+    def ingest(self, tmp_path):
+        for sample, spectra in [("s2", ["b", "a"]), ("s1", ["c"]), ("s3", ["bad"])]:
+            (tmp_path / sample).mkdir()
+            for name in spectra:
+                (tmp_path / sample / (name + ".txt")).write_text(name * 3)
+        (tmp_path / "s1" / "image.tif").write_text("")
+        return tmp_path
+
+    def test_find_spectra_is_sorted(self, ingest):
+        paths = find_spectra(str(ingest))
+        assert [os.path.relpath(p, str(ingest)) for p in paths] == [
+            os.path.join("s1", "c.txt"),
+            os.path.join("s2", "a.txt"),
+            os.path.join("s2", "b.txt"),
+            os.path.join("s3", "bad.txt"),
+        ]
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_results_in_order_with_errors(self, ingest, max_workers):
+        paths = find_spectra(str(ingest))
+        cache = FitCache(fit=fit_or_fail, version="1")
+        results = list(fit_files(paths, max_workers=max_workers, cache=cache))
+        assert [r.path for r in results] == paths
+        assert [r.error is None for r in results] == [True, True, True, False]
+        assert results[0].params == {"g": {"peak_shift": 3.0}}
+        assert cache.stats()["memory"] == 3
+
+    def test_stream_reports_errors(self, ingest):
+        paths = find_spectra(str(ingest))
+        stream = FitStream(paths, max_workers=2, cache=FitCache(fit=fit_or_fail, version="1"))
+        assert stream.get(paths[2]).error is None
+        stream.finish()
+        assert list(stream.errors) == [paths[3]]
+        assert [row[1] for row in stream.report()] == ["ok", "ok", "ok", "error"]
+
+    def test_stream_fits_other_files_with_its_cache(self, ingest):
+        paths = find_spectra(str(ingest))
+        cache = FitCache(fit=fit_or_fail, version="1")
+        stream = FitStream(paths[:1], max_workers=1, cache=cache)
+        assert stream.get(paths[1]).params == {"g": {"peak_shift": 3.0}}
+        assert cache.stats()["memory"] == 1
+        stream.close()
+
+    def test_pool_shutdown_without_cancel_futures(self, ingest, monkeypatch):
+        # shutdown() has no cancel_futures argument before Python 3.9.
+        shutdown = ProcessPoolExecutor.shutdown
+        monkeypatch.setattr(
+            ProcessPoolExecutor, "shutdown", lambda self, wait=True: shutdown(self, wait=wait)
+        )
+        paths = find_spectra(str(ingest))
+        cache = FitCache(fit=fit_or_fail, version="1")
+        assert len(list(fit_files(paths, max_workers=2, cache=cache))) == 4
+        # Closing the iterator early cancels the files not started yet.
+        results = fit_files(paths, max_workers=2, cache=FitCache(fit=fit_or_fail, version="1"))
+        assert next(results).path == paths[0]
+        results.close()
@@ -0,0 +1,75 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from gresq.util.http import HTTPClient, TransferAborted
+
+BODY = b"0123456789" * 10000
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        remaining = self.failures.get(self.path, 0)
+        if remaining > 0:
+            self.failures[self.path] = remaining - 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%s" % httpd.server_address[1]
+    httpd.shutdown()
+
+
+class TestHTTPClient:
+    def test_fetch(self, server):
+        client = HTTPClient()
+        assert client.fetch(server + "/a") == BODY
+
+    def test_retries_on_503(self, server):
+        Handler.failures["/flaky"] = 2
+        client = HTTPClient(retries=3, backoff_factor=0)
+        assert client.fetch(server + "/flaky") == BODY
+        assert Handler.failures["/flaky"] == 0
+
+    def test_download_is_atomic(self, server, tmp_path):
+        client = HTTPClient(chunk_size=1000)
+        path = str(tmp_path / "file")
+        assert client.download(server + "/a", path) == len(BODY)
+        with open(path, "rb") as f:
+            assert f.read() == BODY
+
+        chunks = []
+        with pytest.raises(TransferAborted):
+            client.download(
+                server + "/a",
+                str(tmp_path / "aborted"),
+                abort=lambda: chunks.append(1) or len(chunks) > 5,
+            )
+        assert os.listdir(str(tmp_path)) == ["file"]
+
+    def test_streamed_response_holds_host_slot(self, server):
+        client = HTTPClient(max_per_host=1)
+        r = client.get(server + "/a", stream=True)
+        semaphore = client._hostSemaphore(server)
+        assert not semaphore.acquire(blocking=False)
+        r.close()
+        assert semaphore.acquire(blocking=False)
+        semaphore.release()
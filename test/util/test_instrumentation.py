@@ -0,0 +1,90 @@
+import json
+import threading
+import pytest
+from sqlalchemy import text
+from gresq.util.instrumentation import StatementLog, origin, current_origin
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    engine = sqlite_engine
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE sample (id INTEGER PRIMARY KEY, name TEXT)"))
+        connection.execute(
+            text("INSERT INTO sample (id, name) VALUES (:id, :name)"),
+            [{"id": i, "name": "sample_%s" % i} for i in range(20)],
+        )
+    return engine
+
+
+def run(engine, sql, **params):
+    with engine.connect() as connection:
+        return connection.execute(text(sql), params).fetchall()
+
+
+class TestStatementLog:
+    def test_records_statements(self, engine):
+        log = StatementLog()
+        log.install(engine)
+        with origin("Widget.query"):
+            run(engine, "SELECT name FROM sample WHERE id = :id", id=3)
+        with pytest.raises(Exception):
+            run(engine, "SELECT missing FROM sample")
+        log.uninstall(engine)
+        run(engine, "SELECT 1")
+
+        entries = log.records()
+        assert len(entries) == 2
+        assert entries[0]["statement"] == "SELECT name FROM sample WHERE id = ?"
+        assert entries[0]["parameters"] == [3]
+        assert entries[0]["origin"] == "Widget.query"
+        assert entries[0]["elapsed_ms"] >= 0
+        assert entries[0]["error"] is None
+        assert "missing" in entries[1]["error"]
+
+    def test_origin_nesting_and_threads(self):
+        seen = []
+        with origin("Outer"):
+            with origin("inner"):
+                assert current_origin() == "Outer > inner"
+                captured = current_origin()
+            thread = threading.Thread(target=lambda: seen.append(current_origin()))
+            thread.start()
+            thread.join()
+        assert current_origin() is None
+        assert seen == [None]
+        with origin(captured):
+            assert current_origin() == "Outer > inner"
+
+    def test_ring_buffer_and_summary(self, engine):
+        log = StatementLog(max_entries=5)
+        log.install(engine)
+        for i in range(4):
+            run(engine, "SELECT name FROM sample WHERE id = :id", id=i)
+        for i in range(3):
+            run(engine, "SELECT count(*) FROM sample")
+        assert len(log.records()) == 5
+        assert log.count == 7
+        counts = {g["statement"]: g["count"] for g in log.summary()}
+        assert counts == {
+            "SELECT name FROM sample WHERE id = ?": 2,
+            "SELECT count(*) FROM sample": 3,
+        }
+
+    def test_explain_and_export(self, engine, tmp_path):
+        log = StatementLog(slow_ms=0)
+        log.install(engine)
+        run(engine, "SELECT name FROM sample WHERE id = :id", id=3)
+        entry = log.records()[0]
+        plan = log.explain(entry)
+        assert "sample" in plan
+        assert log.plans[entry["statement"]] == plan
+
+        path = str(tmp_path / "statements.json")
+        log.export(path)
+        with open(path) as f:
+            exported = json.load(f)
+        statements = [s["statement"] for s in exported["statements"]]
+        assert "SELECT name FROM sample WHERE id = ?" in statements
+        assert not any(k.startswith("_") for k in exported["statements"][0])
+        assert exported["summary"][0]["count"] >= 1
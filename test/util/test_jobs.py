@@ -0,0 +1,77 @@
+import time
+import threading
+import pytest
+from gresq.util.jobs import JobRunner
+
+
+def wait(app, jobs, timeout=60):
+    deadline = time.time() + timeout
+    while not all(job.done for job in jobs):
+        assert time.time() < deadline
+        app.processEvents()
+        time.sleep(0.01)
+
+
+def square_sum(n, context=None):
+    total = 0
+    for i in range(n):
+        context.check()
+        total += i * i
+        context.progress(i + 1)
+    return total
+
+
+def wait_for_cancel(started, context=None):
+    started.set()
+    while not context.cancelled():
+        time.sleep(0.01)
+    context.check()
+
+
+def fail():
+    raise ValueError("bad input")
+
+
+class TestJobRunner:
+    def test_thread_jobs(self, app):
+        runner = JobRunner(max_threads=2)
+        job = runner.submit(square_sum, args=(4,), thread=True)
+        progress, results = [], []
+        job.progress.connect(progress.append)
+        job.finished.connect(results.append)
+        wait(app, [job])
+        assert results == [14]
+        assert progress == [1, 2, 3, 4]
+        runner.shutdown()
+
+    def test_duplicates_share_a_job(self, app):
+        runner = JobRunner(max_threads=2)
+        started = threading.Event()
+        first = runner.submit(wait_for_cancel, args=(started,), key="same", thread=True)
+        assert runner.submit(wait_for_cancel, args=(started,), key="same", thread=True) is first
+        cancelled = []
+        first.cancelled.connect(lambda: cancelled.append(True))
+        started.wait(5)
+        first.cancel()
+        wait(app, [first])
+        assert cancelled == [True]
+        assert runner.runningJobs() == []
+        runner.shutdown()
+
+    def test_process_jobs(self, app):
+        runner = JobRunner(max_workers=1)
+        job = runner.submit(square_sum, args=(5,))
+        same = runner.submit(square_sum, args=(5,))
+        failing = runner.submit(fail)
+        progress, errors = [], []
+        job.progress.connect(progress.append)
+        failing.failed.connect(errors.append)
+        wait(app, [job, failing])
+        assert same is job
+        assert job.result == 30
+        assert "bad input" in errors[0]
+        # Progress from the worker arrives through the listener thread.
+        deadline = time.time() + 5
+        while len(progress) < 5 and time.time() < deadline:
+            app.processEvents()
+        runner.shutdown()
@@ -0,0 +1,54 @@
+import os
+import sys
+import pytest
+from PyQt5 import QtWidgets
+from gresq.util.lazy import LazyModule, LazyTab, StartupTimer, lazy_import, import_times
+
+
+@pytest.fixture
+def module_name(tmp_path, monkeypatch):
+    (tmp_path / "gresq_lazy_example.py").write_text("VALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield "gresq_lazy_example"
+    sys.modules.pop("gresq_lazy_example", None)
+
+
+class TestLazyImport:
+    def test_imported_on_first_use(self, module_name):
+        module = lazy_import(module_name)
+        assert isinstance(module, LazyModule)
+        assert module_name not in sys.modules
+        assert module.VALUE == 42
+        assert module_name in sys.modules
+        assert module_name in import_times
+
+    def test_already_imported(self):
+        assert lazy_import("os") is os
+
+
+class TestLazyTab:
+    def test_built_when_shown(self, app):
+        built = []
+        tab = LazyTab(lambda: QtWidgets.QLabel("results"))
+        tab.built.connect(built.append)
+        assert not tab.isBuilt()
+
+        tabs = QtWidgets.QTabWidget()
+        tabs.addTab(QtWidgets.QWidget(), "first")
+        tabs.addTab(tab, "second")
+        tabs.show()
+        app.processEvents()
+        assert not tab.isBuilt()
+
+        tabs.setCurrentWidget(tab)
+        app.processEvents()
+        assert tab.isBuilt()
+        assert built == [tab.widget()]
+        tabs.close()
+
+    def test_startup_phases(self):
+        timer = StartupTimer()
+        with timer.phase("imports"):
+            pass
+        timer.record("base imports", 0.5, 10)
+        assert [p[0] for p in timer.phases] == ["imports", "base imports"]
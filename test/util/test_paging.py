@@ -0,0 +1,141 @@
+import time
+import random
+import pytest
+from PyQt5 import QtCore
+from sqlalchemy import MetaData, Table, Column, Integer, Float
+from sqlalchemy.orm import Query
+from gresq.util.paging import PagedResultsTableModel, count_query
+
+metadata = MetaData()
+results = Table(
+    "results",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("temperature", Float),
+)
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    engine = sqlite_engine
+    metadata.create_all(engine)
+    rng = random.Random(0)
+    rows = []
+    for i in range(1, 1001):
+        # Repeated values and NULLs exercise the tie-breaking on id.
+        value = None if i % 7 == 0 else float(rng.randint(0, 50))
+        rows.append({"id": i, "temperature": value})
+    with engine.begin() as connection:
+        connection.execute(results.insert(), rows)
+    return engine, rows
+
+
+def wait(app, model, timeout=30):
+    deadline = time.time() + timeout
+    while model.pending:
+        assert time.time() < deadline
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def read_all(app, model):
+    wait(app, model)
+    rows = []
+    for page in range(len(model.boundaries)):
+        rows += model.pages[page]
+    while model.canFetchMore():
+        page = len(model.boundaries)
+        model.fetchMore()
+        wait(app, model)
+        rows += model.pages.get(page, [])
+    return rows
+
+
+class TestPagedResultsTableModel:
+    def test_pages_in_id_order(self, app, engine):
+        engine, rows = engine
+        model = PagedResultsTableModel(Query(list(results.c)), bind=engine, page_size=64)
+        assert model.rowCount() == 0
+        model.fetchMore()
+        # Rows are inserted when the page has been read in the background.
+        assert model.rowCount() == 0
+        wait(app, model)
+        assert model.rowCount() == 64
+        assert [r[0] for r in read_all(app, model)] == [r["id"] for r in rows]
+
+    @pytest.mark.parametrize("order", [QtCore.Qt.AscendingOrder, QtCore.Qt.DescendingOrder])
+    def test_sort_with_nulls(self, app, engine, order):
+        engine, rows = engine
+        model = PagedResultsTableModel(Query(list(results.c)), bind=engine, page_size=64)
+        model.sort(1, order)
+        ascending = order == QtCore.Qt.AscendingOrder
+        values = [r for r in rows if r["temperature"] is not None]
+        nulls = [r for r in rows if r["temperature"] is None]
+        expected = sorted(values, key=lambda r: (r["temperature"], r["id"]), reverse=not ascending)
+        expected += sorted(nulls, key=lambda r: r["id"], reverse=not ascending)
+        assert read_all(app, model) == [(r["id"], r["temperature"]) for r in expected]
+
+    def test_sort_after_a_page_was_read(self, app, engine):
+        engine, rows = engine
+        model = PagedResultsTableModel(Query(list(results.c)), bind=engine, page_size=64)
+        model.fetchMore()
+        # The task has run and been deleted, but its rows are not delivered yet.
+        model.pool.waitForDone()
+        model.sort(0, QtCore.Qt.DescendingOrder)
+        wait(app, model)
+        assert model.rowId(0) == rows[-1]["id"]
+        model.cancel()
+
+    def test_evicted_pages_are_read_again(self, app, engine):
+        engine, rows = engine
+        model = PagedResultsTableModel(
+            Query(list(results.c)), bind=engine, page_size=50, max_pages=3
+        )
+        model.sort(1, QtCore.Qt.DescendingOrder)
+        first = read_all(app, model)
+        assert len(model.pages) <= 3
+        changed = []
+        model.dataChanged.connect(lambda top, bottom: changed.append((top.row(), bottom.row())))
+        # Evicted pages are never read on the calling thread.
+        assert model.data(model.index(0, 1)) == model.placeholder
+        assert model.rowId(0) is None
+        wait(app, model)
+        assert changed == [(0, 49)]
+        assert model.rowId(0) == first[0][0]
+        assert model.value("temperature", 1) == first[1][1]
+        assert len(model.pages) <= 3
+        # Display strings are dropped with their page.
+        assert all(key[0] in model.pages for key in model.texts)
+
+    def test_failed_page(self, app, engine):
+        engine, rows = engine
+        model = PagedResultsTableModel(Query(list(results.c)), bind=engine, page_size=64)
+        errors = []
+        model.failed.connect(errors.append)
+        results.drop(engine)
+        model.fetchMore()
+        wait(app, model)
+        assert len(errors) == 1
+        assert model.rowCount() == 0
+        # A failure is not the end of the results, and stops further reads.
+        assert not model.exhausted
+        assert not model.canFetchMore()
+
+    def test_data_and_header(self, app, engine):
+        engine, rows = engine
+        model = PagedResultsTableModel(Query(list(results.c)), bind=engine)
+        model.fetchMore()
+        wait(app, model)
+        assert model.columnNames() == ["id", "temperature"]
+        assert model.headerData(1, QtCore.Qt.Horizontal) == "temperature"
+        assert model.data(model.index(6, 1)) == ""
+        assert model.data(model.index(0, 0)) == "1"
+        assert model.texts[(0, 0, 0)][:3] == ["1", "2", "3"]
+
+    def test_count_query(self, engine):
+        engine, rows = engine
+        q = Query(list(results.c)).filter(results.c.temperature.is_(None))
+        with engine.connect() as connection:
+            assert connection.execute(count_query(q).statement).scalar() == len(
+                [r for r in rows if r["temperature"] is None]
+            )
@@ -0,0 +1,144 @@
+import time
+import pytest
+from sqlalchemy.orm import Session
+from grdb.database import Base
+from grdb.database.models import SemFile, RamanFile
+from gresq.util import prefetch
+from gresq.util.io import DownloadRequest
+from gresq.util.prefetch import Prefetcher, neighbour_rows
+
+
+class FakeScheduler:
+    """Records submitted requests; the test finishes them."""
+
+    def __init__(self, threads=3):
+        self.threads = threads
+        self.requests = []
+
+    def maxThreadCount(self):
+        return self.threads
+
+    def submit(self, url, priority=None, warm=False):
+        request = DownloadRequest(url, priority=priority, warm=warm)
+        self.requests.append(request)
+        return request
+
+
+@pytest.fixture
+def assets(sqlite_engine, monkeypatch):
+    Base.metadata.create_all(sqlite_engine)
+    session = Session(bind=sqlite_engine)
+    for i in range(1, 6):
+        session.add(SemFile(experiment_id=i, url="sem%s" % i))
+        session.add(RamanFile(experiment_id=i, url="raman%s" % i))
+    session.commit()
+    session.close()
+    monkeypatch.setattr(prefetch, "read_session", lambda: Session(bind=sqlite_engine))
+
+
+def urls(scheduler):
+    return [r.url for r in scheduler.requests]
+
+
+def finish(request, nbytes):
+    request.finished[object, int, object].emit(nbytes, 0, {})
+
+
+def wait(app, scheduler, count, timeout=30):
+    deadline = time.time() + timeout
+    while len(scheduler.requests) < count:
+        assert time.time() < deadline
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def settle(app, prefetcher):
+    prefetcher.lookup_pool.waitForDone()
+    app.processEvents()
+
+
+class TestPrefetcher:
+    def test_neighbour_rows(self):
+        assert neighbour_rows(5, 2, 10) == [6, 4, 7, 3]
+        assert neighbour_rows(1, 3, 10) == [2, 0, 3, 4]
+        assert neighbour_rows(0, 3, 2) == [1]
+
+    def test_pending_downloads_are_capped(self, app, assets):
+        scheduler = FakeScheduler(threads=3)
+        prefetcher = Prefetcher(scheduler=scheduler)
+        prefetcher.prefetch([1, 2])
+        # One worker is left free for downloads the user asks for.
+        wait(app, scheduler, 2)
+        settle(app, prefetcher)
+        assert urls(scheduler) == ["sem1", "raman1"]
+        assert list(prefetcher.queue) == ["sem2", "raman2"]
+
+        # Newer requests go ahead of the ones still queued.
+        prefetcher.prefetch([3, 1])
+        settle(app, prefetcher)
+        assert len(scheduler.requests) == 2
+        finish(scheduler.requests[0], 10)
+        assert urls(scheduler) == ["sem1", "raman1", "sem3"]
+        assert list(prefetcher.queue) == ["raman3", "sem2", "raman2"]
+
+    def test_requested_experiments_are_skipped(self, app, assets):
+        scheduler = FakeScheduler()
+        prefetcher = Prefetcher(scheduler=scheduler, max_pending=10)
+        prefetcher.prefetch([1])
+        wait(app, scheduler, 2)
+        prefetcher.prefetch([1, 2])
+        wait(app, scheduler, 4)
+        settle(app, prefetcher)
+        assert urls(scheduler) == ["sem1", "raman1", "sem2", "raman2"]
+
+    def test_budget(self, app, assets):
+        scheduler = FakeScheduler()
+        prefetcher = Prefetcher(budget=100, scheduler=scheduler, max_pending=1)
+        prefetcher.prefetch([1, 2, 3])
+        wait(app, scheduler, 1)
+        finish(scheduler.requests[0], 60)
+        assert prefetcher.remaining() == 40
+        finish(scheduler.requests[1], 60)
+        assert prefetcher.remaining() == 0
+        assert len(scheduler.requests) == 2
+        assert len(prefetcher.queue) == 0
+
+        prefetcher.prefetch([4])
+        settle(app, prefetcher)
+        assert len(scheduler.requests) == 2
+
+    def test_reset_cancels_outstanding_prefetches(self, app, assets):
+        scheduler = FakeScheduler()
+        prefetcher = Prefetcher(budget=100, scheduler=scheduler, max_pending=1)
+        prefetcher.prefetch([1, 2])
+        wait(app, scheduler, 1)
+        finish(scheduler.requests[0], 100)
+        assert prefetcher.remaining() == 0
+
+        prefetcher.reset()
+        assert prefetcher.remaining() == 100
+        assert len(prefetcher.queue) == 0
+
+        prefetcher.prefetch([3])
+        wait(app, scheduler, 2)
+        running = scheduler.requests[1]
+        assert running.url == "sem3"
+        prefetcher.reset()
+        assert running.isCancelled()
+        assert prefetcher.pending == []
+        assert len(prefetcher.queue) == 0
+        # A late result for the replaced query does not count against the new budget.
+        finish(running, 50)
+        assert prefetcher.remaining() == 100
+
+    def test_lookup_of_a_replaced_query_is_dropped(self, app, assets):
+        scheduler = FakeScheduler()
+        prefetcher = Prefetcher(scheduler=scheduler)
+        prefetcher.prefetch([1, 2])
+        prefetcher.reset()
+        settle(app, prefetcher)
+        assert scheduler.requests == []
+        # Experiments of the old query can be prefetched again.
+        prefetcher.prefetch([1])
+        wait(app, scheduler, 2)
+        assert urls(scheduler) == ["sem1", "raman1"]
@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy.orm import Session
+from grdb.database import Base
+from grdb.database.models import (
+    Experiment,
+    Recipe,
+    PreparationStep,
+    RamanFile,
+    RamanAnalysis,
+    SemFile,
+)
+from gresq.util.preview import PreviewLoader, related
+from gresq.util.versions import bump_table_versions
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    engine = sqlite_engine
+    Base.metadata.create_all(engine)
+    session = Session(bind=engine)
+    for i in range(1, 11):
+        recipe = Recipe(id=i)
+        session.add(recipe)
+        session.add_all([PreparationStep(recipe_id=i, step=s) for s in range(3)])
+        session.add(Experiment(id=i, recipe_id=i))
+        session.add(RamanFile(id=i, experiment_id=i, url="raman_%s" % i))
+        session.add_all([RamanAnalysis(raman_file_id=i) for _ in range(2)])
+        session.add(SemFile(id=i, experiment_id=i, url="sem_%s" % i))
+    session.commit()
+    session.close()
+    return engine
+
+
+class TestPreviewLoader:
+    def test_batch_is_detached_and_complete(self, engine, count_statements):
+        loader = PreviewLoader(bind=engine)
+        statements = count_statements(engine)
+        previews = loader.load(range(1, 11))
+        batch = len(statements)
+        assert sorted(previews) == list(range(1, 11))
+
+        experiment = previews[3]
+        assert len(related(experiment.recipe, PreparationStep)) == 3
+        assert len(experiment.raman_files) == 1
+        assert len(related(experiment.raman_files[0], RamanAnalysis)) == 2
+        assert [s.url for s in experiment.sem_files] == ["sem_3"]
+        # Reading the detached graph did not query the database.
+        assert len(statements) == batch
+
+    def test_cache_and_invalidation(self, engine, count_statements):
+        loader = PreviewLoader(bind=engine)
+        first = loader.get(1)
+        statements = count_statements(engine)
+        assert loader.get(1) is first
+        assert not any("experiment" in s for s in statements)
+
+        session = Session(bind=engine)
+        bump_table_versions(session, [RamanFile.__table__])
+        session.close()
+        assert loader.get(1) is not first
+
+    def test_lru(self, engine):
+        loader = PreviewLoader(bind=engine, max_entries=3)
+        loader.load([1, 2, 3])
+        loader.get(1)
+        loader.get(4)
+        assert sorted(loader.cached(range(1, 11))) == [1, 3, 4]
@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy.orm import Session
+from grdb.database import Base
+from grdb.database.models import (
+    Experiment,
+    Recipe,
+    Substrate,
+    Furnace,
+    Properties,
+    PreparationStep,
+    RamanFile,
+    RamanAnalysis,
+    SemFile,
+    Author,
+)
+from gresq.util.query_builder import legacy_results_query, results_query, semi_join_filters
+
+
+@pytest.fixture
+def session(sqlite_engine):
+    Base.metadata.create_all(sqlite_engine)
+    session = Session(bind=sqlite_engine)
+    catalysts = {1: "Cu", 2: "Cu", 3: "Ni"}
+    for i in range(1, 4):
+        session.add(Recipe(id=i))
+        session.add(Substrate(id=i, catalyst=catalysts[i]))
+        session.add(Furnace(id=i))
+        session.add(Experiment(id=i, recipe_id=i, substrate_id=i, furnace_id=i, submitted_by=i))
+        session.add(Properties(experiment_id=i, growth_coverage=10.0 * i))
+        session.add_all(
+            [
+                Author(id=i, experiment_id=i, last_name="Author%s" % i),
+                Author(id=10 + i, experiment_id=i, last_name="Zhang"),
+            ]
+        )
+        session.add_all(
+            [
+                PreparationStep(recipe_id=i, step=0, name="Annealing", furnace_temperature=900.0),
+                PreparationStep(recipe_id=i, step=1, name="Growing", furnace_temperature=1000.0 * i),
+            ]
+        )
+        session.add_all([SemFile(experiment_id=i, filename="%s_%s.tif" % (i, s)) for s in range(2)])
+    # Experiment 1 has two Raman files with two analyses each, experiment 2 one analysis and
+    # experiment 3 none.
+    analyses = {1: [(0.2, 1.0), (0.4, 2.0), (0.6, 3.0), (0.8, 4.0)], 2: [(0.5, 0.5)]}
+    for i, values in analyses.items():
+        for f in range(2 if i == 1 else 1):
+            raman_file = RamanFile(experiment_id=i, filename="%s_%s.txt" % (i, f))
+            session.add(raman_file)
+            session.flush()
+            for d_to_g, gp_to_g in values[2 * f : 2 * f + 2]:
+                session.add(
+                    RamanAnalysis(raman_file_id=raman_file.id, d_to_g=d_to_g, gp_to_g=gp_to_g)
+                )
+    session.commit()
+    yield session
+    session.close()
+
+
+def ids(query):
+    return [row.id for row in query]
+
+
+class TestResultsQuery:
+    def test_one_row_per_experiment(self, session):
+        rows = results_query([], session=session).order_by(Experiment.id).all()
+        assert ids(rows) == [1, 2, 3]
+        assert rows[0].d_to_g == pytest.approx(0.5)
+        assert rows[0].gp_to_g == pytest.approx(2.5)
+        assert rows[1].d_to_g == pytest.approx(0.5)
+        assert rows[2].d_to_g is None
+        # The joined plan returns one row per Raman analysis and preparation step.
+        assert len(legacy_results_query([], session=session).all()) > 3
+
+    @pytest.mark.parametrize(
+        "filters",
+        [
+            [Substrate.catalyst == "Cu"],
+            [Properties.growth_coverage > 15],
+            [RamanAnalysis.d_to_g > 0.45],
+            [PreparationStep.furnace_temperature > 1500],
+            [Author.last_name == "Author2"],
+            [Author.last_name == "Zhang"],
+            [Substrate.catalyst == "Cu", RamanAnalysis.d_to_g > 0.7],
+            [Properties.growth_coverage < 25, PreparationStep.name == "Growing"],
+            [RamanAnalysis.d_to_g > 0.3, RamanAnalysis.gp_to_g < 1.5],
+            [PreparationStep.name == "Annealing", PreparationStep.furnace_temperature > 950],
+        ],
+    )
+    def test_same_experiments_as_legacy_plan(self, session, filters):
+        rows = ids(results_query(filters, session=session))
+        assert len(rows) == len(set(rows))
+        assert sorted(rows) == sorted(set(ids(legacy_results_query(filters, session=session))))
+
+    def test_filters_on_one_relationship_share_a_row(self, session):
+        filters = [RamanAnalysis.d_to_g > 0.3, RamanAnalysis.gp_to_g < 1.5]
+        clauses = semi_join_filters(filters)
+        assert len(clauses) == 1
+        # Experiment 1 has an analysis matching each filter but none matching both.
+        assert ids(results_query(filters, session=session)) == [2]
+
+    def test_direct_filters_are_kept(self, session):
+        filters = [Substrate.catalyst == "Cu", Author.last_name == "Zhang"]
+        clauses = semi_join_filters(filters)
+        assert len(clauses) == 2
+        assert clauses[0] is filters[0]
@@ -0,0 +1,92 @@
+import time
+import pytest
+from sqlalchemy import MetaData, Table, Column, Integer, String, text
+from sqlalchemy.orm import Query
+from gresq.util.query_engine import QueryEngine
+
+metadata = MetaData()
+samples = Table(
+    "engine_samples",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("material", String(32)),
+)
+
+# Runs for a long time on SQLite unless it is interrupted.
+slow_statement = text(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+    "SELECT count(*) FROM n"
+)
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    metadata.create_all(sqlite_engine)
+    with sqlite_engine.begin() as connection:
+        connection.execute(
+            samples.insert(),
+            [{"id": i, "material": "Copper" if i % 2 else "Nickel"} for i in range(1, 51)],
+        )
+    return sqlite_engine
+
+
+def record(query_engine):
+    events = []
+    query_engine.finished.connect(lambda g, df: events.append(("finished", g, len(df))))
+    query_engine.failed.connect(lambda g, e: events.append(("failed", g, e)))
+    query_engine.cancelled.connect(lambda g: events.append(("cancelled", g)))
+    return events
+
+
+def wait(app, query_engine, timeout=30):
+    deadline = time.time() + timeout
+    while query_engine.isRunning() or query_engine.pool.activeThreadCount() > 0:
+        assert time.time() < deadline
+        app.processEvents()
+        time.sleep(0.005)
+    app.processEvents()
+
+
+class TestQueryEngine:
+    def test_results_in_chunks(self, app, engine):
+        query_engine = QueryEngine(bind=engine, chunksize=20, cache=False)
+        events = record(query_engine)
+        progress = []
+        query_engine.progress.connect(lambda g, n: progress.append(n))
+        generation = query_engine.submit(Query([samples]).statement)
+        wait(app, query_engine)
+        assert events == [("finished", generation, 50)]
+        assert progress == [20, 40, 50]
+
+    def test_only_the_newest_generation_is_emitted(self, app, engine):
+        query_engine = QueryEngine(bind=engine, cache=False)
+        events = record(query_engine)
+        first = query_engine.submit(slow_statement)
+        second = query_engine.submit(
+            Query([samples]).filter(samples.c.material == "Copper").statement
+        )
+        assert second > first
+        assert not query_engine.isCurrent(first)
+        wait(app, query_engine)
+        assert [e for e in events if e[0] == "finished"] == [("finished", second, 25)]
+
+    def test_cancel_interrupts_the_statement(self, app, engine):
+        query_engine = QueryEngine(bind=engine, cache=False)
+        events = record(query_engine)
+        generation = query_engine.submit(slow_statement)
+        time.sleep(0.2)
+        query_engine.cancel()
+        wait(app, query_engine, timeout=10)
+        assert events == [("cancelled", generation)]
+
+    def test_cancel_after_the_task_ran(self, app, engine):
+        query_engine = QueryEngine(bind=engine, cache=False)
+        events = record(query_engine)
+        generation = query_engine.submit(Query([samples]).statement)
+        # The task has run and been deleted by the pool.
+        query_engine.pool.waitForDone()
+        query_engine.cancel()
+        wait(app, query_engine)
+        assert not query_engine.isCurrent(generation)
+        # The result was emitted before the cancel, so it is still delivered.
+        assert events == [("finished", generation, 50)]
@@ -0,0 +1,88 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import MetaData, Table, Column, Integer, Float, String, Boolean, Date, and_, or_
+from gresq.util.refine import filter_mask, narrowing_filters, refine_results
+
+metadata = MetaData()
+results = Table(
+    "results",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("temperature", Float),
+    Column("catalyst", String(32)),
+    Column("validated", Boolean),
+    Column("experiment_date", Date),
+    Column("pressure", Float),
+)
+c = results.c
+columns = {col: col.key for col in results.columns if col.key != "pressure"}
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "id": [1, 2, 3, 4, 5],
+            "temperature": [900.0, 1000.0, np.nan, 1050.0, 1100.0],
+            "catalyst": ["Copper", None, "Nickel", "Copper", "Platinum"],
+            "validated": [True, False, True, None, True],
+            "experiment_date": [datetime.date(2019, 1, d) for d in range(1, 6)],
+            "pressure": [1.0, 2.0, 3.0, 4.0, 5.0],
+        }
+    )
+
+
+def ids(df, clause):
+    mask = filter_mask(df, clause, columns)
+    assert mask is not None
+    return list(df["id"][mask])
+
+
+class TestFilterMask:
+    def test_comparisons_exclude_nulls(self, df):
+        assert ids(df, c.temperature > 1000) == [4, 5]
+        assert ids(df, c.temperature <= 1000) == [1, 2]
+        assert ids(df, c.temperature != 1000) == [1, 4, 5]
+        assert ids(df, c.catalyst == "Copper") == [1, 4]
+        assert ids(df, c.catalyst != "Copper") == [3, 5]
+
+    def test_null_and_boolean_tests(self, df):
+        assert ids(df, c.catalyst == None) == [2]
+        assert ids(df, c.catalyst.isnot(None)) == [1, 3, 4, 5]
+        assert ids(df, c.validated == True) == [1, 3, 5]
+        assert ids(df, c.validated.is_(False)) == [2]
+
+    def test_in_dates_and_boolean_clauses(self, df):
+        assert ids(df, c.catalyst.in_(["Nickel", "Platinum"])) == [3, 5]
+        assert ids(df, c.experiment_date >= datetime.date(2019, 1, 4)) == [4, 5]
+        assert ids(df, or_(c.validated == True, c.catalyst == "Copper")) == [1, 3, 4, 5]
+        assert ids(df, and_(c.validated == True, c.temperature > 950)) == [5]
+
+    def test_unsupported(self, df):
+        assert filter_mask(df, c.pressure > 2, columns) is None
+        assert filter_mask(df, c.catalyst.like("Cop%"), columns) is None
+        assert filter_mask(df, or_(c.pressure > 2, c.id > 1), columns) is None
+
+
+class TestRefineResults:
+    def test_narrowing(self, df):
+        base = [c.validated == True]
+        df = df[filter_mask(df, base[0], columns)]
+        refined = refine_results(df, base, base + [c.temperature > 950], columns)
+        assert list(refined["id"]) == [5]
+        # Filters rebuilt from the same inputs compare equal.
+        refined = refine_results(df, base, [c.temperature > 950, c.validated == True], columns)
+        assert list(refined["id"]) == [5]
+
+    def test_same_filters(self, df):
+        base = [c.validated == True]
+        df = df[filter_mask(df, base[0], columns)]
+        assert list(refine_results(df, base, [c.validated == True], columns)["id"]) == [1, 3, 5]
+
+    def test_widening_or_unsupported_falls_back(self, df):
+        base = [c.validated == True]
+        assert refine_results(df, base, [c.temperature > 950], columns) is None
+        assert refine_results(df, base, base + [c.pressure > 1], columns) is None
+        assert narrowing_filters(base, [c.validated == False]) is None
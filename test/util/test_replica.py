@@ -0,0 +1,135 @@
+import pytest
+from sqlalchemy.orm import Session
+from grdb.database import Base
+from grdb.database.models import Experiment, Recipe, PreparationStep
+from gresq.util.replica import (
+    Replica,
+    read_engine,
+    read_session_scope,
+    set_active_replica,
+)
+from gresq.util.versions import (
+    create_versions_table,
+    bump_table_versions,
+    changed_tables,
+    current_versions,
+)
+
+
+def make_primary(engine, versions=True):
+    Base.metadata.create_all(engine)
+    if versions:
+        create_versions_table(engine)
+    session = Session(bind=engine)
+    for i in range(1, 6):
+        session.add(Recipe(id=i))
+        session.add_all([PreparationStep(recipe_id=i, step=s) for s in range(2)])
+        session.add(Experiment(id=i, recipe_id=i, validated=False))
+    session.commit()
+    session.close()
+    return engine
+
+
+@pytest.fixture
+def primary(sqlite_engine):
+    return make_primary(sqlite_engine)
+
+
+class TestReplica:
+    def test_first_sync_copies_everything(self, primary, tmp_path):
+        replica = Replica(str(tmp_path / "replica.db"), primary=primary)
+        assert not replica.isReady()
+        copied = replica.sync()
+        assert copied["experiment"] == 5
+        assert copied["preparation_step"] == 10
+        assert replica.isReady()
+        assert replica.state()["experiment"]["rows"] == 5
+        assert current_versions(replica.engine) == current_versions(primary)
+
+        set_active_replica(replica)
+        try:
+            assert read_engine() is replica.engine
+            with read_session_scope() as session:
+                assert session.query(Experiment).count() == 5
+        finally:
+            set_active_replica(None)
+
+    def test_only_changed_tables_are_read(self, primary, tmp_path):
+        replica = Replica(str(tmp_path / "replica.db"), primary=primary)
+        replica.sync()
+        assert replica.sync() == {}
+
+        session = Session(bind=primary)
+        session.query(Experiment).filter(Experiment.id == 2).update({"validated": True})
+        bump_table_versions(session, [Experiment.__table__])
+        session.commit()
+        session.close()
+
+        assert replica.sync() == {"experiment": 5}
+        session = Session(bind=replica.engine)
+        assert [e.id for e in session.query(Experiment).filter(Experiment.validated)] == [2]
+        session.close()
+        assert current_versions(replica.engine) == current_versions(primary)
+
+    def test_inserted_rows_are_pulled(self, primary, tmp_path):
+        replica = Replica(str(tmp_path / "replica.db"), primary=primary)
+        replica.sync()
+
+        session = Session(bind=primary)
+        session.add(Recipe(id=6))
+        session.add(Experiment(id=6, recipe_id=6, validated=False))
+        inserted, changed = changed_tables(session)
+        assert (inserted, changed) == (["experiment", "recipe"], [])
+        bump_table_versions(session, changed, inserted=inserted)
+        session.commit()
+        session.close()
+
+        assert replica.sync() == {"experiment": 1, "recipe": 1}
+        session = Session(bind=replica.engine)
+        assert sorted(e.id for e in session.query(Experiment)) == list(range(1, 7))
+        session.close()
+
+        session = Session(bind=primary)
+        session.delete(session.query(Experiment).get(6))
+        session.add(Recipe(id=7))
+        inserted, changed = changed_tables(session)
+        assert (inserted, changed) == (["recipe"], ["experiment"])
+        bump_table_versions(session, changed, inserted=inserted)
+        session.commit()
+        session.close()
+
+        assert replica.sync() == {"experiment": 5, "recipe": 1}
+        assert current_versions(replica.engine) == current_versions(primary)
+
+    def test_id_high_water_mark_without_versions(self, sqlite_engine, tmp_path):
+        primary = make_primary(sqlite_engine, versions=False)
+        replica = Replica(str(tmp_path / "replica.db"), primary=primary)
+        replica.sync()
+
+        session = Session(bind=primary)
+        session.add(Recipe(id=6))
+        session.query(PreparationStep).filter(PreparationStep.recipe_id == 1).delete()
+        session.commit()
+        session.close()
+
+        copied = replica.sync()
+        assert copied["recipe"] == 1
+        assert copied["experiment"] == 0
+        session = Session(bind=replica.engine)
+        assert sorted(r.id for r in session.query(Recipe)) == list(range(1, 7))
+        assert session.query(PreparationStep).count() == 8
+        session.close()
+
+        # Updates made by this process are seen through its local counters.
+        session = Session(bind=primary)
+        session.query(Experiment).filter(Experiment.id == 3).update({"validated": True})
+        bump_table_versions(session, [Experiment.__table__])
+        session.commit()
+        session.close()
+
+        copied = replica.sync()
+        assert copied["experiment"] == 5
+        assert copied["recipe"] == 0
+        session = Session(bind=replica.engine)
+        assert [e.id for e in session.query(Experiment).filter(Experiment.validated)] == [3]
+        session.close()
@@ -0,0 +1,88 @@
+import pytest
+import pandas as pd
+from sqlalchemy import MetaData, Table, Column, Integer, String
+from sqlalchemy.orm import Query, Session
+from gresq.util.result_cache import ResultCache, statement_key, statement_tables
+from gresq.util.versions import bump_table_versions, create_versions_table
+
+metadata = MetaData()
+samples = Table(
+    "cache_samples",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("material", String(32)),
+)
+others = Table("cache_others", metadata, Column("id", Integer, primary_key=True))
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    engine = sqlite_engine
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            samples.insert(),
+            [{"id": i, "material": "Copper" if i % 2 else "Nickel"} for i in range(1, 101)],
+        )
+    create_versions_table(engine)
+    return engine
+
+
+def material_query(material):
+    return Query([samples]).filter(samples.c.material == material).statement
+
+
+class TestResultCache:
+    def test_key_includes_parameters(self, engine):
+        assert statement_key(material_query("Copper"), engine) == statement_key(
+            material_query("Copper"), engine
+        )
+        assert statement_key(material_query("Copper"), engine) != statement_key(
+            material_query("Nickel"), engine
+        )
+
+    def test_statement_tables(self):
+        inner = Query([others.c.id]).subquery()
+        statement = Query([samples]).filter(samples.c.id.in_(Query([inner.c.id]))).statement
+        assert statement_tables(statement) == ["cache_others", "cache_samples"]
+
+    def test_hit_and_invalidation(self, engine):
+        cache = ResultCache()
+        with engine.connect() as connection:
+            first = cache.read(material_query("Copper"), connection)
+            second = cache.read(material_query("Copper"), connection)
+        assert second is first
+        assert cache.stats()["hits"] == 1
+
+        session = Session(bind=engine)
+        bump_table_versions(session, [others])
+        session.commit()
+        assert cache.get(material_query("Copper"), engine) is first
+
+        bump_table_versions(session, [samples])
+        session.commit()
+        session.close()
+        assert cache.get(material_query("Copper"), engine) is None
+
+    def test_memory_budget(self, engine):
+        small = pd.DataFrame({"a": range(100)})
+        nbytes = int(small.memory_usage(index=True, deep=True).sum())
+        cache = ResultCache(max_bytes=2 * nbytes)
+        versions = cache.snapshot(material_query("Copper"), engine)
+        for material in ("Copper", "Nickel", "Platinum"):
+            cache.put(material_query(material), engine, small.copy(), versions)
+        assert cache.stats()["entries"] == 2
+        assert cache.get(material_query("Copper"), engine) is None
+        assert cache.get(material_query("Platinum"), engine) is not None
+
+        cache.put(material_query("Tungsten"), engine, pd.DataFrame({"a": range(1000)}), versions)
+        assert cache.get(material_query("Tungsten"), engine) is None
+
+    def test_not_cached_without_table_versions(self, sqlite_engine):
+        metadata.create_all(sqlite_engine)
+        cache = ResultCache()
+        with sqlite_engine.connect() as connection:
+            first = cache.read(material_query("Copper"), connection)
+            second = cache.read(material_query("Copper"), connection)
+        assert second is not first
+        assert cache.stats()["entries"] == 0
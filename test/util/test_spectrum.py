@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+from gresq.util.spectrum import (
+    parse_spectrum,
+    save_spectrum,
+    load_spectrum,
+    load_spectra,
+    SpectrumStore,
+)
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+
+
+class TestParseSpectrum:
+    def test_csv_with_header(self):
+        spectrum = parse_spectrum(os.path.join(DATA, "test_raman.csv"))
+        assert spectrum.shape[1] == 2
+        assert spectrum[0, 0] == pytest.approx(1034.8926)
+        assert spectrum[0, 1] == pytest.approx(229)
+
+    def test_tab_separated_crlf(self):
+        data = b"672.79272\t8.2226219\r\n673.5\t9.0\r\n674.25\t10.5\r\n"
+        spectrum = parse_spectrum(data)
+        np.testing.assert_allclose(
+            spectrum, [[672.79272, 8.2226219], [673.5, 9.0], [674.25, 10.5]]
+        )
+
+    def test_malformed_rows_are_dropped(self):
+        data = b"x\ty\n1 2\n3\n4,5,6\nfoo bar\n7 8\n"
+        np.testing.assert_allclose(parse_spectrum(data), [[1, 2], [4, 5], [7, 8]])
+
+    def test_ragged_numeric_rows(self):
+        data = b"100 1\n200 2 3\n300\n400 4\n"
+        np.testing.assert_allclose(parse_spectrum(data), [[100, 1], [200, 2], [400, 4]])
+
+    def test_no_data(self):
+        with pytest.raises(ValueError):
+            parse_spectrum(b"wavenumber,intensity\n")
+
+
+class TestBinaryFormat:
+    def test_round_trip_mmap(self, tmp_path):
+        spectrum = parse_spectrum(b"1,2\n3,4\n")
+        path = str(tmp_path / "s.npy")
+        save_spectrum(path, spectrum)
+        loaded = load_spectrum(path)
+        assert isinstance(loaded, np.memmap)
+        assert loaded.dtype == np.float32
+        np.testing.assert_allclose(loaded, spectrum)
+
+    def test_store_parses_once(self, tmp_path):
+        store = SpectrumStore(str(tmp_path))
+        data = b"1\t2\n3\t4\n"
+        first = store.fromBytes(data)
+        assert len(os.listdir(str(tmp_path))) == 1
+        second = store.fromBytes(data)
+        np.testing.assert_allclose(first, second)
+        assert len(os.listdir(str(tmp_path))) == 1
+
+
+class TestLoadSpectra:
+    def test_shared_axis_is_stacked(self):
+        a = np.array([[1, 10], [2, 20], [3, 30]], dtype=float)
+        b = np.array([[1, 11], [2, 21], [3, 31]], dtype=float)
+        x, y = load_spectra([a, b])
+        np.testing.assert_allclose(x, [1, 2, 3])
+        assert y.shape == (2, 3)
+        np.testing.assert_allclose(y[1], [11, 21, 31])
+
+    def test_different_axes_are_interpolated(self):
+        a = np.array([[0, 0], [2, 2], [4, 4]], dtype=float)
+        b = np.array([[3, 1], [2, 2], [1, 3]], dtype=float)
+        x, y = load_spectra([a, b])
+        np.testing.assert_allclose(x, [0, 1, 2, 3, 4])
+        np.testing.assert_allclose(y[0], [0, 1, 2, 3, 4])
+        np.testing.assert_allclose(y[1], [np.nan, 3, 2, 1, np.nan])
+
+    def test_ingest_files(self):
+        directory = os.path.join(DATA, "SEM_Raman_Data", "KZPd_170928-4")
+        paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(".txt")]
+        x, y = load_spectra(paths)
+        assert y.shape == (len(paths), x.size)
@@ -0,0 +1,116 @@
+import pytest
+from sqlalchemy.orm import Session
+from grdb.database import Base
+from grdb.database.models import (
+    Experiment,
+    Recipe,
+    Substrate,
+    Furnace,
+    Properties,
+    PreparationStep,
+    RamanFile,
+    RamanAnalysis,
+)
+from gresq.util.query_builder import referenced_tables, results_query
+from gresq.util.summary import (
+    experiment_summary,
+    create_summary_table,
+    delete_experiment_summary,
+    rebuild_experiment_summary,
+    refresh_experiment_summary,
+    summary_results_query,
+)
+
+
+def add_experiment(session, i, catalyst="Cu", d_to_g=(0.5,)):
+    session.add(Recipe(id=i))
+    session.add(Substrate(id=i, catalyst=catalyst))
+    session.add(Furnace(id=i))
+    session.add(Experiment(id=i, recipe_id=i, substrate_id=i, furnace_id=i))
+    session.add(Properties(experiment_id=i, growth_coverage=10.0 * i))
+    session.add_all(
+        [
+            PreparationStep(recipe_id=i, step=0, furnace_temperature=900.0, helium_flow_rate=1.0),
+            PreparationStep(recipe_id=i, step=1, furnace_temperature=1000.0 + i),
+        ]
+    )
+    raman_file = RamanFile(id=i, experiment_id=i)
+    session.add(raman_file)
+    session.add_all([RamanAnalysis(raman_file_id=i, d_to_g=v) for v in d_to_g])
+    session.flush()
+
+
+@pytest.fixture
+def session(sqlite_engine):
+    Base.metadata.create_all(sqlite_engine)
+    create_summary_table(sqlite_engine)
+    session = Session(bind=sqlite_engine)
+    for i in range(1, 4):
+        add_experiment(session, i, catalyst="Cu" if i < 3 else "Ni", d_to_g=(0.1 * i, 0.3))
+    rebuild_experiment_summary(session)
+    session.commit()
+    yield session
+    session.close()
+
+
+def summary_rows(session):
+    q = session.query(experiment_summary).order_by(experiment_summary.c.id)
+    return [dict(r._asdict()) for r in q]
+
+
+def assert_matches_rebuild(session):
+    incremental = summary_rows(session)
+    rebuild_experiment_summary(session)
+    assert incremental == summary_rows(session)
+
+
+class TestExperimentSummary:
+    def test_rebuild(self, session):
+        rows = summary_rows(session)
+        assert [r["id"] for r in rows] == [1, 2, 3]
+        assert rows[0]["catalyst"] == "Cu"
+        assert rows[0]["d_to_g"] == pytest.approx(0.2)
+        assert rows[2]["maximum_temperature"] == pytest.approx(1003.0)
+        assert rows[2]["uses_helium"]
+
+    def test_refresh_after_insert(self, session):
+        add_experiment(session, 4, d_to_g=(0.7,))
+        refresh_experiment_summary(session, [4])
+        assert [r["id"] for r in summary_rows(session)] == [1, 2, 3, 4]
+        assert_matches_rebuild(session)
+
+    def test_refresh_after_update(self, session):
+        session.query(Substrate).filter(Substrate.id == 2).update({"catalyst": "Pt"})
+        session.add(RamanAnalysis(raman_file_id=2, d_to_g=1.0))
+        session.add(PreparationStep(recipe_id=2, step=2, furnace_temperature=1500.0))
+        session.flush()
+        refresh_experiment_summary(session, [2])
+        row = summary_rows(session)[1]
+        assert row["catalyst"] == "Pt"
+        assert row["maximum_temperature"] == pytest.approx(1500.0)
+        assert_matches_rebuild(session)
+
+    def test_delete(self, session):
+        session.query(RamanAnalysis).filter(RamanAnalysis.raman_file_id == 3).delete()
+        session.query(RamanFile).filter(RamanFile.id == 3).delete()
+        session.query(Properties).filter(Properties.experiment_id == 3).delete()
+        session.query(Experiment).filter(Experiment.id == 3).delete()
+        delete_experiment_summary(session, [3])
+        assert [r["id"] for r in summary_rows(session)] == [1, 2]
+        assert_matches_rebuild(session)
+
+    def test_filters_are_translated(self, session):
+        filters = [Substrate.catalyst == "Cu", Properties.growth_coverage > 15]
+        q = summary_results_query(filters, session=session)
+        for clause in q.whereclause.get_children():
+            assert referenced_tables(clause) == {experiment_summary}
+        assert [r.id for r in q] == [2]
+        assert [r.id for r in results_query(filters, session=session)] == [2]
+
+    def test_one_to_many_filters_are_correlated(self, session):
+        filters = [Substrate.catalyst == "Cu", RamanAnalysis.d_to_g < 0.15]
+        q = summary_results_query(filters, session=session)
+        assert [r.id for r in q] == [1]
+
+    def test_unmaterialized_filter(self, session):
+        assert summary_results_query([Recipe.carbon_source == "CH4"]) is None
@@ -0,0 +1,101 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from PyQt5 import QtCore
+from gresq.util.util import ResultsTableModel, DisplayCache
+
+
+def cell_text(df, i, j):
+    value = df.iloc[i, j]
+    return "" if pd.isnull(value) else str(value)
+
+
+@pytest.fixture
+def df():
+    n = 2500
+    rng = np.random.RandomState(0)
+    floats = rng.uniform(0, 1000, n)
+    floats[::5] = np.nan
+    return pd.DataFrame(
+        {
+            "id": np.arange(n),
+            "temperature": floats,
+            "name": [None if i % 3 == 0 else "Copper %s" % i for i in range(n)],
+            "date": pd.to_datetime(
+                [datetime.date(2018, 1, 1) + datetime.timedelta(days=i % 400) for i in range(n)]
+            ),
+            "flag": [i % 2 == 0 for i in range(n)],
+            "features": [("a", "b")[: i % 3] for i in range(n)],
+        }
+    )
+
+
+class TestDisplayCache:
+    def test_matches_cell_formatting(self, df):
+        cache = DisplayCache(df, block_size=100)
+        for i in (0, 1, 99, 100, 1234, len(df) - 1):
+            for j in range(df.shape[1]):
+                assert cache.text(i, j) == cell_text(df, i, j)
+
+    def test_blocks_are_formatted_once(self, df):
+        cache = DisplayCache(df, block_size=100)
+        cache.text(5, 1)
+        cache.text(50, 1)
+        cache.text(150, 1)
+        assert set(cache.blocks) == {(1, 0), (1, 1)}
+
+
+class TestResultsTableModel:
+    def test_data_follows_sort(self, df):
+        model = ResultsTableModel()
+        model.setDataFrame(df)
+        before = model.data(model.index(0, 1))
+        model.sort(1, QtCore.Qt.DescendingOrder)
+        expected = df.sort_values(by="temperature", ascending=False, kind="stable")
+        for i in range(0, len(df), 250):
+            assert model.data(model.index(i, 1)) == cell_text(expected, i, 1)
+            assert model.rowId(i) == expected["id"].iloc[i]
+        assert model.data(model.index(0, 1)) != before
+        # The DataFrame itself is not reordered.
+        assert model.df is df
+
+    def test_permutations_are_cached(self, df):
+        model = ResultsTableModel()
+        model.setDataFrame(df)
+        model.sort(2, QtCore.Qt.AscendingOrder)
+        first = model.order
+        model.sort(2, QtCore.Qt.DescendingOrder)
+        model.sort(2, QtCore.Qt.AscendingOrder)
+        assert model.order is first
+
+    def test_stable_multi_column_sort(self, df):
+        model = ResultsTableModel()
+        model.setDataFrame(df)
+        model.sort(4, QtCore.Qt.AscendingOrder)
+        model.sort(3, QtCore.Qt.DescendingOrder)
+        assert model.sort_keys == [(3, False), (4, True)]
+        expected = df.sort_values(
+            by=["date", "flag"], ascending=[False, True], kind="stable"
+        )
+        assert [model.rowId(i) for i in range(len(df))] == list(expected["id"])
+
+        model.sortBy([(2, True), (0, False)])
+        expected = df.sort_values(by=["name", "id"], ascending=[True, False], kind="stable")
+        assert [model.rowId(i) for i in range(len(df))] == list(expected["id"])
+
+    def test_selection_follows_rows(self, df):
+        model = ResultsTableModel()
+        model.setDataFrame(df)
+        current = QtCore.QPersistentModelIndex(model.index(10, 0))
+        model.sort(1, QtCore.Qt.AscendingOrder)
+        assert model.rowId(current.row()) == 10
+        model.sortBy([])
+        assert current.row() == 10
+
+    def test_copy_drops_fields(self, df):
+        model = ResultsTableModel()
+        model.setDataFrame(df)
+        model.header_mapper = {c: c for c in df.columns}
+        copied = model.copy(fields=["id", "name"])
+        assert copied.data(copied.index(1, 1)) == "Copper 1"
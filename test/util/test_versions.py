@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy.orm import Session
+from gresq.util.versions import (
+    create_versions_table,
+    bump_table_versions,
+    current_versions,
+    versions_available,
+)
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    return sqlite_engine
+
+
+class TestTableVersions:
+    def test_local_counters_without_table(self, engine):
+        assert not versions_available(engine, refresh=True)
+        before = current_versions(engine, ["experiment"])
+        session = Session(bind=engine)
+        bump_table_versions(session, ["experiment"])
+        session.close()
+        assert current_versions(engine, ["experiment"]) != before
+
+    def test_database_counters(self, engine):
+        create_versions_table(engine)
+        assert versions_available(engine)
+        before = current_versions(engine, ["experiment", "recipe"])
+        other = current_versions(engine, ["furnace"])
+
+        session = Session(bind=engine)
+        bump_table_versions(session, ["experiment", "new_table"])
+        session.commit()
+        session.close()
+
+        assert current_versions(engine, ["experiment", "recipe"]) != before
+        assert current_versions(engine, ["furnace"]) == other
+        assert current_versions(engine, ["new_table"])["new_table"][0] == 1
+
+    def test_all_tables(self, engine):
+        create_versions_table(engine)
+        before = current_versions(engine, ["furnace"])
+        session = Session(bind=engine)
+        bump_table_versions(session)
+        session.rollback()
+        session.close()
+        # Rolled back in the database, but this process still treats it as a change.
+        after = current_versions(engine, ["furnace"])
+        assert after != before
+        assert after["*"][0] == before["*"][0]
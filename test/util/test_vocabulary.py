@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+from gresq.util.versions import create_versions_table, bump_table_versions
+from gresq.util.vocabulary import Vocabulary, read_vocabulary, string_columns
+
+VocabularyBase = declarative_base()
+
+
+class Sample(VocabularyBase):
+    __tablename__ = "vocabulary_sample"
+    id = Column(Integer, primary_key=True)
+    catalyst = Column(String(32))
+    gas = Column(String(32))
+    pressure = Column(Float)
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    engine = sqlite_engine
+    VocabularyBase.metadata.create_all(engine)
+    session = Session(bind=engine)
+    session.add_all(
+        [
+            Sample(catalyst="Copper", gas="Argon", pressure=1.0),
+            Sample(catalyst="Nickel", gas="Argon", pressure=2.0),
+            Sample(catalyst="Copper", gas=None, pressure=3.0),
+        ]
+    )
+    session.commit()
+    session.close()
+    create_versions_table(engine)
+    return engine
+
+
+class TestVocabulary:
+    def test_string_columns(self):
+        columns = string_columns(Sample, ["id", "catalyst", "gas", "pressure", "missing"])
+        assert [c.key for c in columns] == ["catalyst", "gas"]
+
+    def test_single_round_trip(self, engine, count_statements):
+        statements = count_statements(engine)
+        values = read_vocabulary(engine, string_columns(Sample, ["catalyst", "gas"]))
+        assert len(statements) == 1
+        assert values == {
+            "vocabulary_sample.catalyst": ["Copper", "Nickel"],
+            "vocabulary_sample.gas": ["Argon"],
+        }
+
+    def test_file_cache_and_update(self, engine, tmp_path, count_statements):
+        path = str(tmp_path / "vocabulary.json")
+        columns = string_columns(Sample, ["catalyst", "gas"])
+        Vocabulary(bind=engine, path=path).load(columns)
+
+        vocabulary = Vocabulary(bind=engine, path=path)
+        statements = count_statements(engine)
+        vocabulary.load(columns)
+        assert not any("vocabulary_sample" in s for s in statements)
+        assert vocabulary.values(Sample.catalyst) == ["Copper", "Nickel"]
+        assert not vocabulary.update()
+
+        session = Session(bind=engine)
+        session.add(Sample(catalyst="Platinum", gas="Hydrogen"))
+        bump_table_versions(session, ["vocabulary_sample"])
+        session.commit()
+        session.close()
+
+        updated = []
+        vocabulary.updated.connect(lambda: updated.append(True))
+        assert vocabulary.update()
+        assert updated == [True]
+        assert vocabulary.values(Sample.catalyst) == ["Copper", "Nickel", "Platinum"]
+        assert vocabulary.values(Sample.gas) == ["Argon", "Hydrogen"]